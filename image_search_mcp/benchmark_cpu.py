@@ -0,0 +1,93 @@
+"""
+PLIP图像特征提取CPU性能基准
+在当前主机上测量不同 线程数 / int8量化 / channels-last / 推理后端 组合的吞吐（images/s），
+并报告与fp32基线特征的漂移（余弦相似度）
+
+用法:
+    python benchmark_cpu.py --threads 1 2 4 --batch_size 16
+"""
+import argparse
+import os
+import time
+
+import torch
+
+import plip_model
+from plip_model import ONNX_PATH, TORCHSCRIPT_PATH, PLIPFeatureExtractor, configure_threads
+
+
+def _sample_images(n_images: int, images_dir: str = None):
+    """基准图片：指定目录下的图片，未指定时使用随机图像"""
+    if images_dir:
+        plip_model.CALIBRATION_DIR = images_dir
+    extractor = PLIPFeatureExtractor(device="cpu", image_backend="torch", quantize=False, channels_last=False)
+    pixels = extractor._calibration_pixels(max_images=n_images)
+    return extractor, pixels
+
+
+def _throughput(extractor, pixels: torch.Tensor, batch_size: int, repeats: int) -> float:
+    """预热一个批次后，重复提取 repeats 轮，返回 images/s"""
+    extractor._image_features(pixels[:batch_size])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(pixels), batch_size):
+            extractor._image_features(pixels[i:i + batch_size])
+    return repeats * len(pixels) / (time.perf_counter() - start)
+
+
+def run_benchmark(threads, batch_size: int = 16, n_images: int = 32, repeats: int = 3, images_dir: str = None):
+    """
+    依次测量各配置的吞吐
+
+    Args:
+        threads: 要测量的intra-op线程数列表
+        batch_size: 每次前向的图像数
+        n_images: 基准图像数
+        repeats: 重复轮数
+        images_dir: 基准图片目录（None时使用随机图像）
+    """
+    baseline, pixels = _sample_images(n_images, images_dir)
+    reference = baseline._image_features(pixels)
+    print(f"主机CPU核数: {os.cpu_count()}，基准图像 {len(pixels)} 张，批大小 {batch_size}\n")
+
+    settings = [("fp32", "torch", False, False), ("fp32+channels_last", "torch", False, True)]
+    settings += [("int8", "torch", True, False), ("int8+channels_last", "torch", True, True)]
+    if os.path.exists(TORCHSCRIPT_PATH):
+        settings.append(("torchscript", "torchscript", False, False))
+    if os.path.exists(ONNX_PATH):
+        settings.append(("onnx", "onnx", False, False))
+
+    print(f"{'配置':22s} {'线程':>4s} {'images/s':>10s} {'平均余弦':>9s} {'最小余弦':>9s}")
+    for name, backend, quantize, channels_last in settings:
+        if (backend, quantize, channels_last) == ("torch", False, False):
+            extractor = baseline
+        else:
+            extractor = PLIPFeatureExtractor(
+                device="cpu", image_backend=backend, quantize=quantize, channels_last=channels_last
+            )
+        cosine = (reference * extractor._image_features(pixels)).sum(axis=1)
+        for n in threads:
+            configure_threads(n)
+            ips = _throughput(extractor, pixels, batch_size, repeats)
+            print(f"{name:22s} {n:4d} {ips:10.1f} {cosine.mean():9.4f} {cosine.min():9.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PLIP图像特征提取CPU性能基准")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4],
+                        help="要测量的intra-op线程数（默认: 1 2 4）")
+    parser.add_argument("--batch_size", type=int, default=16, help="批大小（默认: 16）")
+    parser.add_argument("--n_images", type=int, default=32, help="基准图像数（默认: 32）")
+    parser.add_argument("--repeats", type=int, default=3, help="重复轮数（默认: 3）")
+    parser.add_argument("--images_dir", type=str, default=None, help="基准图片目录（默认使用随机图像）")
+
+    args = parser.parse_args()
+
+    try:
+        run_benchmark(args.threads, args.batch_size, args.n_images, args.repeats, args.images_dir)
+    except KeyboardInterrupt:
+        print("\n\n基准测试被用户中断")
+    except Exception as e:
+        print(f"\n错误: {e}")
+        import traceback
+        traceback.print_exc()
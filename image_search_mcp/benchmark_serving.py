@@ -0,0 +1,169 @@
+"""
+多进程服务负载均衡基准
+依次以不同worker数启动 serve_multi.py，用多个并发MCP客户端调用 search_similar_cases，
+报告吞吐（QPS）、延迟分位数、各worker分到的请求数以及内存占用（RSS合计 vs PSS合计），
+用于确认吞吐随核数近似线性增长、且没有产生N份模型和图谱
+
+用法:
+    python benchmark_serving.py --workers 1 2 4 --clients 16 --requests 400
+"""
+import argparse
+import asyncio
+import base64
+import io
+import os
+import subprocess
+import sys
+import time
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+# 与 serve_multi.py / server.py 的默认端口一致
+PORT = 18930
+# 等待服务启动（含父进程预加载模型）的超时时间（秒）
+STARTUP_TIMEOUT = 600
+
+
+def _payloads(n: int, images_dir: str = None) -> List[str]:
+    """查询图片（Base64 PNG）：指定目录下的图片，未指定时使用随机图像"""
+    images = []
+    if images_dir:
+        for root, _, files in os.walk(images_dir):
+            images.extend(os.path.join(root, f) for f in sorted(files)
+                          if f.lower().endswith((".png", ".jpg", ".jpeg", ".tif", ".tiff")))
+        images = [Image.open(p).convert("RGB") for p in images[:n]]
+    if not images:
+        rng = np.random.default_rng(0)
+        images = [Image.fromarray(rng.integers(0, 255, (224, 224, 3), dtype=np.uint8)) for _ in range(n)]
+
+    payloads = []
+    for image in images:
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        payloads.append(base64.b64encode(buf.getvalue()).decode())
+    return payloads
+
+
+async def _wait_ready(port: int, n_workers: int):
+    """等待代理端口可用且所有worker进程存活"""
+    import httpx
+
+    deadline = time.perf_counter() + STARTUP_TIMEOUT
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                stats = (await client.get(f"http://127.0.0.1:{port}/workers")).json()
+                if sum(w["alive"] for w in stats["workers"]) == n_workers:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"服务在 {STARTUP_TIMEOUT} s 内未就绪")
+            await asyncio.sleep(1.0)
+
+
+async def _client_loop(url: str, payloads: List[str], n_requests: int, latencies: List[float], errors: List[str]):
+    from fastmcp import Client
+
+    async with Client(url) as client:
+        # 预热：第一次调用触发worker上的懒加载（ChromaDB连接、分类器等），不计入统计
+        await client.call_tool("search_similar_cases", {"query_image": payloads[0], "top_k": 5})
+        for i in range(n_requests):
+            start = time.perf_counter()
+            try:
+                await client.call_tool(
+                    "search_similar_cases",
+                    {"query_image": payloads[i % len(payloads)], "top_k": 5}
+                )
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(str(e))
+
+
+async def _measure(port: int, n_workers: int, n_clients: int, n_requests: int, payloads: List[str]) -> dict:
+    import httpx
+
+    await _wait_ready(port, n_workers)
+    latencies, errors = [], []
+    per_client = max(1, n_requests // n_clients)
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        _client_loop(f"http://127.0.0.1:{port}/sse", payloads, per_client, latencies, errors)
+        for _ in range(n_clients)
+    ])
+    elapsed = time.perf_counter() - start
+
+    async with httpx.AsyncClient() as client:
+        stats = (await client.get(f"http://127.0.0.1:{port}/workers")).json()
+    # 内存合计包含持有共享模型的父进程
+    processes = stats["workers"] + [stats["proxy"]]
+
+    lat_ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "workers": n_workers,
+        "qps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(lat_ms, 50)),
+        "p95_ms": float(np.percentile(lat_ms, 95)),
+        "errors": len(errors),
+        "per_worker": [w["requests"] for w in stats["workers"]],
+        "rss_mb": sum(p.get("rss_mb", 0) for p in processes),
+        "pss_mb": sum(p.get("pss_mb", 0) for p in processes)
+    }
+
+
+def run_benchmark(worker_counts: List[int], n_clients: int, n_requests: int, port: int, images_dir: str = None):
+    """
+    依次以不同worker数启动服务并压测
+
+    Args:
+        worker_counts: 要测量的worker数列表
+        n_clients: 并发客户端数
+        n_requests: 每轮总请求数
+        port: 压测使用的对外端口
+        images_dir: 查询图片目录（None时使用随机图像）
+    """
+    payloads = _payloads(32, images_dir)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve_multi.py")
+    results = []
+    for n in worker_counts:
+        print(f"\n启动 {n} 个worker...")
+        proc = subprocess.Popen(
+            [sys.executable, script, "--workers", str(n), "--port", str(port)],
+            stdout=subprocess.DEVNULL,
+            env={**os.environ, "IMAGE_SEARCH_WORKER_PORT": str(port + 1)}
+        )
+        try:
+            results.append(asyncio.run(_measure(port, n, n_clients, n_requests, payloads)))
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    base_qps = results[0]["qps"] if results else 0
+    print(f"\n{'workers':>7s} {'QPS':>8s} {'加速比':>6s} {'p50(ms)':>8s} {'p95(ms)':>8s} {'错误':>4s} "
+          f"{'RSS合计(MB)':>11s} {'PSS合计(MB)':>11s}  各worker消息数")
+    for r in results:
+        speedup = r["qps"] / base_qps if base_qps else 0
+        print(f"{r['workers']:7d} {r['qps']:8.1f} {speedup:6.2f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+              f"{r['errors']:4d} {r['rss_mb']:11.1f} {r['pss_mb']:11.1f}  {r['per_worker']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多进程服务负载均衡基准")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="要测量的worker数（默认: 1 2 4）")
+    parser.add_argument("--clients", type=int, default=16, help="并发客户端数（默认: 16）")
+    parser.add_argument("--requests", type=int, default=400, help="每轮总请求数（默认: 400）")
+    parser.add_argument("--port", type=int, default=PORT + 100, help=f"压测使用的端口（默认: {PORT + 100}）")
+    parser.add_argument("--images_dir", type=str, default=None, help="查询图片目录（默认使用随机图像）")
+
+    args = parser.parse_args()
+
+    try:
+        run_benchmark(args.workers, args.clients, args.requests, args.port, args.images_dir)
+    except KeyboardInterrupt:
+        print("\n\n基准测试被用户中断")
+    except Exception as e:
+        print(f"\n错误: {e}")
+        import traceback
+        traceback.print_exc()
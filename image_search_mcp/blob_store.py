@@ -0,0 +1,230 @@
+"""
+本地内容寻址的图片暂存区（blob store）
+大图片不再以Base64字符串放在每次工具调用的JSON里，而是先上传到服务器本地，
+之后各搜索工具通过句柄 blob:<sha256> 引用
+
+- 分块上传：每块直接写入临时文件的对应偏移，单次请求的内存占用只与块大小有关；
+  提交时流式计算SHA-256，同内容只保存一份
+- 总容量超过上限时按最近访问时间淘汰；超时未提交的上传自动清理
+- 多进程部署（serve_multi.py）时各worker共用同一个目录
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import uuid
+from typing import BinaryIO, Optional
+
+BLOB_PREFIX = "blob:"
+# 暂存区目录
+BLOB_STORE_PATH = os.getenv("BLOB_STORE_PATH", "./blob_store")
+# 暂存区容量上限（字节）
+BLOB_STORE_MAX_BYTES = int(os.getenv("BLOB_STORE_MAX_BYTES", str(10 * 2 ** 30)))
+# 单个图片的大小上限（字节）
+MAX_BLOB_BYTES = int(os.getenv("BLOB_MAX_BYTES", str(2 * 2 ** 30)))
+# 单个分块的大小上限（字节）
+MAX_CHUNK_BYTES = 8 * 2 ** 20
+# 未提交上传的过期时间（秒）
+UPLOAD_TTL = 3600
+# 流式读写的缓冲区大小
+COPY_BUFFER = 2 ** 20
+
+_SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+_UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def is_blob_handle(value: str) -> bool:
+    return value.startswith(BLOB_PREFIX)
+
+
+class BlobStore:
+    """内容寻址的文件暂存区"""
+
+    def __init__(self, root: str = BLOB_STORE_PATH, max_bytes: int = BLOB_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(root, "objects")
+        self.uploads_dir = os.path.join(root, "uploads")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _upload_path(self, upload_id: str) -> str:
+        if not _UPLOAD_ID_PATTERN.match(upload_id or ""):
+            raise ValueError(f"无效的上传ID: {upload_id}")
+        return os.path.join(self.uploads_dir, upload_id + ".part")
+
+    def path(self, handle: str) -> str:
+        """句柄对应的本地文件路径（同时刷新访问时间，用于LRU淘汰）"""
+        digest = handle[len(BLOB_PREFIX):] if is_blob_handle(handle) else handle
+        if not _SHA256_PATTERN.match(digest):
+            raise ValueError(f"无效的图片句柄: {handle}")
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"图片句柄不存在或已被清理: {handle}，请重新上传")
+        os.utime(path)
+        return path
+
+    # ---------- 分块上传 ----------
+
+    def begin_upload(self) -> str:
+        """创建上传会话，返回上传ID"""
+        self.cleanup_uploads()
+        upload_id = uuid.uuid4().hex
+        open(self._upload_path(upload_id), "wb").close()
+        return upload_id
+
+    def write_chunk(self, upload_id: str, offset: int, data: bytes) -> int:
+        """
+        把一个分块写入上传会话的指定偏移（重传同一分块是幂等的）
+
+        Returns:
+            当前已写入的文件大小
+        """
+        if len(data) > MAX_CHUNK_BYTES:
+            raise ValueError(f"分块过大: {len(data)} 字节（上限 {MAX_CHUNK_BYTES}）")
+        if offset < 0 or offset + len(data) > MAX_BLOB_BYTES:
+            raise ValueError(f"分块偏移超出范围（单个图片上限 {MAX_BLOB_BYTES} 字节）")
+        path = self._upload_path(upload_id)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"上传会话不存在或已过期: {upload_id}")
+        with open(path, "r+b") as f:
+            f.seek(offset)
+            f.write(data)
+            f.seek(0, os.SEEK_END)
+            return f.tell()
+
+    def commit_upload(self, upload_id: str, expected_sha256: Optional[str] = None) -> dict:
+        """
+        完成上传：计算SHA-256并移入内容寻址目录
+
+        Args:
+            upload_id: 上传ID
+            expected_sha256: 客户端计算的SHA-256（可选，不一致时报错）
+
+        Returns:
+            {"handle", "sha256", "size"}
+        """
+        path = self._upload_path(upload_id)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"上传会话不存在或已过期: {upload_id}")
+        with open(path, "rb") as f:
+            digest = _sha256_file(f)
+        if expected_sha256 and expected_sha256.lower() != digest:
+            os.remove(path)
+            raise ValueError(f"SHA-256校验失败: 期望 {expected_sha256}，实际 {digest}，请重新上传")
+        return self._store(path, digest)
+
+    def abort_upload(self, upload_id: str):
+        path = self._upload_path(upload_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    # ---------- 流式写入 ----------
+
+    def writer(self) -> "BlobWriter":
+        """流式写入器（HTTP上传使用），边写边计算SHA-256"""
+        return BlobWriter(self, self._upload_path(uuid.uuid4().hex))
+
+    def _store(self, tmp_path: str, digest: str) -> dict:
+        target = self._object_path(digest)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            # 相同内容已存在，只保留一份
+            os.remove(tmp_path)
+            os.utime(target)
+        else:
+            os.replace(tmp_path, target)
+        size = os.path.getsize(target)
+        self.evict()
+        return {"handle": BLOB_PREFIX + digest, "sha256": digest, "size": size}
+
+    # ---------- 清理 ----------
+
+    def evict(self):
+        """总容量超过上限时按最近访问时间淘汰"""
+        with self._lock:
+            entries = []
+            total = 0
+            for sub in os.scandir(self.objects_dir):
+                if not sub.is_dir():
+                    continue
+                for entry in os.scandir(sub.path):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def cleanup_uploads(self, ttl: float = UPLOAD_TTL):
+        """删除超时未提交的上传"""
+        now = time.time()
+        for entry in os.scandir(self.uploads_dir):
+            try:
+                if now - entry.stat().st_mtime > ttl:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+class BlobWriter:
+    """把字节流写入暂存区的临时文件，commit时移入内容寻址目录"""
+
+    def __init__(self, store: BlobStore, tmp_path: str):
+        self.store = store
+        self.tmp_path = tmp_path
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        self._file = open(tmp_path, "wb")
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > MAX_BLOB_BYTES:
+            raise ValueError(f"图片过大（上限 {MAX_BLOB_BYTES} 字节）")
+        self._hasher.update(data)
+        self._file.write(data)
+
+    def commit(self) -> dict:
+        self._file.close()
+        if self.size == 0:
+            self.abort()
+            raise ValueError("上传内容为空")
+        return self.store._store(self.tmp_path, self._hasher.hexdigest())
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def _sha256_file(f: BinaryIO) -> str:
+    hasher = hashlib.sha256()
+    for block in iter(lambda: f.read(COPY_BUFFER), b""):
+        hasher.update(block)
+    return hasher.hexdigest()
+
+
+_store: Optional[BlobStore] = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """获取全局暂存区实例"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BlobStore()
+    return _store
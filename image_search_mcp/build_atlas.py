@@ -1,19 +1,199 @@
 """
 从NCT-CRC-HE-100K数据集构建迷你图谱
-随机抽取每个类别的样本图片，构建用于测试的图谱库
+从每个类别抽取样本图片，构建用于测试的图谱库
+
+抽样方式（--sampling）:
+- random: 随机抽取（默认）
+- kmeans: 多样性抽样。分批提取候选图块的PLIP特征，每个类别做mini-batch k-means
+          （聚类数 = 抽取数），每个簇保留离中心最近的图块，常见形态不再挤占名额；
+          同时与同样数量的随机抽样比较覆盖度，写入 coverage_report.json
+
+放置方式（--mode）:
+- copy:     复制文件（默认，与源数据集完全独立）
+- hardlink: 硬链接（同一文件系统内不占用额外空间，跨文件系统时回退为复制）
+- reflink:  写时复制克隆（btrfs / XFS等支持时，否则回退为复制）
+- manifest: 不复制任何文件，只写清单，indexer.py --manifest 直接读取源数据集中的图片
+
+所有方式都会在目标目录写入清单 manifest.jsonl（每行 {"path", "diagnosis", "filename", "source"}）
 """
 import os
+import json
 import shutil
 import random
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from clustering import assign_clusters, minibatch_kmeans
+
+# NCT-CRC-HE-100K的9个类别（类别代码 -> 英文组织描述，描述也用于零样本分类的文本提示）
+NCT_CRC_CATEGORIES = {
+    "ADI": "adipose tissue",                     # Adipose - 脂肪组织
+    "BACK": "background",                        # Background - 背景
+    "DEB": "debris and necrosis",                # Debris - 坏死碎片
+    "LYM": "lymphocytes",                        # Lymphocytes - 淋巴细胞
+    "MUC": "mucus",                              # Mucus - 粘液
+    "MUS": "smooth muscle",                      # Muscle - 平滑肌
+    "NORM": "normal colon mucosa",               # Normal - 正常粘膜
+    "STR": "cancer-associated stroma",           # Stroma - 肿瘤基质
+    "TUM": "colorectal adenocarcinoma epithelium",  # Tumor - 腺癌上皮
+}
+
+SUPPORTED_FORMATS = ('.tif', '.tiff', '.jpg', '.jpeg', '.png')
+PLACEMENT_MODES = ("copy", "hardlink", "reflink", "manifest")
+SAMPLING_METHODS = ("random", "kmeans")
+# 多样性抽样时每批提取特征的图片数
+EMBED_BATCH_SIZE = 64
+# 多样性抽样时每个类别最多提取特征的候选数（超过时先随机抽取候选）
+MAX_CANDIDATES = 5000
+# 覆盖度：候选图块与最近的入选图块余弦相似度不低于该值时视为被覆盖
+COVERAGE_THRESHOLD = 0.9
+# 覆盖度报告文件名
+COVERAGE_REPORT_NAME = "coverage_report.json"
+# 图谱清单文件名
+MANIFEST_NAME = "manifest.jsonl"
+# 并行复制/链接的线程数（I/O密集，可高于CPU核数）
+IO_WORKERS = 16
+# Linux FICLONE ioctl（reflink）
+_FICLONE = 0x40049409
+
+
+def iter_images(directory: str) -> Iterator[os.DirEntry]:
+    """流式列出目录中的图片文件（scandir不为每个文件额外stat）"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(SUPPORTED_FORMATS) and entry.is_file():
+                yield entry
+
+
+def _reflink(src: str, dst: str):
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def place_file(src: str, dst: str, mode: str) -> str:
+    """
+    按放置方式把源文件放到目标路径，链接失败时回退为复制
+
+    Returns:
+        实际使用的方式（copy / hardlink / reflink / exists）
+    """
+    if os.path.exists(dst):
+        return "exists"
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+    elif mode == "reflink":
+        try:
+            _reflink(src, dst)
+            return "reflink"
+        except (OSError, ImportError):
+            if os.path.exists(dst):
+                os.remove(dst)
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def write_manifest(path: str, records: List[dict]):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_manifest(path: str) -> List[dict]:
+    """读取图谱清单，相对路径按清单所在目录解析"""
+    base = os.path.dirname(os.path.abspath(path))
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record["path"] = os.path.join(base, record["path"])
+            records.append(record)
+    return records
+
+
+def _embed_images(paths: List[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """分批提取图片的PLIP特征（归一化）"""
+    from plip_model import get_extractor
+
+    extractor = get_extractor()
+    features = []
+    for start in range(0, len(paths), batch_size):
+        features.append(extractor.extract_features_batch(paths[start:start + batch_size]))
+    return np.concatenate(features).astype(np.float32)
+
+
+def select_diverse(features: np.ndarray, n: int, seed: Optional[int] = 0) -> np.ndarray:
+    """
+    多样性抽样：k-means聚为n簇，每簇取离中心最近的样本；空簇导致不足n个时，
+    依次补入与已选样本最不相似的样本（n 超过样本数时返回全部样本）
+
+    Returns:
+        入选样本下标（升序，不重复）
+    """
+    n = min(n, len(features))
+    if n == len(features):
+        return np.arange(n, dtype=np.int64)
+    centroids = minibatch_kmeans(features, n, seed=seed)
+    labels = assign_clusters(features, centroids)
+    selected = []
+    for c in range(len(centroids)):
+        members = np.flatnonzero(labels == c)
+        if len(members):
+            selected.append(int(members[(features[members] @ centroids[c]).argmax()]))
+
+    if len(selected) < n:
+        closest = (features @ features[selected].T).max(axis=1)
+        closest[selected] = np.inf
+        while len(selected) < n:
+            pick = int(closest.argmin())
+            selected.append(pick)
+            closest = np.maximum(closest, features @ features[pick])
+            closest[pick] = np.inf
+    return np.sort(np.asarray(selected, dtype=np.int64))
+
+
+def coverage(features: np.ndarray, selected: np.ndarray, threshold: float = COVERAGE_THRESHOLD) -> dict:
+    """
+    入选样本对全部候选的覆盖度
+
+    Returns:
+        mean_similarity: 候选与最近入选样本的平均余弦相似度
+        p5_similarity: 覆盖最差的5%候选的相似度
+        covered: 相似度不低于阈值的候选比例
+    """
+    nearest = np.empty(len(features), dtype=np.float32)
+    chosen = features[selected]
+    for start in range(0, len(features), 8192):
+        nearest[start:start + 8192] = (features[start:start + 8192] @ chosen.T).max(axis=1)
+    return {
+        "mean_similarity": round(float(nearest.mean()), 4),
+        "p5_similarity": round(float(np.percentile(nearest, 5)), 4),
+        "covered": round(float((nearest >= threshold).mean()), 4)
+    }
 
 
 def build_mini_atlas(
     source_dir: str,
     target_dir: str = "./atlas_data",
     categories: list = None,
-    images_per_category: int = 20
+    images_per_category: int = 20,
+    mode: str = "copy",
+    workers: int = IO_WORKERS,
+    seed: Optional[int] = None,
+    sampling: str = "random",
+    max_candidates: int = MAX_CANDIDATES
 ):
     """
     从源数据集构建迷你图谱
@@ -22,38 +202,39 @@ def build_mini_atlas(
         source_dir: NCT-CRC-HE-100K数据集目录
         target_dir: 目标图谱目录
         categories: 要抽取的类别列表，None时使用默认类别
-        images_per_category: 每个类别抽取的图片数量
+        images_per_category: 每个类别抽取的图片数量（0表示全部）
+        mode: 放置方式 copy / hardlink / reflink / manifest
+        workers: 并行复制/链接的线程数
+        seed: 随机种子（None时每次抽样不同）
+        sampling: 抽样方式 random / kmeans
+        max_candidates: kmeans抽样时每个类别最多提取特征的候选数（小于抽样数时按抽样数）
     """
     source_path = Path(source_dir)
     target_path = Path(target_dir)
     
     if not source_path.exists():
         raise ValueError(f"源数据集目录不存在: {source_dir}")
+    if mode not in PLACEMENT_MODES:
+        raise ValueError(f"不支持的放置方式: {mode}，可选: {', '.join(PLACEMENT_MODES)}")
+    if sampling not in SAMPLING_METHODS:
+        raise ValueError(f"不支持的抽样方式: {sampling}，可选: {', '.join(SAMPLING_METHODS)}")
     
     # 默认类别（NCT-CRC-HE-100K的9个类别）
     if categories is None:
-        categories = [
-            "ADI",   # Adipose - 脂肪组织
-            "BACK",  # Background - 背景
-            "DEB",   # Debris - 坏死碎片
-            "LYM",   # Lymphocytes - 淋巴细胞
-            "MUC",   # Mucus - 粘液
-            "MUS",   # Muscle - 平滑肌
-            "NORM",  # Normal - 正常粘膜
-            "STR",   # Stroma - 肿瘤基质
-            "TUM",   # Tumor - 腺癌上皮
-        ]
+        categories = list(NCT_CRC_CATEGORIES)
     
+    rng = random.Random(seed)
     print(f"源数据集目录: {source_dir}")
-    print(f"目标图谱目录: {target_dir}")
-    print(f"每个类别抽取 {images_per_category} 张图片")
+    print(f"目标图谱目录: {target_dir}（放置方式: {mode}）")
+    print(f"每个类别抽取 {images_per_category or '全部'} 张图片（抽样方式: {sampling}）")
     print()
     
     # 创建目标目录
     target_path.mkdir(parents=True, exist_ok=True)
     
-    total_copied = 0
-    
+    records = []
+    jobs = []
+    coverage_report = {}
     for cat in categories:
         cat_source = source_path / cat
         cat_target = target_path / cat
@@ -66,50 +247,112 @@ def build_mini_atlas(
             print(f"⚠️  警告: {cat_source} 不是目录，跳过")
             continue
         
-        # 创建目标分类文件夹
-        cat_target.mkdir(parents=True, exist_ok=True)
-        
-        # 获取所有图片文件
-        supported_formats = ('.tif', '.tiff', '.jpg', '.jpeg', '.png')
-        all_images = [
-            f for f in os.listdir(cat_source)
-            if f.lower().endswith(supported_formats)
-        ]
+        # 获取所有图片文件（排序保证同一随机种子抽样结果可复现）
+        all_images = sorted(entry.name for entry in iter_images(str(cat_source)))
         
         if not all_images:
             print(f"⚠️  警告: {cat} 类别中没有找到图片文件")
             continue
         
-        # 随机抽取
-        n_samples = min(len(all_images), images_per_category)
-        selected_images = random.sample(all_images, n_samples)
+        n_samples = min(len(all_images), images_per_category) if images_per_category else len(all_images)
+        if sampling == "kmeans" and n_samples < len(all_images):
+            # 多样性抽样
+            candidates = all_images
+            # 候选数不少于抽样数
+            n_candidates = max(max_candidates, n_samples)
+            if len(candidates) > n_candidates:
+                candidates = sorted(rng.sample(all_images, n_candidates))
+            print(f"  {cat}: 正在提取 {len(candidates)} 个候选图块的特征...")
+            features = _embed_images([str(cat_source / img) for img in candidates])
+            chosen = select_diverse(features, n_samples, seed=seed)
+            selected_images = [candidates[i] for i in chosen]
+            baseline = np.sort(np.asarray(rng.sample(range(len(candidates)), n_samples), dtype=np.int64))
+            coverage_report[cat] = {
+                "candidates": len(candidates),
+                "selected": n_samples,
+                "kmeans": coverage(features, chosen),
+                "random": coverage(features, baseline)
+            }
+        else:
+            # 随机抽取
+            selected_images = sorted(rng.sample(all_images, n_samples))
         
-        # 复制文件
-        copied_count = 0
+        if mode != "manifest":
+            cat_target.mkdir(parents=True, exist_ok=True)
         for img in selected_images:
             src_file = cat_source / img
             dst_file = cat_target / img
-            
+            if mode == "manifest":
+                path = os.path.abspath(src_file)
+            else:
+                jobs.append((str(src_file), str(dst_file)))
+                path = os.path.join(cat, img)
+            records.append({"path": path, "diagnosis": cat, "filename": img, "source": "Internal Atlas"})
+        
+        print(f"✅ {cat:6s}: 从 {len(all_images):4d} 张中抽取 {n_samples:3d} 张")
+        if cat in coverage_report:
+            km, rnd = coverage_report[cat]["kmeans"], coverage_report[cat]["random"]
+            print(f"   覆盖度（相似度≥{COVERAGE_THRESHOLD}的候选比例）: kmeans {km['covered']:.1%} vs 随机 {rnd['covered']:.1%}，"
+                  f"平均最近相似度 {km['mean_similarity']:.3f} vs {rnd['mean_similarity']:.3f}")
+    
+    # 复制/链接在线程池中并行执行（文件I/O会释放GIL）
+    placed = {}
+    failed = set()
+    if jobs:
+        def _place(job):
             try:
-                shutil.copy2(src_file, dst_file)
-                copied_count += 1
+                return place_file(job[0], job[1], mode)
             except Exception as e:
-                print(f"  错误: 复制 {img} 失败: {e}")
+                print(f"  错误: 放置 {job[0]} 失败: {e}")
+                failed.add(job[1])
+                return "failed"
         
-        print(f"✅ {cat:6s}: 从 {len(all_images):4d} 张中抽取 {copied_count:3d} 张")
-        total_copied += copied_count
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for method in pool.map(_place, jobs):
+                placed[method] = placed.get(method, 0) + 1
+        failed_paths = {os.path.relpath(p, target_path) for p in failed}
+        records = [r for r in records if r["path"] not in failed_paths]
+    
+    manifest_path = target_path / MANIFEST_NAME
+    write_manifest(str(manifest_path), records)
+    if coverage_report:
+        _summarize_coverage(coverage_report)
+        with open(target_path / COVERAGE_REPORT_NAME, "w", encoding="utf-8") as f:
+            json.dump(coverage_report, f, indent=2, ensure_ascii=False)
     
     print()
     print("=" * 60)
-    print(f"✅ 迷你图谱构建完成！")
-    print(f"   总计: {total_copied} 张图片")
+    print("✅ 迷你图谱构建完成！")
+    print(f"   总计: {len(records)} 张图片")
+    if placed:
+        print("   放置方式: " + "，".join(f"{k} {v}" for k, v in sorted(placed.items())))
     print(f"   目录: {target_dir}")
+    print(f"   清单: {manifest_path}")
+    if coverage_report:
+        overall = coverage_report["overall"]
+        print(f"   覆盖度: kmeans {overall['kmeans']['covered']:.1%} vs 随机 {overall['random']['covered']:.1%}"
+              f"（详见 {target_path / COVERAGE_REPORT_NAME}）")
     print()
     print("下一步: 运行 indexer.py 构建索引")
-    print(f"   python indexer.py --atlas_dir {target_dir}")
+    if mode == "manifest":
+        print(f"   python indexer.py --manifest {manifest_path}")
+    else:
+        print(f"   python indexer.py --atlas_dir {target_dir}  （或 --manifest {manifest_path}）")
     print("=" * 60)
 
 
+def _summarize_coverage(report: dict):
+    """按候选数加权汇总各类别的覆盖度，写入 report["overall"]"""
+    total = sum(r["candidates"] for r in report.values())
+    overall = {"candidates": total, "selected": sum(r["selected"] for r in report.values())}
+    for method in ("kmeans", "random"):
+        overall[method] = {
+            key: round(sum(r[method][key] * r["candidates"] for r in report.values()) / total, 4)
+            for key in ("mean_similarity", "p5_similarity", "covered")
+        }
+    report["overall"] = overall
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="从NCT-CRC-HE-100K数据集构建迷你图谱"
@@ -130,7 +373,7 @@ if __name__ == "__main__":
         "--images_per_category",
         type=int,
         default=20,
-        help="每个类别抽取的图片数量（默认: 20）"
+        help="每个类别抽取的图片数量（默认: 20，0表示全部）"
     )
     parser.add_argument(
         "--categories",
@@ -139,6 +382,38 @@ if __name__ == "__main__":
         default=None,
         help="要抽取的类别列表（默认: 所有9个类别）"
     )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        default="copy",
+        choices=PLACEMENT_MODES,
+        help="放置方式: copy / hardlink / reflink / manifest（只写清单，不复制）（默认: copy）"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=IO_WORKERS,
+        help=f"并行复制/链接的线程数（默认: {IO_WORKERS}）"
+    )
+    parser.add_argument(
+        "--sampling",
+        type=str,
+        default="random",
+        choices=SAMPLING_METHODS,
+        help="抽样方式: random / kmeans（多样性抽样，需要PLIP模型）（默认: random）"
+    )
+    parser.add_argument(
+        "--max_candidates",
+        type=int,
+        default=MAX_CANDIDATES,
+        help=f"kmeans抽样时每个类别最多提取特征的候选数（默认: {MAX_CANDIDATES}）"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="抽样随机种子（默认: 不固定）"
+    )
     
     args = parser.parse_args()
     
@@ -147,7 +422,12 @@ if __name__ == "__main__":
             source_dir=args.source_dir,
             target_dir=args.target_dir,
             categories=args.categories,
-            images_per_category=args.images_per_category
+            images_per_category=args.images_per_category,
+            mode=args.mode,
+            workers=args.workers,
+            seed=args.seed,
+            sampling=args.sampling,
+            max_candidates=args.max_candidates
         )
     except KeyboardInterrupt:
         print("\n\n构建被用户中断")
@@ -0,0 +1,245 @@
+"""
+在线新增病例：预写日志（WAL）和增量索引
+
+- 新确诊病例的特征和元数据先以一行JSON追加到 wal.jsonl 并 fsync，写入成功即视为持久化
+- 增量索引（DeltaIndex）保存尚未合并进主索引的病例，查询时与主索引一起搜索；
+  写时复制，查询读取不可变的快照，不加锁
+- 各进程（serve_multi.py 的多个worker）共用同一个日志文件，按文件偏移读取新追加的记录；
+  追加与压缩后的重写通过文件锁互斥，压缩时日志被替换为新文件，读取方发现inode变化后从头读取
+- 后台压缩把增量合并进主索引后，从日志中删除已合并的记录
+
+目录结构:
+  <ATLAS_CASES_PATH>/wal.jsonl       预写日志（每行: id、base64编码的float32特征、元数据）
+  <ATLAS_CASES_PATH>/images/         新增病例图片的副本
+"""
+import base64
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+# 新增病例目录
+CASES_PATH = os.getenv("ATLAS_CASES_PATH", "./atlas_cases")
+WAL_NAME = "wal.jsonl"
+
+
+def encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_vector(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+@contextmanager
+def _file_lock(path: str, blocking: bool = True):
+    """跨进程文件锁（没有fcntl时只在进程内互斥），yield 是否获得锁"""
+    if not HAS_FCNTL:
+        yield True
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def _parse_lines(data: bytes) -> List[dict]:
+    records = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # 写入中途崩溃留下的残行
+            continue
+    return records
+
+
+class CaseLog:
+    """新增病例的预写日志"""
+
+    def __init__(self, root: str = CASES_PATH):
+        self.root = root
+        self.path = os.path.join(root, WAL_NAME)
+        self.images_dir = os.path.join(root, "images")
+        os.makedirs(self.images_dir, exist_ok=True)
+        self._lock_path = self.path + ".lock"
+        self._compact_lock_path = os.path.join(root, "compact.lock")
+        self._add_lock_path = os.path.join(root, "add.lock")
+        self._add_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._inode = None
+        self._offset = 0
+
+    def append(self, record: dict):
+        """追加一条记录并fsync（返回即已持久化）"""
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._write_lock, _file_lock(self._lock_path):
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                # 上次写入中途崩溃时文件末尾可能是残行，先换行，避免与本条记录拼在一起
+                size = os.fstat(fd).st_size
+                if size:
+                    os.lseek(fd, size - 1, os.SEEK_SET)
+                    if os.read(fd, 1) != b"\n":
+                        line = b"\n" + line
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def read_new(self) -> Tuple[List[dict], bool]:
+        """
+        读取上次读取之后追加的完整记录
+
+        Returns:
+            (记录列表, 日志是否已被压缩重写)；重写后从新文件开头读取，返回的是新文件的全部记录
+        """
+        with self._read_lock:
+            try:
+                f = open(self.path, "rb")
+            except FileNotFoundError:
+                return [], False
+            with f:
+                inode = os.fstat(f.fileno()).st_ino
+                rewritten = self._inode is not None and inode != self._inode
+                if inode != self._inode:
+                    self._inode = inode
+                    self._offset = 0
+                f.seek(self._offset)
+                data = f.read()
+            # 只消费以换行结尾的完整行，正在写入的行留到下次读取
+            end = data.rfind(b"\n") + 1
+            self._offset += end
+            return _parse_lines(data[:end]), rewritten
+
+    def rewrite(self, keep: Callable[[dict], bool]) -> int:
+        """用只包含 keep 为真的记录的新文件替换日志（与追加互斥），返回保留的记录数"""
+        with self._write_lock, _file_lock(self._lock_path):
+            try:
+                with open(self.path, "rb") as f:
+                    records = _parse_lines(f.read())
+            except FileNotFoundError:
+                return 0
+            kept = [r for r in records if keep(r)]
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                for r in kept:
+                    f.write((json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        return len(kept)
+
+    @contextmanager
+    def add_lock(self):
+        """新增病例锁（跨线程和进程）：从检查id是否已存在到写入日志之间持有，同一id不会写入两次"""
+        with self._add_lock, _file_lock(self._add_lock_path):
+            yield
+
+    def compaction_lock(self):
+        """压缩锁（非阻塞，多进程时同一时刻只有一个进程压缩），yield 是否获得锁"""
+        return _file_lock(self._compact_lock_path, blocking=False)
+
+
+def _matches(meta: dict, filters: Optional[Dict]) -> bool:
+    """元数据过滤（与ChromaDB where条件、紧凑索引分区过滤的语义一致）"""
+    if not filters:
+        return True
+    if filters.get("diagnoses") and meta.get("diagnosis") not in filters["diagnoses"]:
+        return False
+    if filters.get("exclude_diagnoses") and meta.get("diagnosis") in filters["exclude_diagnoses"]:
+        return False
+    if filters.get("sources") and meta.get("source") not in filters["sources"]:
+        return False
+    return True
+
+
+class DeltaIndex:
+    """尚未合并进主索引的新增病例（写时复制的内存索引，精确搜索）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Tuple[List[str], np.ndarray, List[dict]] = ([], np.empty((0, 0), dtype=np.float32), [])
+
+    def __len__(self) -> int:
+        return len(self._state[0])
+
+    @property
+    def ids(self) -> List[str]:
+        return list(self._state[0])
+
+    def snapshot(self) -> Tuple[List[str], np.ndarray, List[dict]]:
+        """当前的 (ids, 特征矩阵, 元数据)，之后的写入不影响返回值"""
+        return self._state
+
+    def add(self, records: List[dict]) -> int:
+        """加入日志记录（已存在的id跳过），返回新加入的条数"""
+        with self._lock:
+            ids, vectors, metadatas = self._state
+            known = set(ids)
+            new = []
+            for r in records:
+                if r["id"] not in known:
+                    known.add(r["id"])
+                    new.append(r)
+            if not new:
+                return 0
+            added = np.stack([decode_vector(r["embedding"]) for r in new])
+            self._state = (
+                ids + [r["id"] for r in new],
+                np.concatenate([vectors, added]) if len(ids) else added,
+                metadatas + [r["metadata"] for r in new]
+            )
+            return len(new)
+
+    def drop(self, drop_ids: Set[str]) -> int:
+        """移除指定id（已合并进主索引），返回移除的条数"""
+        with self._lock:
+            ids, vectors, metadatas = self._state
+            keep = [i for i, record_id in enumerate(ids) if record_id not in drop_ids]
+            if len(keep) == len(ids):
+                return 0
+            self._state = (
+                [ids[i] for i in keep],
+                vectors[keep] if keep else np.empty((0, 0), dtype=np.float32),
+                [metadatas[i] for i in keep]
+            )
+            return len(ids) - len(keep)
+
+    def search(self, query: np.ndarray, top_k: int, filters: Optional[Dict] = None) -> List[Tuple[dict, float]]:
+        """
+        精确搜索
+
+        Returns:
+            [(元数据, 余弦相似度), ...]，按相似度降序
+        """
+        ids, vectors, metadatas = self._state
+        if not ids:
+            return []
+        rows = [i for i, meta in enumerate(metadatas) if _matches(meta, filters)]
+        if not rows:
+            return []
+        scores = vectors[rows] @ np.asarray(query, dtype=np.float32)
+        best = np.argsort(-scores, kind="stable")[:top_k]
+        return [(metadatas[rows[i]], float(scores[i])) for i in best]
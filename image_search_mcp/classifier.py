@@ -0,0 +1,211 @@
+"""
+零样本组织分类模块
+启动时预计算类别文本提示的PLIP文本特征和图谱中每个类别的特征中心，
+查询时只需一次图像前向计算加一个很小的矩阵乘法
+"""
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from build_atlas import NCT_CRC_CATEGORIES
+
+# 自定义类别集合（JSON文件：{"类别代码": "英文描述", ...}），未配置时使用NCT-CRC-HE的9个类别
+LABELS_FILE_ENV = "CLASSIFY_LABELS_FILE"
+# 文本提示模板
+PROMPT_TEMPLATE = "an H&E image of {}."
+# 从图谱读取特征时的分页大小
+PAGE_SIZE = 5000
+# 用于温度标定的图谱样本上限
+CALIBRATION_SAMPLES = 5000
+# 温度搜索网格（logit = 相似度 * scale）
+SCALE_GRID = np.geomspace(1.0, 200.0, 40)
+# 两个分类头融合权重搜索网格（文本头权重）
+WEIGHT_GRID = np.linspace(0.0, 1.0, 11)
+
+
+def load_label_set() -> Dict[str, str]:
+    """读取配置的类别集合（类别代码 -> 描述）"""
+    path = os.getenv(LABELS_FILE_ENV)
+    if not path:
+        return dict(NCT_CRC_CATEGORIES)
+    with open(path, "r", encoding="utf-8") as f:
+        labels = json.load(f)
+    if not isinstance(labels, dict) or not labels:
+        raise ValueError(f"{path} 必须是非空的 {{类别代码: 描述}} JSON对象")
+    return labels
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def _nll(probs: np.ndarray, targets: np.ndarray) -> float:
+    return float(-np.log(probs[np.arange(len(targets)), targets] + 1e-12).mean())
+
+
+def _fit_scale(sims: np.ndarray, targets: np.ndarray) -> float:
+    """在网格上搜索使负对数似然最小的温度（scale）"""
+    losses = [_nll(_softmax(sims * scale), targets) for scale in SCALE_GRID]
+    return float(SCALE_GRID[int(np.argmin(losses))])
+
+
+class TileClassifier:
+    """基于PLIP的组织类别分类器（文本提示零样本 + 图谱类别中心）"""
+
+    def __init__(self, extractor, collection=None, labels: Optional[Dict[str, str]] = None):
+        """
+        预计算类别特征
+
+        Args:
+            extractor: PLIPFeatureExtractor实例
+            collection: ChromaDB collection，提供时计算每个类别的特征中心并做温度标定
+            labels: 类别代码 -> 英文描述，None时读取配置
+        """
+        self.labels = labels or load_label_set()
+        self.codes: List[str] = list(self.labels)
+
+        prompts = [PROMPT_TEMPLATE.format(desc) for desc in self.labels.values()]
+        self.text_embeddings = extractor.extract_text_features_batch(prompts).astype(np.float32)
+        # CLIP训练时学到的logit scale，作为文本头的默认温度
+        self.text_scale = extractor.logit_scale
+
+        self.centroid_codes: List[str] = []
+        self.centroids: Optional[np.ndarray] = None
+        self.centroid_scale = self.text_scale
+        self.text_weight = 1.0
+
+        if collection is not None:
+            samples, sample_labels, sums, counts = self._compute_centroids(collection)
+            if self.centroids is not None and len(samples):
+                self._calibrate(samples, sample_labels, sums, counts)
+
+        print(
+            f"零样本分类器就绪: {len(self.codes)} 个文本类别, "
+            f"{len(self.centroid_codes)} 个图谱类别中心, "
+            f"文本权重={self.text_weight:.1f}"
+        )
+
+    def _compute_centroids(self, collection):
+        """
+        分页读取图谱特征，按诊断类别累加得到类别中心，同时保留部分样本用于标定
+
+        Returns:
+            (标定样本, 样本类别, 各类别特征和（按 centroid_codes 顺序）, 各类别样本数)
+        """
+        sums: Dict[str, np.ndarray] = {}
+        counts: Dict[str, int] = {}
+        samples = []
+        sample_labels = []
+        rng = np.random.default_rng(0)
+
+        total = collection.count()
+        for offset in range(0, total, PAGE_SIZE):
+            page = collection.get(
+                limit=PAGE_SIZE,
+                offset=offset,
+                include=["embeddings", "metadatas"]
+            )
+            embeddings = np.asarray(page["embeddings"], dtype=np.float32)
+            for emb, meta in zip(embeddings, page["metadatas"]):
+                code = (meta or {}).get("diagnosis")
+                if code not in self.labels:
+                    continue
+                if code not in sums:
+                    sums[code] = np.zeros_like(emb)
+                    counts[code] = 0
+                sums[code] += emb
+                counts[code] += 1
+                # 蓄水池抽样，保证标定样本不超过上限
+                seen = sum(counts.values())
+                if len(samples) < CALIBRATION_SAMPLES:
+                    samples.append(emb)
+                    sample_labels.append(code)
+                else:
+                    j = int(rng.integers(seen))
+                    if j < CALIBRATION_SAMPLES:
+                        samples[j] = emb
+                        sample_labels[j] = code
+
+        if not sums:
+            return np.empty((0, 0), dtype=np.float32), [], None, None
+
+        self.centroid_codes = [code for code in self.codes if code in sums]
+        class_sums = np.stack([sums[code] for code in self.centroid_codes])
+        class_counts = np.array([counts[code] for code in self.centroid_codes])
+        centroids = class_sums / class_counts[:, None]
+        self.centroids = centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
+        return np.stack(samples), sample_labels, class_sums, class_counts
+
+    def _calibrate(self, samples: np.ndarray, sample_labels: List[str], sums: np.ndarray, counts: np.ndarray):
+        """
+        在图谱样本上标定两个分类头的温度和融合权重（最小化负对数似然）
+
+        标定样本本身参与了类别中心的计算，直接用完整中心会高估中心头的置信度；
+        这里对每个样本使用去掉该样本后的本类中心（留一法），其他类别的中心不受影响。
+        所在类别只有这一个样本时无法留一，该样本不参与标定。
+        """
+        index = {code: i for i, code in enumerate(self.centroid_codes)}
+        targets = np.array([index[code] for code in sample_labels])
+        keep = counts[targets] > 1
+        if not keep.any():
+            return
+        samples, targets = samples[keep], targets[keep]
+        text_rows = [self.codes.index(code) for code in self.centroid_codes]
+
+        text_sims = samples @ self.text_embeddings[text_rows].T
+        centroid_sims = samples @ self.centroids.T
+        rows = np.arange(len(targets))
+        loo = sums[targets] - samples
+        loo_norm = np.linalg.norm(loo, axis=1)
+        centroid_sims[rows, targets] = (samples * loo).sum(axis=1) / np.maximum(loo_norm, 1e-12)
+        self.text_scale = _fit_scale(text_sims, targets)
+        self.centroid_scale = _fit_scale(centroid_sims, targets)
+
+        # 以对数概率加权融合（product of experts），权重同样按负对数似然选择
+        text_logp = np.log(_softmax(text_sims * self.text_scale) + 1e-12)
+        centroid_logp = np.log(_softmax(centroid_sims * self.centroid_scale) + 1e-12)
+        losses = [
+            _nll(_softmax(w * text_logp + (1 - w) * centroid_logp), targets)
+            for w in WEIGHT_GRID
+        ]
+        self.text_weight = float(WEIGHT_GRID[int(np.argmin(losses))])
+
+    def classify(self, features: np.ndarray, method: str = "ensemble") -> Dict[str, float]:
+        """
+        计算各类别概率
+
+        Args:
+            features: 归一化后的图像特征向量
+            method: "text"（仅文本提示）、"centroid"（仅图谱类别中心）或 "ensemble"（两者融合）
+
+        Returns:
+            类别代码 -> 概率（按概率降序）
+        """
+        if method not in ("text", "centroid", "ensemble"):
+            raise ValueError(f"不支持的分类方法: {method}")
+        if method != "text" and self.centroids is None:
+            if method == "centroid":
+                raise ValueError("图谱中没有可用的类别中心，请使用 method='text'")
+            method = "text"
+
+        if method == "text":
+            codes = self.codes
+            probs = _softmax(self.text_embeddings @ features * self.text_scale)
+        else:
+            codes = self.centroid_codes
+            centroid_logp = np.log(_softmax(self.centroids @ features * self.centroid_scale) + 1e-12)
+            if method == "centroid":
+                probs = np.exp(centroid_logp)
+            else:
+                text_rows = [self.codes.index(code) for code in codes]
+                text_logp = np.log(
+                    _softmax(self.text_embeddings[text_rows] @ features * self.text_scale) + 1e-12
+                )
+                probs = _softmax(self.text_weight * text_logp + (1 - self.text_weight) * centroid_logp)
+
+        order = np.argsort(-probs)
+        return {codes[i]: float(probs[i]) for i in order}
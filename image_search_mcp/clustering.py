@@ -0,0 +1,140 @@
+"""
+聚类工具模块
+纯numpy实现的mini-batch k-means（余弦空间，输入为归一化特征向量）
+"""
+from typing import Optional
+
+import numpy as np
+
+
+def assign_clusters(features: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    """
+    将特征分配到最近（余弦相似度最大）的聚类中心
+
+    Args:
+        features: 归一化特征矩阵（n, dim）
+        centroids: 归一化聚类中心（k, dim）
+        chunk_size: 分块大小，限制相似度矩阵的内存占用
+
+    Returns:
+        每个样本的聚类编号（n,）
+    """
+    labels = np.empty(len(features), dtype=np.int64)
+    for start in range(0, len(features), chunk_size):
+        sims = features[start:start + chunk_size] @ centroids.T
+        labels[start:start + chunk_size] = sims.argmax(axis=1)
+    return labels
+
+
+def minibatch_kmeans(
+    features: np.ndarray,
+    n_clusters: int,
+    batch_size: int = 1024,
+    n_iter: int = 100,
+    seed: Optional[int] = 0
+) -> np.ndarray:
+    """
+    Mini-batch k-means（球面k-means：中心每步重新归一化）
+
+    Args:
+        features: 归一化特征矩阵（n, dim）
+        n_clusters: 聚类数（大于样本数时取样本数）
+        batch_size: 每次迭代的样本数
+        n_iter: 迭代次数
+        seed: 随机种子
+
+    Returns:
+        归一化聚类中心（k, dim）
+    """
+    features = np.asarray(features, dtype=np.float32)
+    n = len(features)
+    k = min(n_clusters, n)
+    rng = np.random.default_rng(seed)
+
+    # k-means++ 初始化（在子样本上进行，控制初始化开销）
+    pool = features[rng.choice(n, size=min(n, max(10 * k, batch_size)), replace=False)]
+    centroids = [pool[rng.integers(len(pool))]]
+    closest = 1.0 - pool @ centroids[0]
+    for _ in range(1, k):
+        weights = np.clip(closest, 0, None) ** 2
+        total = weights.sum()
+        idx = rng.choice(len(pool), p=weights / total) if total > 0 else rng.integers(len(pool))
+        centroids.append(pool[idx])
+        closest = np.minimum(closest, 1.0 - pool @ pool[idx])
+    centroids = np.stack(centroids).astype(np.float32)
+
+    counts = np.zeros(k, dtype=np.int64)
+    for _ in range(n_iter):
+        batch = features[rng.choice(n, size=min(batch_size, n), replace=False)]
+        labels = (batch @ centroids.T).argmax(axis=1)
+        for c in np.unique(labels):
+            members = batch[labels == c]
+            counts[c] += len(members)
+            # 每个中心的学习率随被分配样本数递减
+            lr = len(members) / counts[c]
+            centroids[c] = (1 - lr) * centroids[c] + lr * members.mean(axis=0)
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+
+    return centroids
+
+
+def duplicate_groups(
+    features: np.ndarray,
+    threshold: float = 0.95,
+    partition_keys: Optional[list] = None,
+    bucket_size: int = 512,
+    seed: Optional[int] = 0,
+    chunk_size: int = 1024
+) -> np.ndarray:
+    """
+    近重复分组（同一切片的相邻图块、同一图块的增强版本等）
+
+    按索引顺序做leader聚类：尚未分组的样本成为新组的代表，与它余弦相似度不低于阈值的
+    未分组样本并入该组。样本数较多时先用k-means分桶，只在桶内两两比较
+
+    Args:
+        features: 归一化特征矩阵（n, dim）
+        threshold: 判定为近重复的余弦相似度阈值
+        partition_keys: 每个样本的分区键（如 (诊断, 来源)），只在同一分区内分组，
+                        保证按元数据过滤后代表样本与组员同时保留或同时排除
+        bucket_size: 分桶的目标大小
+        seed: 分桶k-means的随机种子
+        chunk_size: 相似度矩阵的分块行数（限制桶很大时的内存占用）
+
+    Returns:
+        每个样本所属组的代表样本下标（n,），代表样本指向自身
+    """
+    features = np.asarray(features, dtype=np.float32)
+    n = len(features)
+    groups = np.arange(n, dtype=np.int64)
+    if n == 0:
+        return groups
+
+    partitions: dict = {}
+    for i, key in enumerate(partition_keys if partition_keys is not None else [None] * n):
+        partitions.setdefault(key, []).append(i)
+
+    for members in partitions.values():
+        members = np.asarray(members, dtype=np.int64)
+        if len(members) > bucket_size:
+            centroids = minibatch_kmeans(features[members], -(-len(members) // bucket_size), seed=seed)
+            labels = assign_clusters(features[members], centroids)
+            buckets = [members[labels == c] for c in np.unique(labels)]
+        else:
+            buckets = [members]
+
+        for bucket in buckets:
+            bucket_features = features[bucket]
+            assigned = np.zeros(len(bucket), dtype=bool)
+            # 分块计算相似度（k-means分桶可能很不均匀），内存为 chunk_size x 桶大小
+            for start in range(0, len(bucket), chunk_size):
+                sims = bucket_features[start:start + chunk_size] @ bucket_features.T
+                for offset in range(len(sims)):
+                    i = start + offset
+                    if assigned[i]:
+                        continue
+                    joined = ~assigned & (sims[offset] >= threshold)
+                    joined[i] = True
+                    groups[bucket[joined]] = bucket[i]
+                    assigned |= joined
+    return groups
@@ -0,0 +1,113 @@
+"""
+PLIP模型快照下载与图像塔导出脚本
+- 下载固定版本的模型快照到本地（之后服务器启动完全离线）
+- 把图像塔（含投影层和归一化）导出为TorchScript/ONNX，CPU推理可使用更轻量的运行时
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+
+import plip_model
+from plip_model import ONNX_PATH, TORCHSCRIPT_PATH, resolve_model_path
+
+
+class PLIPImageTower(torch.nn.Module):
+    """图像塔封装：pixel_values -> 归一化图像特征"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        features = self.model.get_image_features(pixel_values=pixel_values)
+        return features / features.norm(dim=-1, keepdim=True)
+
+
+def export_image_tower(formats, image_size: int = 224, verify: bool = True):
+    """
+    导出图像塔
+
+    Args:
+        formats: 导出格式列表（torchscript / onnx）
+        image_size: 输入尺寸
+        verify: 导出后是否与原始模型比对输出
+    """
+    extractor = plip_model.PLIPFeatureExtractor(device="cpu", image_backend="torch")
+    tower = PLIPImageTower(extractor.model).eval()
+    example = torch.randn(2, 3, image_size, image_size)
+    with torch.no_grad():
+        reference = tower(example).numpy()
+
+    os.makedirs(os.path.dirname(TORCHSCRIPT_PATH), exist_ok=True)
+
+    if "torchscript" in formats:
+        print(f"正在导出TorchScript: {TORCHSCRIPT_PATH}")
+        with torch.no_grad():
+            traced = torch.jit.trace(tower, example)
+            traced = torch.jit.freeze(traced)
+        traced.save(TORCHSCRIPT_PATH)
+        if verify:
+            with torch.no_grad():
+                output = torch.jit.load(TORCHSCRIPT_PATH)(example).numpy()
+            print(f"  与原始模型最大误差: {np.abs(output - reference).max():.2e}")
+
+    if "onnx" in formats:
+        print(f"正在导出ONNX: {ONNX_PATH}")
+        torch.onnx.export(
+            tower,
+            (example,),
+            ONNX_PATH,
+            input_names=["pixel_values"],
+            output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+            opset_version=17
+        )
+        if verify:
+            import onnxruntime as ort
+            session = ort.InferenceSession(ONNX_PATH, providers=["CPUExecutionProvider"])
+            output = session.run(None, {"pixel_values": example.numpy()})[0]
+            print(f"  与原始模型最大误差: {np.abs(output - reference).max():.2e}")
+
+
+def measure_cold_start(backend: str):
+    """测量指定后端的模型加载时间和单张图像推理时间"""
+    start = time.perf_counter()
+    extractor = plip_model.PLIPFeatureExtractor(device="cpu", image_backend=backend)
+    load_s = time.perf_counter() - start
+    image = np.random.randint(0, 255, (224, 224, 3), dtype=np.uint8)
+    extractor.extract_features(image)
+    start = time.perf_counter()
+    extractor.extract_features(image)
+    infer_ms = (time.perf_counter() - start) * 1000
+    print(f"  {backend:12s} 加载 {load_s:.2f} s，单张推理 {infer_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="下载PLIP模型快照并导出图像塔")
+    parser.add_argument("--download_only", action="store_true", help="只下载模型快照，不导出")
+    parser.add_argument("--formats", type=str, nargs="+", default=["torchscript", "onnx"],
+                        choices=["torchscript", "onnx"], help="导出格式（默认: torchscript onnx）")
+    parser.add_argument("--no_verify", action="store_true", help="不比对导出模型的输出")
+    parser.add_argument("--measure", action="store_true", help="导出后测量各后端的冷启动时间")
+
+    args = parser.parse_args()
+
+    try:
+        path = resolve_model_path()
+        print(f"✅ 本地模型快照: {path}")
+        if not args.download_only:
+            export_image_tower(args.formats, verify=not args.no_verify)
+            print("✅ 导出完成，设置 PLIP_IMAGE_BACKEND=torchscript 或 onnx 启用")
+            if args.measure:
+                print("\n冷启动测量:")
+                for backend in ["torch"] + args.formats:
+                    measure_cold_start(backend)
+    except KeyboardInterrupt:
+        print("\n\n操作被用户中断")
+    except Exception as e:
+        print(f"\n错误: {e}")
+        import traceback
+        traceback.print_exc()
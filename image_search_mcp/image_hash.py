@@ -0,0 +1,121 @@
+"""
+感知哈希与汉明距离索引（索引构建时在提取特征之前去除完全/几乎完全相同的图块）
+
+- dHash：灰度图缩小到 (hash_size+1) x hash_size，比较水平相邻像素的明暗得到64位哈希，
+  对重新编码、轻微的亮度变化和缩放不敏感；只需解码和缩小，远比PLIP前向便宜
+- HammingIndex：多索引哈希，把64位哈希分成 max_distance+1 段分别建表，
+  汉明距离不超过 max_distance 的两个哈希至少有一段完全相同（鸽巢原理），查询只比较同段相同的候选
+- hash_groups：按输入顺序做leader聚类，与已有代表的距离不超过阈值时归入该组
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+# 默认的汉明距离阈值（64位中最多4位不同）
+MAX_DISTANCE = 4
+# 并行计算哈希的线程数（解码在PIL内部释放GIL）
+HASH_WORKERS = 16
+
+
+def dhash(path: str, hash_size: int = HASH_SIZE) -> int:
+    """计算图片的dHash（hash_size * hash_size 位整数）"""
+    with Image.open(path) as image:
+        if image.format == "JPEG":
+            # DCT域缩小解码，只需要很小的灰度图
+            image.draft("L", (hash_size * 8, hash_size * 8))
+        gray = image.convert("L").resize((hash_size + 1, hash_size), Image.BOX)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hash_images(paths: Sequence[str], workers: int = HASH_WORKERS) -> List[Optional[int]]:
+    """并行计算一批图片的dHash，读取失败的图片为None"""
+    def _safe(path):
+        try:
+            return dhash(path)
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_safe, paths))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class HammingIndex:
+    """汉明距离近邻索引（多索引哈希）"""
+
+    def __init__(self, max_distance: int = MAX_DISTANCE, bits: int = HASH_BITS):
+        self.max_distance = max_distance
+        n_bands = max_distance + 1
+        bounds = np.linspace(0, bits, n_bands + 1).astype(int)
+        self.bands = [(int(start), int(end - start)) for start, end in zip(bounds[:-1], bounds[1:])]
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in self.bands]
+        self.hashes: List[int] = []
+
+    def _keys(self, value: int) -> List[int]:
+        return [(value >> start) & ((1 << width) - 1) for start, width in self.bands]
+
+    def add(self, value: int) -> int:
+        """加入哈希，返回其编号"""
+        item = len(self.hashes)
+        self.hashes.append(value)
+        for table, key in zip(self.tables, self._keys(value)):
+            table.setdefault(key, []).append(item)
+        return item
+
+    def nearest(self, value: int) -> Optional[int]:
+        """距离不超过 max_distance 的最近项编号（距离相同时取先加入的），没有时返回None"""
+        best, best_distance = None, self.max_distance + 1
+        seen = set()
+        for table, key in zip(self.tables, self._keys(value)):
+            for item in table.get(key, ()):
+                if item in seen:
+                    continue
+                seen.add(item)
+                distance = hamming(value, self.hashes[item])
+                if distance < best_distance or (best is not None and distance == best_distance and item < best):
+                    best, best_distance = item, distance
+        return best
+
+
+def hash_groups(
+    hashes: Sequence[Optional[int]],
+    max_distance: int = MAX_DISTANCE,
+    partition_keys: Optional[Sequence] = None
+) -> np.ndarray:
+    """
+    按感知哈希分组
+
+    Args:
+        hashes: 每张图片的哈希（None表示无法计算，单独成组）
+        max_distance: 同组的最大汉明距离
+        partition_keys: 分区键（如诊断），只在同一分区内分组，不同标签的图块不会互为别名
+
+    Returns:
+        每张图片所属组代表的下标（代表即该组在输入中第一次出现的图片）
+    """
+    groups = np.arange(len(hashes), dtype=np.int64)
+    indexes: Dict[object, HammingIndex] = {}
+    leaders: Dict[object, List[int]] = {}
+    for i, value in enumerate(hashes):
+        if value is None:
+            continue
+        key = partition_keys[i] if partition_keys is not None else None
+        if key not in indexes:
+            indexes[key] = HammingIndex(max_distance)
+            leaders[key] = []
+        match = indexes[key].nearest(value)
+        if match is None:
+            indexes[key].add(value)
+            leaders[key].append(i)
+        else:
+            groups[i] = leaders[key][match]
+    return groups
@@ -0,0 +1,59 @@
+"""
+图像解码工具模块
+- Base64载荷直接从data URL前缀之后解码，不做split等中间拷贝
+- JPEG使用draft模式在解码阶段按1/2、1/4、1/8缩小（DCT域缩放），并直接解码为RGB，
+  大尺寸照片的解码像素量可减少到1/64
+- 只在模式不是RGB时做一次转换
+- 需要保留原图（如新增病例归档）时，用 image_extension 按原始内容确定扩展名，原样保存字节
+"""
+import binascii
+import io
+from typing import BinaryIO, Union
+
+from PIL import Image
+
+# 解码目标尺寸：draft模式保证解码结果的两条边都不小于该值（与PLIP输入尺寸一致）
+DRAFT_SIZE = 224
+# data URL前缀（如 data:image/png;base64,）只在开头这一段里查找逗号
+DATA_URL_PREFIX_MAX = 256
+
+
+def decode_base64(data: str) -> bytes:
+    """解码Base64字符串（支持data URL前缀），不拷贝前缀之后的载荷"""
+    start = data.find(",", 0, DATA_URL_PREFIX_MAX) + 1
+    # start为0时切片返回原字符串对象本身
+    return binascii.a2b_base64(data[start:])
+
+
+def image_extension(source: Union[str, bytes]) -> str:
+    """原始图像内容对应的文件扩展名（只读取文件头，不解码），未知格式时为 .img"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as image:
+        fmt = image.format
+    extensions = [ext for ext, name in Image.registered_extensions().items() if name == fmt]
+    preferred = {"JPEG": ".jpg", "TIFF": ".tif", "PNG": ".png"}
+    return preferred.get(fmt) or (extensions[0] if extensions else ".img")
+
+
+def open_image(source: Union[str, bytes, BinaryIO], draft_size: int = DRAFT_SIZE) -> Image.Image:
+    """
+    打开并解码图像，返回RGB图像
+
+    Args:
+        source: 文件路径、图像字节或文件对象
+        draft_size: JPEG按draft模式缩小解码的目标尺寸，None表示全分辨率解码
+
+    Returns:
+        已解码的RGB PIL Image
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        # BytesIO直接引用bytes对象的缓冲区，不产生拷贝
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    if draft_size and image.format == "JPEG":
+        image.draft("RGB", (draft_size, draft_size))
+    image.load()
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
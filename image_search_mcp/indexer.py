@@ -1,69 +1,56 @@
 """
 图谱索引构建脚本
-遍历图谱目录，使用PLIP提取特征向量，存储到ChromaDB
+遍历图谱目录（或读取 build_atlas.py 生成的清单），使用PLIP提取特征向量，存储到ChromaDB
+写入后对本次新增的图块做近重复分组（元数据 dup_group），检索时据此折叠近重复结果
+--phash_distance 开启提取特征前的感知哈希去重：完全/几乎完全相同的图块只对代表提取特征和入库，
+其余记录为代表的别名（元数据 aliases / alias_count）
+
+分片并行构建（单机多进程，或共享文件系统的多台机器）:
+  python indexer.py --manifest m.jsonl --shard_dir ./shards --workers 4    # 本机4个进程，完成后自动合并
+  python indexer.py --manifest m.jsonl --shard_dir ./shards --shard 2/8    # 在某台机器上只构建第2片
+  python indexer.py --shard_dir ./shards --merge [--index_out ./atlas_index]
+图片按记录id的哈希确定性地分到各分片，每个分片写入一个文件；已完成的分片在重跑时跳过，
+失败的分片只需单独重跑
 """
 import os
+import sys
+import json
+import hashlib
 import argparse
+import subprocess
+import tempfile
 from pathlib import Path
+from typing import List, Optional
+import numpy as np
 import chromadb
 from chromadb.config import Settings
+from build_atlas import iter_images, read_manifest
+from clustering import duplicate_groups
+from image_hash import hash_groups, hash_images
+from thumbnails import get_thumbnail_cache
 from plip_model import get_extractor, PLIPEmbeddingFunction
+from vector_store import DUP_THRESHOLD, PAGE_SIZE, PARTITION_FIELDS
 
 DB_PATH = "./pathology_atlas_db"
 COLLECTION_NAME = "pathology_cases"
+# 分片构建时每批提取特征的图片数
+SHARD_BATCH_SIZE = 64
+# 写入ChromaDB时每批的记录数
+ADD_BATCH_SIZE = 1000
 
 
-def index_images(atlas_dir: str, db_path: str = DB_PATH):
+def scan_atlas_dir(atlas_dir: str):
     """
-    构建图谱索引
+    扫描按诊断分类的图谱目录
     
-    Args:
-        atlas_dir: 图谱目录路径（按诊断分类的文件夹结构）
-        db_path: ChromaDB数据库路径
+    Returns:
+        (ids, image_paths, metadatas)
     """
     atlas_path = Path(atlas_dir)
-    if not atlas_path.exists():
-        raise ValueError(f"图谱目录不存在: {atlas_dir}")
-    
-    print(f"开始构建索引，图谱目录: {atlas_dir}")
-    print("正在初始化PLIP模型...")
-    
-    # 初始化embedding function
-    embedding_func = PLIPEmbeddingFunction()
-    
-    # 初始化ChromaDB客户端
-    print(f"正在连接ChromaDB数据库: {db_path}")
-    chroma_client = chromadb.PersistentClient(path=db_path, settings=Settings(anonymized_telemetry=False))
-    
-    # 获取或创建collection
-    try:
-        collection = chroma_client.get_collection(name=COLLECTION_NAME)
-        print(f"找到已存在的collection: {COLLECTION_NAME}")
-        print(f"当前包含 {collection.count()} 条记录")
-        response = input("是否清空现有数据并重新索引？(y/N): ")
-        if response.lower() == 'y':
-            chroma_client.delete_collection(name=COLLECTION_NAME)
-            collection = chroma_client.create_collection(
-                name=COLLECTION_NAME,
-                embedding_function=embedding_func
-            )
-            print("已清空旧数据")
-        else:
-            print("将在现有数据基础上增量添加")
-    except Exception:
-        collection = chroma_client.create_collection(
-            name=COLLECTION_NAME,
-            embedding_function=embedding_func
-        )
-        print(f"创建新collection: {COLLECTION_NAME}")
-    
-    # 收集所有图片
     ids = []
     image_paths = []
     metadatas = []
     
-    supported_formats = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
-    
     print("\n正在扫描图片文件...")
     for folder_name in sorted(os.listdir(atlas_path)):
         folder_path = atlas_path / folder_name
@@ -73,30 +60,153 @@ def index_images(atlas_dir: str, db_path: str = DB_PATH):
         print(f"  处理类别: {folder_name}")
         image_count = 0
         
-        for img_file in sorted(os.listdir(folder_path)):
-            if img_file.lower().endswith(supported_formats):
-                full_path = folder_path / img_file
-                
-                # 生成唯一ID
-                img_id = f"{folder_name}_{img_file}"
-                
-                ids.append(img_id)
-                image_paths.append(str(full_path))
-                metadatas.append({
-                    "diagnosis": folder_name,
-                    "source": "Internal Atlas",
-                    "image_path": str(full_path),
-                    "filename": img_file
-                })
-                image_count += 1
+        for img_file in sorted(entry.name for entry in iter_images(str(folder_path))):
+            full_path = folder_path / img_file
+            
+            # 生成唯一ID
+            ids.append(f"{folder_name}_{img_file}")
+            image_paths.append(str(full_path))
+            metadatas.append({
+                "diagnosis": folder_name,
+                "source": "Internal Atlas",
+                "image_path": str(full_path),
+                "filename": img_file
+            })
+            image_count += 1
         
         print(f"    找到 {image_count} 张图片")
+    return ids, image_paths, metadatas
+
+
+def scan_manifest(manifest_path: str):
+    """
+    读取 build_atlas.py 生成的图谱清单（不需要复制或遍历图片目录）
+    
+    Returns:
+        (ids, image_paths, metadatas)，id规则与按目录扫描一致
+    """
+    print(f"\n正在读取图谱清单: {manifest_path}")
+    ids = []
+    image_paths = []
+    metadatas = []
+    for record in read_manifest(manifest_path):
+        ids.append(f"{record['diagnosis']}_{record['filename']}")
+        image_paths.append(record["path"])
+        metadatas.append({
+            "diagnosis": record["diagnosis"],
+            "source": record.get("source", "Internal Atlas"),
+            "image_path": record["path"],
+            "filename": record["filename"]
+        })
+    print(f"  清单包含 {len(ids)} 张图片")
+    return ids, image_paths, metadatas
+
+
+def _hash_dedup_groups(image_paths: List[str], metadatas: List[dict], max_distance: int):
+    """
+    计算感知哈希并在同一诊断/来源内分组
+    
+    Returns:
+        (每张图片所属组代表的下标, 哈希列表)
+    """
+    print(f"\n正在计算感知哈希（{len(image_paths)} 张图片）...")
+    hashes = hash_images(image_paths)
+    groups = hash_groups(
+        hashes,
+        max_distance,
+        partition_keys=[tuple(m.get(f) for f in PARTITION_FIELDS) for m in metadatas]
+    )
+    return groups, hashes
+
+
+def _apply_dedup(ids: List[str], image_paths: List[str], metadatas: List[dict], groups, hashes):
+    """
+    只保留各组代表，其余图片的id记录在代表的元数据中（aliases 为JSON数组字符串）
+    
+    Returns:
+        (ids, image_paths, metadatas)，只含代表
+    """
+    aliases = {}
+    for i, leader in enumerate(groups):
+        if leader != i:
+            aliases.setdefault(int(leader), []).append(ids[i])
+    keep = [i for i, leader in enumerate(groups) if leader == i]
+    kept_metadatas = []
+    for i in keep:
+        meta = dict(metadatas[i])
+        if hashes[i] is not None:
+            meta["phash"] = f"{hashes[i]:016x}"
+        if i in aliases:
+            meta["aliases"] = json.dumps(aliases[i], ensure_ascii=False)
+            meta["alias_count"] = len(aliases[i])
+        kept_metadatas.append(meta)
+    n_aliases = len(ids) - len(keep)
+    print(f"  {n_aliases} 张图片与其他图片重复（{n_aliases / max(len(ids), 1):.1%}），只对 {len(keep)} 张提取特征")
+    return [ids[i] for i in keep], [image_paths[i] for i in keep], kept_metadatas
+
+
+def attach_thumbnails(image_paths: List[str], metadatas: List[dict]) -> List[dict]:
+    """生成缩略图金字塔（内容寻址，已存在时跳过），把缩略图键写入元数据 thumb"""
+    print(f"\n正在生成缩略图（{len(image_paths)} 张图片）...")
+    keys = get_thumbnail_cache().generate_many(image_paths)
+    n_failed = sum(key is None for key in keys)
+    if n_failed:
+        print(f"  {n_failed} 张图片的缩略图生成失败（搜索结果中不附带缩略图）")
+    return [{**meta, "thumb": key} if key else meta for meta, key in zip(metadatas, keys)]
+
+
+def dedup_records(ids: List[str], image_paths: List[str], metadatas: List[dict], max_distance: int):
+    """提取特征前按感知哈希去重（汉明距离不超过 max_distance 的图块归为一组）"""
+    groups, hashes = _hash_dedup_groups(image_paths, metadatas, max_distance)
+    return _apply_dedup(ids, image_paths, metadatas, groups, hashes)
+
+
+def index_images(
+    atlas_dir: str = None,
+    db_path: str = DB_PATH,
+    dup_threshold: float = DUP_THRESHOLD,
+    manifest: str = None,
+    phash_distance: int = -1,
+    thumbnails: bool = True
+):
+    """
+    构建图谱索引
+    
+    Args:
+        atlas_dir: 图谱目录路径（按诊断分类的文件夹结构）
+        db_path: ChromaDB数据库路径
+        dup_threshold: 近重复分组的余弦相似度阈值（0表示不分组）
+        manifest: 图谱清单路径（build_atlas.py 生成），给出时不扫描 atlas_dir
+        phash_distance: 感知哈希去重的汉明距离阈值（-1表示不去重）
+        thumbnails: 是否生成缩略图（搜索结果展示图块时不读取原图）
+    """
+    if manifest:
+        if not os.path.exists(manifest):
+            raise ValueError(f"图谱清单不存在: {manifest}")
+        print(f"开始构建索引，图谱清单: {manifest}")
+    else:
+        if not atlas_dir or not Path(atlas_dir).exists():
+            raise ValueError(f"图谱目录不存在: {atlas_dir}")
+        print(f"开始构建索引，图谱目录: {atlas_dir}")
+    print("正在初始化PLIP模型...")
+    
+    collection = open_collection(db_path)
+    
+    # 收集所有图片
+    if manifest:
+        ids, image_paths, metadatas = scan_manifest(manifest)
+    else:
+        ids, image_paths, metadatas = scan_atlas_dir(atlas_dir)
     
     if not ids:
         print("错误: 未找到任何图片文件")
         return
     
     print(f"\n总共找到 {len(ids)} 张图片")
+    if phash_distance >= 0:
+        ids, image_paths, metadatas = dedup_records(ids, image_paths, metadatas, phash_distance)
+    if thumbnails:
+        metadatas = attach_thumbnails(image_paths, metadatas)
     print("开始提取特征向量并写入数据库...")
     
     # 批量处理（每次处理一批，避免内存溢出）
@@ -105,6 +215,8 @@ def index_images(atlas_dir: str, db_path: str = DB_PATH):
     
     # 初始化extractor
     extractor = get_extractor()
+    # 成功写入的记录（用于近重复分组）
+    added_ids, added_embeddings, added_metadatas = [], [], []
     
     for i in range(0, len(ids), batch_size):
         batch_ids = ids[i:i+batch_size]
@@ -127,6 +239,9 @@ def index_images(atlas_dir: str, db_path: str = DB_PATH):
                 embeddings=batch_embeddings.tolist(),
                 metadatas=batch_metadatas
             )
+            added_ids.extend(batch_ids)
+            added_embeddings.extend(batch_embeddings)
+            added_metadatas.extend(batch_metadatas)
         except Exception as e:
             print(f"  批次 {batch_num} 处理失败: {e}")
             # 尝试逐张添加
@@ -138,34 +253,479 @@ def index_images(atlas_dir: str, db_path: str = DB_PATH):
                         embeddings=[embedding.tolist()],
                         metadatas=[metadata]
                     )
+                    added_ids.append(img_id)
+                    added_embeddings.append(embedding)
+                    added_metadatas.append(metadata)
                 except Exception as e2:
                     print(f"    跳过图片 {img_id}: {e2}")
     
-    print(f"\n✅ 索引构建完成！")
+    if dup_threshold > 0 and added_ids:
+        mark_duplicates(collection, added_ids, np.stack(added_embeddings), added_metadatas, dup_threshold)
+    
+    print("\n✅ 索引构建完成！")
     print(f"数据库路径: {db_path}")
     print(f"Collection: {COLLECTION_NAME}")
     print(f"总记录数: {collection.count()}")
 
 
+def open_collection(db_path: str = DB_PATH):
+    """连接ChromaDB并获取collection（已存在时询问是否清空）"""
+    # 初始化embedding function
+    embedding_func = PLIPEmbeddingFunction()
+    
+    # 初始化ChromaDB客户端
+    print(f"正在连接ChromaDB数据库: {db_path}")
+    chroma_client = chromadb.PersistentClient(path=db_path, settings=Settings(anonymized_telemetry=False))
+    
+    # 获取或创建collection
+    try:
+        collection = chroma_client.get_collection(name=COLLECTION_NAME)
+        print(f"找到已存在的collection: {COLLECTION_NAME}")
+        print(f"当前包含 {collection.count()} 条记录")
+        response = input("是否清空现有数据并重新索引？(y/N): ")
+        if response.lower() == 'y':
+            chroma_client.delete_collection(name=COLLECTION_NAME)
+            collection = chroma_client.create_collection(
+                name=COLLECTION_NAME,
+                embedding_function=embedding_func
+            )
+            print("已清空旧数据")
+        else:
+            print("将在现有数据基础上增量添加")
+    except Exception:
+        collection = chroma_client.create_collection(
+            name=COLLECTION_NAME,
+            embedding_function=embedding_func
+        )
+        print(f"创建新collection: {COLLECTION_NAME}")
+    return collection
+
+
+def _join_existing_groups(collection, ids, embeddings: np.ndarray, metadatas, groups: np.ndarray, threshold: float):
+    """
+    新记录的组代表与集合中已有的组代表（同一诊断/来源）比较，相似度达到阈值时整组并入已有的组
+    （与全量leader聚类一致：已有记录在前，分组不变）
+
+    Returns:
+        新记录的 dup_group 列表
+    """
+    new_ids = set(ids)
+    dup_group = [ids[g] for g in groups]
+    leaders_by_key = {}
+    for i, (g, meta) in enumerate(zip(groups, metadatas)):
+        if g == i:
+            leaders_by_key.setdefault(tuple(meta.get(f) for f in PARTITION_FIELDS), []).append(i)
+
+    joined = 0
+    for key, leaders in leaders_by_key.items():
+        if any(value is None for value in key):
+            continue
+        clauses = [{field: value} for field, value in zip(PARTITION_FIELDS, key)]
+        where = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+        pending = np.asarray(leaders, dtype=np.int64)
+        offset = 0
+        while len(pending):
+            page = collection.get(where=where, limit=PAGE_SIZE, offset=offset, include=["embeddings", "metadatas"])
+            if not len(page["ids"]):
+                break
+            offset += len(page["ids"])
+            rows = [
+                j for j, (record_id, meta) in enumerate(zip(page["ids"], page["metadatas"]))
+                if record_id not in new_ids and (meta or {}).get("dup_group", record_id) == record_id
+            ]
+            if not rows:
+                continue
+            hits = embeddings[pending] @ np.asarray(page["embeddings"], dtype=np.float32)[rows].T >= threshold
+            found = hits.any(axis=1)
+            for leader, first in zip(pending[found], hits[found].argmax(axis=1)):
+                group_id = page["ids"][rows[first]]
+                for i in np.flatnonzero(groups == leader):
+                    dup_group[i] = group_id
+                    joined += 1
+            pending = pending[~found]
+    if joined:
+        print(f"  {joined} 张新图片并入已有记录的近重复组")
+    return dup_group
+
+
+def mark_duplicates(collection, ids, embeddings: np.ndarray, metadatas, threshold: float = DUP_THRESHOLD):
+    """
+    近重复分组：只在同一诊断/来源内分组，把组代表的记录id写入元数据 dup_group
+
+    增量索引时先对本次新增的记录分组，再把各组与集合中已有的组比较，近重复的并入已有的组
+    """
+    print(f"\n正在进行近重复分组（余弦相似度 ≥ {threshold}）...")
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    groups = duplicate_groups(
+        embeddings,
+        threshold,
+        partition_keys=[tuple(m.get(f) for f in PARTITION_FIELDS) for m in metadatas]
+    )
+    dup_group = [ids[g] for g in groups]
+    if collection.count() > len(ids):
+        dup_group = _join_existing_groups(collection, ids, embeddings, metadatas, groups, threshold)
+    updated = [{**m, "dup_group": g} for m, g in zip(metadatas, dup_group)]
+    batch_size = 1000
+    for i in range(0, len(ids), batch_size):
+        collection.update(ids=ids[i:i + batch_size], metadatas=updated[i:i + batch_size])
+    n_groups = len(set(dup_group))
+    print(f"  {len(ids)} 张图片分为 {n_groups} 组，{len(ids) - n_groups} 张为近重复")
+
+
+# ---------- 分片构建 ----------
+
+def shard_of(record_id: str, num_shards: int) -> int:
+    """记录所属分片（按id的哈希，与文件列表顺序和机器无关）"""
+    return int.from_bytes(hashlib.sha1(record_id.encode("utf-8")).digest()[:8], "big") % num_shards
+
+
+def shard_path(shard_dir: str, shard_index: int, num_shards: int) -> str:
+    return os.path.join(shard_dir, f"shard-{shard_index:05d}-of-{num_shards:05d}.npz")
+
+
+def _scan(atlas_dir: Optional[str], manifest: Optional[str]):
+    if manifest:
+        return scan_manifest(manifest)
+    if not atlas_dir or not Path(atlas_dir).exists():
+        raise ValueError(f"图谱目录不存在: {atlas_dir}")
+    return scan_atlas_dir(atlas_dir)
+
+
+def _list_digest(ids: List[str]) -> str:
+    """完整文件列表的摘要，合并时确认各分片来自同一份列表"""
+    return hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()
+
+
+def _dedup_plan(
+    shard_dir: str,
+    ids: List[str],
+    image_paths: List[str],
+    metadatas: List[dict],
+    max_distance: int
+):
+    """
+    分片构建共用的去重分组（需要全部图片的哈希，只计算一次并保存在分片目录中）
+    
+    Returns:
+        (groups, hashes)
+    """
+    path = os.path.join(shard_dir, f"dedup-d{max_distance}.json")
+    digest = _list_digest(ids)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+        if plan["list_digest"] == digest:
+            hashes = [int(h, 16) if h is not None else None for h in plan["hashes"]]
+            return plan["groups"], hashes
+        print(f"去重分组 {path} 来自不同的文件列表，重新计算")
+    
+    groups, hashes = _hash_dedup_groups(image_paths, metadatas, max_distance)
+    # 多个分片主机可能同时计算，各自写入独立的临时文件后原子替换
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=shard_dir)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({
+                "list_digest": digest,
+                "max_distance": max_distance,
+                "groups": [int(g) for g in groups],
+                "hashes": [f"{h:016x}" if h is not None else None for h in hashes]
+            }, f)
+        # mkstemp 创建的文件只有属主可读，其他分片主机的用户也需要读取
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return [int(g) for g in groups], hashes
+
+
+def build_shard(
+    shard_index: int,
+    num_shards: int,
+    shard_dir: str,
+    atlas_dir: str = None,
+    manifest: str = None,
+    force: bool = False,
+    batch_size: int = SHARD_BATCH_SIZE,
+    phash_distance: int = -1,
+    thumbnails: bool = True
+) -> str:
+    """
+    构建一个分片：提取本分片图片的特征，写入分片文件（先写临时文件再原子重命名）
+    
+    Args:
+        shard_index: 分片编号（0 ~ num_shards-1）
+        num_shards: 分片总数
+        shard_dir: 分片文件目录（多机构建时为共享目录）
+        atlas_dir / manifest: 图谱目录或清单（所有分片必须使用同一份）
+        force: 分片文件已存在时也重新构建
+        batch_size: 每批提取特征的图片数
+        phash_distance: 感知哈希去重的汉明距离阈值（-1表示不去重），所有分片必须相同
+        thumbnails: 是否为本分片的图片生成缩略图
+    
+    Returns:
+        分片文件路径
+    """
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"分片编号超出范围: {shard_index}/{num_shards}")
+    os.makedirs(shard_dir, exist_ok=True)
+    path = shard_path(shard_dir, shard_index, num_shards)
+    if os.path.exists(path) and not force:
+        print(f"分片 {shard_index}/{num_shards} 已完成，跳过: {path}")
+        return path
+    
+    ids, image_paths, metadatas = _scan(atlas_dir, manifest)
+    digest = _list_digest(ids)
+    if phash_distance >= 0:
+        groups, hashes = _dedup_plan(shard_dir, ids, image_paths, metadatas, phash_distance)
+        ids, image_paths, metadatas = _apply_dedup(ids, image_paths, metadatas, groups, hashes)
+    rows = [i for i, record_id in enumerate(ids) if shard_of(record_id, num_shards) == shard_index]
+    print(f"分片 {shard_index}/{num_shards}: {len(rows)} / {len(ids)} 张图片")
+    if thumbnails:
+        for i, meta in zip(rows, attach_thumbnails([image_paths[i] for i in rows], [metadatas[i] for i in rows])):
+            metadatas[i] = meta
+    
+    extractor = get_extractor()
+    kept, embeddings, failed = [], [], []
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        try:
+            embeddings.append(extractor.extract_features_batch([image_paths[i] for i in batch]))
+            kept.extend(batch)
+        except Exception as e:
+            print(f"  批次 {start // batch_size + 1} 处理失败: {e}，逐张重试")
+            for i in batch:
+                try:
+                    embeddings.append(extractor.extract_features(image_paths[i])[None, :])
+                    kept.append(i)
+                except Exception as e2:
+                    print(f"    跳过图片 {ids[i]}: {e2}")
+                    failed.append(ids[i])
+        print(f"  已处理 {min(start + batch_size, len(rows))}/{len(rows)}")
+    
+    tmp_path = path + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        embeddings=np.concatenate(embeddings).astype(np.float32) if embeddings else np.empty((0, 0), dtype=np.float32),
+        # 在完整列表中的位置，合并后恢复与单进程构建相同的记录顺序
+        order=np.asarray(kept, dtype=np.int64),
+        records=np.asarray(json.dumps({
+            "ids": [ids[i] for i in kept],
+            "metadatas": [metadatas[i] for i in kept],
+            "failed": failed,
+            "list_digest": digest,
+            "list_size": len(ids)
+        }, ensure_ascii=False))
+    )
+    os.replace(tmp_path, path)
+    print(f"✅ 分片 {shard_index}/{num_shards} 完成: {len(kept)} 条记录，{len(failed)} 张失败 -> {path}")
+    return path
+
+
+def run_local_shards(
+    num_workers: int,
+    shard_dir: str,
+    atlas_dir: str = None,
+    manifest: str = None,
+    force: bool = False,
+    phash_distance: int = -1,
+    thumbnails: bool = True
+) -> List[int]:
+    """
+    在本机用多个子进程并行构建所有分片（每个进程一个分片，torch线程数按核数平分）
+    
+    Returns:
+        失败的分片编号
+    """
+    cpu_count = os.cpu_count() or 1
+    env = dict(os.environ)
+    env.setdefault("PLIP_NUM_THREADS", str(max(1, cpu_count // num_workers)))
+    os.makedirs(shard_dir, exist_ok=True)
+    if phash_distance >= 0:
+        # 各分片进程直接读取已保存的去重分组，不重复计算全部图片的哈希
+        _dedup_plan(shard_dir, *_scan(atlas_dir, manifest), phash_distance)
+    
+    processes = {}
+    for i in range(num_workers):
+        if os.path.exists(shard_path(shard_dir, i, num_workers)) and not force:
+            print(f"分片 {i}/{num_workers} 已完成，跳过")
+            continue
+        args = [sys.executable, os.path.abspath(__file__), "--shard", f"{i}/{num_workers}", "--shard_dir", shard_dir]
+        args += ["--manifest", manifest] if manifest else ["--atlas_dir", atlas_dir]
+        if force:
+            args.append("--force")
+        if phash_distance >= 0:
+            args += ["--phash_distance", str(phash_distance)]
+        if not thumbnails:
+            args.append("--no_thumbnails")
+        log_path = os.path.join(shard_dir, f"shard-{i:05d}.log")
+        print(f"启动分片 {i}/{num_workers}（日志: {log_path}）")
+        with open(log_path, "w", encoding="utf-8") as log:
+            processes[i] = subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT, env=env)
+    
+    failed = [i for i, proc in processes.items() if proc.wait() != 0 or not os.path.exists(shard_path(shard_dir, i, num_workers))]
+    if failed:
+        print(f"⚠️  分片 {failed} 失败，查看日志后重跑（已完成的分片会跳过）")
+    return failed
+
+
+def load_shards(shard_dir: str):
+    """
+    读取并校验全部分片
+    
+    Returns:
+        (ids, embeddings, metadatas)，按完整文件列表的顺序
+    """
+    files = sorted(f for f in os.listdir(shard_dir) if f.startswith("shard-") and f.endswith(".npz") and ".tmp" not in f)
+    if not files:
+        raise FileNotFoundError(f"分片目录中没有分片文件: {shard_dir}")
+    totals = {int(f.split("-of-")[1].split(".")[0]) for f in files}
+    if len(totals) != 1:
+        raise ValueError(f"分片目录中混有不同分片数的文件: {sorted(totals)}，请清理后重试")
+    num_shards = totals.pop()
+    missing = [i for i in range(num_shards) if not os.path.exists(shard_path(shard_dir, i, num_shards))]
+    if missing:
+        raise FileNotFoundError(f"缺少分片 {missing}（共 {num_shards} 片），请先构建这些分片")
+    
+    orders, embeddings, ids, metadatas, digests = [], [], [], [], set()
+    n_failed = 0
+    for i in range(num_shards):
+        with np.load(shard_path(shard_dir, i, num_shards)) as data:
+            records = json.loads(str(data["records"]))
+            if len(records["ids"]):
+                embeddings.append(data["embeddings"])
+            orders.append(data["order"])
+        ids.extend(records["ids"])
+        metadatas.extend(records["metadatas"])
+        digests.add(records["list_digest"])
+        n_failed += len(records["failed"])
+    if len(digests) != 1:
+        raise ValueError("各分片来自不同的文件列表（图谱目录或清单在构建期间发生了变化），请用 --force 重建")
+    
+    order = np.argsort(np.concatenate(orders), kind="stable")
+    embeddings = np.concatenate(embeddings)[order] if embeddings else np.empty((0, 0), dtype=np.float32)
+    print(f"读取 {num_shards} 个分片: {len(ids)} 条记录，{n_failed} 张图片失败")
+    return [ids[i] for i in order], embeddings, [metadatas[i] for i in order]
+
+
+def merge_shards(
+    shard_dir: str,
+    db_path: str = DB_PATH,
+    dup_threshold: float = DUP_THRESHOLD,
+    index_out: str = None,
+    prefilter_dim: int = 0
+):
+    """
+    合并分片：写入ChromaDB，并可直接导出紧凑向量索引
+    
+    近重复分组在合并后对全部记录统一计算（跨分片的近重复也能分到同一组）
+    """
+    ids, embeddings, metadatas = load_shards(shard_dir)
+    if not ids:
+        print("错误: 分片中没有任何记录")
+        return
+    
+    if dup_threshold > 0:
+        groups = duplicate_groups(
+            embeddings,
+            dup_threshold,
+            partition_keys=[tuple(m.get(f) for f in PARTITION_FIELDS) for m in metadatas]
+        )
+        metadatas = [{**m, "dup_group": ids[g]} for m, g in zip(metadatas, groups)]
+        n_groups = len(np.unique(groups))
+        print(f"近重复分组: {len(ids)} 张图片分为 {n_groups} 组")
+    
+    collection = open_collection(db_path)
+    for start in range(0, len(ids), ADD_BATCH_SIZE):
+        end = start + ADD_BATCH_SIZE
+        collection.add(ids=ids[start:end], embeddings=embeddings[start:end].tolist(), metadatas=metadatas[start:end])
+        print(f"  已写入 {min(end, len(ids))}/{len(ids)}")
+    
+    print("\n✅ 分片合并完成！")
+    print(f"数据库路径: {db_path}")
+    print(f"总记录数: {collection.count()}")
+    
+    if index_out:
+        from vector_store import AtlasVectorIndex
+        
+        AtlasVectorIndex.build(ids, embeddings, metadatas, prefilter_dim=prefilter_dim).save(index_out)
+        print(f"紧凑向量索引: {index_out}")
+
+
+def _parse_shard(value: str):
+    index, _, total = value.partition("/")
+    try:
+        return int(index), int(total)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 i/N（如 0/4）: {value}")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="构建病理图谱索引")
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
         "--atlas_dir",
         type=str,
-        required=True,
         help="图谱目录路径（按诊断分类的文件夹结构）"
     )
+    source.add_argument(
+        "--manifest",
+        type=str,
+        help="图谱清单路径（build_atlas.py 生成的 manifest.jsonl，可直接引用源数据集中的图片）"
+    )
     parser.add_argument(
         "--db_path",
         type=str,
         default=DB_PATH,
         help=f"ChromaDB数据库路径（默认: {DB_PATH}）"
     )
+    parser.add_argument(
+        "--dup_threshold",
+        type=float,
+        default=DUP_THRESHOLD,
+        help=f"近重复分组的余弦相似度阈值（默认: {DUP_THRESHOLD}，0表示不分组）"
+    )
+    parser.add_argument(
+        "--phash_distance",
+        type=int,
+        default=-1,
+        help="提取特征前按感知哈希去重的汉明距离阈值（默认: -1 不去重；建议 4，0 只合并哈希相同的图块）"
+    )
+    parser.add_argument("--no_thumbnails", action="store_true", help="不生成缩略图（默认生成，目录由环境变量 THUMB_CACHE_PATH 指定）")
+    parser.add_argument("--shard_dir", type=str, default=None, help="分片文件目录（分片构建/合并时必需）")
+    parser.add_argument("--shard", type=_parse_shard, default=None, help="只构建一个分片，格式 i/N（多机构建）")
+    parser.add_argument("--workers", type=int, default=None, help="本机并行构建的分片数，完成后自动合并")
+    parser.add_argument("--merge", action="store_true", help="合并 --shard_dir 中的全部分片")
+    parser.add_argument("--index_out", type=str, default=None, help="合并时同时导出紧凑向量索引的目录")
+    parser.add_argument("--force", action="store_true", help="分片文件已存在时也重新构建")
+    parser.add_argument("--prefilter_dim", type=int, default=0, help="导出紧凑索引时构建的PCA预筛选维数（默认: 0，不构建）")
     
     args = parser.parse_args()
+    sharded = args.shard or args.workers or args.merge
+    if sharded and not args.shard_dir:
+        parser.error("分片构建/合并需要 --shard_dir")
+    if not args.merge and not (args.atlas_dir or args.manifest):
+        parser.error("需要 --atlas_dir 或 --manifest")
     
     try:
-        index_images(args.atlas_dir, args.db_path)
+        if args.shard:
+            build_shard(
+                args.shard[0], args.shard[1], args.shard_dir, args.atlas_dir, args.manifest, args.force,
+                phash_distance=args.phash_distance, thumbnails=not args.no_thumbnails
+            )
+        elif args.workers:
+            if not run_local_shards(
+                args.workers, args.shard_dir, args.atlas_dir, args.manifest, args.force, args.phash_distance,
+                not args.no_thumbnails
+            ):
+                merge_shards(args.shard_dir, args.db_path, args.dup_threshold, args.index_out, args.prefilter_dim)
+        elif args.merge:
+            merge_shards(args.shard_dir, args.db_path, args.dup_threshold, args.index_out, args.prefilter_dim)
+        else:
+            index_images(
+                args.atlas_dir, args.db_path, args.dup_threshold, manifest=args.manifest, phash_distance=args.phash_distance,
+                thumbnails=not args.no_thumbnails
+            )
     except KeyboardInterrupt:
         print("\n\n索引构建被用户中断")
     except Exception as e:
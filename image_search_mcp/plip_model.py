@@ -1,48 +1,447 @@
 """
 PLIP模型封装模块
-提供图像特征提取功能，使用代理下载模型
+提供图像/文本特征提取功能
+
+模型加载采用离线优先策略：优先使用固定版本的本地快照（PLIP_LOCAL_PATH），
+本地没有快照时才通过代理下载一次；图像塔可选使用导出的TorchScript/ONNX推理（见 export_model.py）
 """
+import glob
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
 import torch
 from PIL import Image
 import numpy as np
-from typing import Union, List
-from transformers import AutoProcessor, AutoModel
+from typing import Optional, Union, List
+from transformers import AutoProcessor, AutoModel, CLIPTextModelWithProjection
+
+from image_io import open_image
 
-# 配置代理（用于模型下载）
-os.environ['HTTP_PROXY'] = 'http://10.196.180.160:7897'
-os.environ['HTTPS_PROXY'] = 'http://10.196.180.160:7897'
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # PLIP模型名称
 PLIP_MODEL_NAME = "vinid/plip"
+# 固定的模型版本（HuggingFace commit hash）；未设置时首次下载把 main 解析为 commit hash 并记录在快照信息中，
+# 之后的校验和重新下载都使用记录的版本
+PLIP_REVISION = os.getenv("PLIP_REVISION")
+# 本地模型快照目录
+PLIP_LOCAL_PATH = os.getenv("PLIP_LOCAL_PATH", os.path.join(_MODULE_DIR, "models", "plip"))
+# 离线模式：本地快照不存在时直接报错，不访问网络
+PLIP_OFFLINE = os.getenv("PLIP_OFFLINE", "0") == "1"
+# 下载代理（仅在需要下载模型或图片时使用，设为空字符串则不使用代理）
+PROXY_URL = os.getenv("PLIP_PROXY", "http://10.196.180.160:7897")
+
+# 图像塔推理后端：torch（默认）/ torchscript / onnx
+IMAGE_BACKEND = os.getenv("PLIP_IMAGE_BACKEND", "torch")
+# 导出的图像塔文件（export_model.py 生成）
+EXPORT_DIR = os.getenv("PLIP_EXPORT_DIR", os.path.join(_MODULE_DIR, "models"))
+TORCHSCRIPT_PATH = os.path.join(EXPORT_DIR, "plip_image.pt")
+ONNX_PATH = os.path.join(EXPORT_DIR, "plip_image.onnx")
+# 快照信息文件（记录下载的模型版本）
+SNAPSHOT_INFO = "snapshot_info.json"
+
+# CPU推理调优（多worker部署时按 核数/worker数 设置，避免线程超订）
+# 每个进程的intra-op线程数（空表示使用torch默认值）
+NUM_THREADS = os.getenv("PLIP_NUM_THREADS")
+# 每个进程的inter-op线程数
+INTEROP_THREADS = os.getenv("PLIP_INTEROP_THREADS")
+# 图像塔动态int8量化（仅CPU）
+QUANTIZE_INT8 = os.getenv("PLIP_QUANTIZE", "0") == "1"
+# 图像塔使用channels-last内存布局
+CHANNELS_LAST = os.getenv("PLIP_CHANNELS_LAST", "0") == "1"
+# 量化漂移检查使用的样本图片目录（空时使用随机图像）
+CALIBRATION_DIR = os.getenv("PLIP_CALIBRATION_DIR")
+# 量化前后特征的最小余弦相似度，低于该值时告警
+DRIFT_WARN_COSINE = 0.98
+
+# 文本特征缓存条数（LRU，Agent 经常重复使用相同的描述）
+TEXT_CACHE_SIZE = 1024
+# CLIP 文本塔最大 token 长度
+TEXT_MAX_LENGTH = 77
+
+
+def get_proxies() -> Optional[dict]:
+    """requests使用的代理配置，未配置代理时返回None"""
+    if not PROXY_URL:
+        return None
+    return {"http": PROXY_URL, "https": PROXY_URL}
+
+
+def configure_threads(num_threads: Optional[int] = None, interop_threads: Optional[int] = None):
+    """
+    设置torch的线程池大小
+    
+    inter-op线程数只能在进程内第一次并行计算之前设置一次，设置失败时忽略
+    """
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(int(interop_threads))
+        except RuntimeError as e:
+            print(f"inter-op线程数设置失败（需在首次计算前设置）: {e}")
+
+
+# 快照中必须存在的配置文件
+SNAPSHOT_CONFIGS = ("config.json", "preprocessor_config.json")
+# 模型权重文件（safetensors 优先，仓库没有时回退到 pytorch_model.bin）
+WEIGHT_PATTERNS = ("*.safetensors", "pytorch_model*.bin")
+
+
+def _weight_files(path: str) -> List[str]:
+    files = []
+    for pattern in WEIGHT_PATTERNS:
+        files.extend(sorted(glob.glob(os.path.join(path, pattern))))
+    return files
+
+
+def _has_snapshot(path: str) -> bool:
+    """配置文件和权重文件都存在时才视为完整快照（下载中断的目录不算）"""
+    if not all(os.path.exists(os.path.join(path, name)) for name in SNAPSHOT_CONFIGS):
+        return False
+    return bool(_weight_files(path))
+
+
+def _snapshot_revision(path: str) -> Optional[str]:
+    """读取快照信息中记录的模型版本，没有记录时返回None"""
+    try:
+        with open(os.path.join(path, SNAPSHOT_INFO), encoding="utf-8") as f:
+            return json.load(f).get("revision")
+    except (OSError, ValueError):
+        return None
+
+
+def _pinned_revision() -> str:
+    """下载使用的固定版本：PLIP_REVISION > 已记录的版本 > 当前 main 对应的 commit hash"""
+    if PLIP_REVISION:
+        return PLIP_REVISION
+    recorded = _snapshot_revision(PLIP_LOCAL_PATH)
+    if recorded:
+        return recorded
+    from huggingface_hub import HfApi
+    return HfApi().model_info(PLIP_MODEL_NAME, revision="main").sha
+
+
+def resolve_model_path() -> str:
+    """
+    返回可直接加载的本地模型目录（离线优先）
+    
+    本地快照完整时直接返回；否则在非离线模式下通过代理下载固定版本的快照到本地
+    （中断的下载会续传，下载后仍缺少权重文件时报错）
+    """
+    if _has_snapshot(PLIP_LOCAL_PATH):
+        recorded = _snapshot_revision(PLIP_LOCAL_PATH)
+        if PLIP_REVISION and recorded and recorded != PLIP_REVISION:
+            print(f"⚠️  本地模型快照版本 {recorded} 与 PLIP_REVISION={PLIP_REVISION} 不一致，仍使用本地快照")
+        return PLIP_LOCAL_PATH
+    if PLIP_OFFLINE:
+        raise FileNotFoundError(
+            f"离线模式下未找到本地模型快照: {PLIP_LOCAL_PATH}\n"
+            f"请先在有网络的环境运行 python export_model.py --download_only 下载模型"
+        )
+    
+    from huggingface_hub import snapshot_download
+    
+    saved_env = {k: os.environ.get(k) for k in ("HTTP_PROXY", "HTTPS_PROXY")}
+    if PROXY_URL:
+        os.environ["HTTP_PROXY"] = PROXY_URL
+        os.environ["HTTPS_PROXY"] = PROXY_URL
+    try:
+        revision = _pinned_revision()
+        print(f"本地未找到完整的模型快照，正在下载 {PLIP_MODEL_NAME}@{revision} 到 {PLIP_LOCAL_PATH}")
+        snapshot_download(
+            repo_id=PLIP_MODEL_NAME,
+            revision=revision,
+            local_dir=PLIP_LOCAL_PATH,
+            allow_patterns=["*.json", "*.txt", "*.safetensors", "*.model"]
+        )
+        if not _weight_files(PLIP_LOCAL_PATH):
+            # 该版本没有safetensors权重时下载pytorch_model.bin
+            snapshot_download(
+                repo_id=PLIP_MODEL_NAME,
+                revision=revision,
+                local_dir=PLIP_LOCAL_PATH,
+                allow_patterns=["pytorch_model*.bin"]
+            )
+    finally:
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    if not _has_snapshot(PLIP_LOCAL_PATH):
+        raise FileNotFoundError(
+            f"模型快照下载不完整（缺少配置或权重文件）: {PLIP_LOCAL_PATH}，"
+            f"请检查 {PLIP_MODEL_NAME}@{revision} 是否包含 {', '.join(SNAPSHOT_CONFIGS)} 和权重文件"
+        )
+    with open(os.path.join(PLIP_LOCAL_PATH, SNAPSHOT_INFO), "w", encoding="utf-8") as f:
+        json.dump({"repo_id": PLIP_MODEL_NAME, "revision": revision, "downloaded_at": time.time()}, f)
+    return PLIP_LOCAL_PATH
 
 
 class PLIPFeatureExtractor:
     """PLIP特征提取器"""
     
-    def __init__(self, device=None):
+    def __init__(
+        self,
+        device=None,
+        image_backend: str = None,
+        quantize: Optional[bool] = None,
+        channels_last: Optional[bool] = None
+    ):
         """
         初始化PLIP模型
         
         Args:
             device: 计算设备，None时自动选择（优先GPU）
+            image_backend: 图像塔推理后端（torch / torchscript / onnx），None时读取 PLIP_IMAGE_BACKEND
+            quantize: 是否对图像塔做动态int8量化（仅CPU + torch后端），None时读取 PLIP_QUANTIZE
+            channels_last: 图像塔是否使用channels-last内存布局，None时读取 PLIP_CHANNELS_LAST
         """
+        configure_threads(NUM_THREADS, INTEROP_THREADS)
         if device is None:
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         else:
             self.device = torch.device(device)
+        self.image_backend = image_backend or IMAGE_BACKEND
+        if self.image_backend not in ("torch", "torchscript", "onnx"):
+            raise ValueError(f"不支持的图像推理后端: {self.image_backend}")
+        self.quantize = QUANTIZE_INT8 if quantize is None else quantize
+        self.channels_last = CHANNELS_LAST if channels_last is None else channels_last
+        if self.quantize and (self.device.type != "cpu" or self.image_backend != "torch"):
+            print("动态int8量化仅支持CPU上的torch后端，已忽略")
+            self.quantize = False
+        self.quantization_drift = None
         
-        print(f"正在加载PLIP模型 ({PLIP_MODEL_NAME})，设备: {self.device}")
-        print("首次运行会从HuggingFace下载模型，可能需要一些时间...")
+        start = time.perf_counter()
+        self.model_path = resolve_model_path()
+        print(f"正在加载PLIP模型 ({self.model_path})，设备: {self.device}，图像后端: {self.image_backend}")
         
+        self._model = None
+        self._text_model = None
+        self._model_lock = threading.Lock()
+        self._image_runner = None
+        # 每个线程复用的预处理缓冲区
+        self._buffers = threading.local()
         try:
-            self.processor = AutoProcessor.from_pretrained(PLIP_MODEL_NAME)
-            self.model = AutoModel.from_pretrained(PLIP_MODEL_NAME).to(self.device)
-            self.model.eval()
+            self.processor = AutoProcessor.from_pretrained(self.model_path, local_files_only=True)
+            self._preprocess_config = self._fast_preprocess_config()
+            if self.image_backend == "torch":
+                self._model = self._load_model()
+                self._optimize_image_tower()
+            else:
+                # 导出的图像塔不需要完整模型，文本特征只加载文本塔
+                self._image_runner = self._load_image_runner()
             print("PLIP模型加载完成")
         except Exception as e:
             print(f"模型加载失败: {e}")
             raise
+        self.load_seconds = time.perf_counter() - start
+        
+        self._text_cache = OrderedDict()
+        self._text_cache_lock = threading.Lock()
+        self.text_cache_hits = 0
+        self.text_cache_misses = 0
+    
+    def _load_model(self):
+        model = AutoModel.from_pretrained(self.model_path, local_files_only=True).to(self.device)
+        model.eval()
+        return model
+    
+    def _load_text_model(self):
+        """只加载文本塔和文本投影层（视觉塔权重不加载）"""
+        model = CLIPTextModelWithProjection.from_pretrained(self.model_path, local_files_only=True).to(self.device)
+        model.eval()
+        return model
+    
+    def _load_image_runner(self):
+        """加载导出的图像塔（输入pixel_values，输出归一化特征）"""
+        if self.image_backend == "torchscript":
+            if not os.path.exists(TORCHSCRIPT_PATH):
+                raise FileNotFoundError(f"未找到TorchScript图像塔: {TORCHSCRIPT_PATH}，请先运行 export_model.py")
+            traced = torch.jit.load(TORCHSCRIPT_PATH, map_location=self.device)
+            traced.eval()
+            return lambda pixel_values: traced(pixel_values.to(self.device)).cpu().numpy()
+        
+        import onnxruntime as ort
+        if not os.path.exists(ONNX_PATH):
+            raise FileNotFoundError(f"未找到ONNX图像塔: {ONNX_PATH}，请先运行 export_model.py")
+        session = ort.InferenceSession(ONNX_PATH, providers=["CPUExecutionProvider"])
+        return lambda pixel_values: session.run(None, {"pixel_values": pixel_values.cpu().numpy()})[0]
+    
+    def _optimize_image_tower(self):
+        """对图像塔应用内存布局和动态int8量化（文本塔保持fp32）"""
+        if self.channels_last:
+            self._model.vision_model.to(memory_format=torch.channels_last)
+        if not self.quantize:
+            return
+        
+        # 量化前后对同一批图像提取特征，检查特征漂移
+        calibration = self._calibration_pixels()
+        reference = self._image_features(calibration)
+        torch.ao.quantization.quantize_dynamic(
+            self._model.vision_model,
+            {torch.nn.Linear},
+            dtype=torch.qint8,
+            inplace=True
+        )
+        quantized = self._image_features(calibration)
+        cosine = (reference * quantized).sum(axis=1)
+        self.quantization_drift = {
+            "mean_cosine": float(cosine.mean()),
+            "min_cosine": float(cosine.min()),
+            "samples": int(len(cosine))
+        }
+        print(
+            f"图像塔已动态int8量化，特征漂移: 平均余弦 {cosine.mean():.4f}，"
+            f"最小余弦 {cosine.min():.4f}（{len(cosine)} 张样本）"
+        )
+        if cosine.min() < DRIFT_WARN_COSINE:
+            print(f"⚠️  量化漂移超过阈值（最小余弦 < {DRIFT_WARN_COSINE}），检索结果可能与fp32索引不一致")
+    
+    def _calibration_pixels(self, max_images: int = 16) -> torch.Tensor:
+        """漂移检查用的样本：PLIP_CALIBRATION_DIR 下的图片，未配置时使用固定随机种子的随机图像"""
+        images = []
+        if CALIBRATION_DIR:
+            for ext in ("jpg", "jpeg", "png", "tif", "tiff"):
+                images.extend(sorted(glob.glob(os.path.join(CALIBRATION_DIR, "**", f"*.{ext}"), recursive=True)))
+            images = [self._to_pil(p) for p in images[:max_images]]
+        if not images:
+            rng = np.random.default_rng(0)
+            images = [Image.fromarray(rng.integers(0, 255, (224, 224, 3), dtype=np.uint8)) for _ in range(max_images)]
+        return self._pixel_values(images)
+    
+    @property
+    def model(self):
+        """完整的PLIP模型（使用导出图像塔时懒加载，仅导出等场景需要）"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._load_model()
+        return self._model
+    
+    def _text_features(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        """文本塔前向计算：已加载完整模型时直接复用，否则懒加载单独的文本塔"""
+        if self._model is not None:
+            return self._model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+        if self._text_model is None:
+            with self._model_lock:
+                if self._text_model is None:
+                    self._text_model = self._load_text_model()
+        return self._text_model(input_ids=input_ids, attention_mask=attention_mask).text_embeds
+    
+    @property
+    def logit_scale(self) -> float:
+        """CLIP训练时学到的logit scale（exp后）；未加载完整模型时直接从safetensors权重中读取"""
+        if self._model is None:
+            from safetensors import safe_open
+            for path in glob.glob(os.path.join(self.model_path, "*.safetensors")):
+                with safe_open(path, framework="pt") as f:
+                    if "logit_scale" in f.keys():
+                        return float(f.get_tensor("logit_scale").exp().item())
+        return float(self.model.logit_scale.exp().item())
+    
+    def _image_features(self, pixel_values: torch.Tensor) -> np.ndarray:
+        """图像塔前向计算，返回归一化特征矩阵"""
+        if self._image_runner is not None:
+            return self._image_runner(pixel_values)
+        pixel_values = pixel_values.to(self.device)
+        if self.channels_last:
+            pixel_values = pixel_values.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode():
+            outputs = self.model.get_image_features(pixel_values=pixel_values)
+            features = outputs / outputs.norm(dim=-1, keepdim=True)
+            return features.cpu().numpy()
+    
+    @staticmethod
+    def _to_pil(image: Union[str, Image.Image, np.ndarray]) -> Image.Image:
+        """将图像路径、numpy数组统一转换为RGB PIL Image（已是RGB时不转换）"""
+        if isinstance(image, str):
+            return open_image(image)
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        if not isinstance(image, Image.Image):
+            raise ValueError(f"不支持的图像类型: {type(image)}")
+        return image if image.mode == 'RGB' else image.convert('RGB')
+    
+    def _fast_preprocess_config(self) -> Optional[dict]:
+        """
+        从processor配置中读取 缩放/中心裁剪/归一化 参数
+        
+        配置不是"短边缩放 + 中心裁剪"的形式时返回None，预处理回退到processor
+        """
+        config = getattr(self.processor, "image_processor", None)
+        size = getattr(config, "size", None) or {}
+        crop = getattr(config, "crop_size", None) or {}
+        if "shortest_edge" not in size or not getattr(config, "do_center_crop", False):
+            return None
+        if crop.get("height", 0) > size["shortest_edge"] or crop.get("width", 0) > size["shortest_edge"]:
+            return None
+        std = np.asarray(config.image_std, dtype=np.float32).reshape(1, 3, 1, 1)
+        mean = np.asarray(config.image_mean, dtype=np.float32).reshape(1, 3, 1, 1)
+        return {
+            "shortest_edge": size["shortest_edge"],
+            "crop": (crop["height"], crop["width"]),
+            "resample": config.resample,
+            # (x * rescale - mean) / std  =  x * (rescale / std) - mean / std
+            "scale": np.float32(config.rescale_factor) / std,
+            "offset": mean / std
+        }
+    
+    def _resize_crop(self, image: Image.Image) -> Image.Image:
+        """短边缩放到目标尺寸后中心裁剪（与processor的尺寸计算一致）"""
+        config = self._preprocess_config
+        short = config["shortest_edge"]
+        crop_h, crop_w = config["crop"]
+        w, h = image.size
+        if w <= h:
+            new_w, new_h = short, int(short * h / w)
+        else:
+            new_w, new_h = int(short * w / h), short
+        if (new_w, new_h) != (w, h):
+            image = image.resize((new_w, new_h), config["resample"])
+        left, top = (new_w - crop_w) // 2, (new_h - crop_h) // 2
+        if (left, top, crop_w, crop_h) != (0, 0, new_w, new_h):
+            image = image.crop((left, top, left + crop_w, top + crop_h))
+        return image
+    
+    def _buffer(self, name: str, shape: tuple, dtype) -> np.ndarray:
+        """当前线程的复用缓冲区（容量不足时重新分配）"""
+        buf = getattr(self._buffers, name, None)
+        if buf is None or len(buf) < shape[0]:
+            buf = np.empty(shape, dtype=dtype)
+            setattr(self._buffers, name, buf)
+        return buf[:shape[0]]
+    
+    def _pixel_values(self, images: List[Image.Image], reuse: bool = False) -> torch.Tensor:
+        """
+        批量预处理为NCHW float32张量
+        
+        逐张只做PIL缩放裁剪（uint8），归一化对整批一次向量化完成
+        
+        Args:
+            images: RGB PIL Image列表
+            reuse: 是否使用当前线程的复用缓冲区（返回的张量在下次调用前必须用完）
+        """
+        if self._preprocess_config is None:
+            return self.processor(images=images, return_tensors="pt")['pixel_values']
+        
+        config = self._preprocess_config
+        crop_h, crop_w = config["crop"]
+        n = len(images)
+        if reuse:
+            stage = self._buffer("stage", (n, crop_h, crop_w, 3), np.uint8)
+            out = self._buffer("pixels", (n, 3, crop_h, crop_w), np.float32)
+        else:
+            stage = np.empty((n, crop_h, crop_w, 3), dtype=np.uint8)
+            out = np.empty((n, 3, crop_h, crop_w), dtype=np.float32)
+        for i, image in enumerate(images):
+            stage[i] = np.asarray(self._resize_crop(image))
+        np.multiply(stage.transpose(0, 3, 1, 2), config["scale"], out=out)
+        np.subtract(out, config["offset"], out=out)
+        return torch.from_numpy(out)
     
     def preprocess_image(self, image: Union[str, Image.Image, np.ndarray]) -> torch.Tensor:
         """
@@ -54,16 +453,7 @@ class PLIPFeatureExtractor:
         Returns:
             预处理后的tensor
         """
-        if isinstance(image, str):
-            image = Image.open(image).convert('RGB')
-        elif isinstance(image, np.ndarray):
-            image = Image.fromarray(image).convert('RGB')
-        elif not isinstance(image, Image.Image):
-            raise ValueError(f"不支持的图像类型: {type(image)}")
-        
-        # 使用PLIP的processor处理图像
-        inputs = self.processor(images=image, return_tensors="pt")
-        return inputs['pixel_values'].to(self.device)
+        return self._pixel_values([self._to_pil(image)]).to(self.device)
     
     def extract_features(self, image: Union[str, Image.Image, np.ndarray]) -> np.ndarray:
         """
@@ -75,12 +465,8 @@ class PLIPFeatureExtractor:
         Returns:
             特征向量（numpy数组）
         """
-        with torch.no_grad():
-            pixel_values = self.preprocess_image(image)
-            outputs = self.model.get_image_features(pixel_values=pixel_values)
-            # 归一化特征向量
-            features = outputs / outputs.norm(dim=-1, keepdim=True)
-            return features.cpu().numpy().flatten()
+        pixel_values = self._pixel_values([self._to_pil(image)], reuse=True)
+        return self._image_features(pixel_values).flatten()
     
     def extract_features_batch(self, images: List[Union[str, Image.Image, np.ndarray]]) -> np.ndarray:
         """
@@ -92,11 +478,71 @@ class PLIPFeatureExtractor:
         Returns:
             特征向量矩阵（n_samples, feature_dim）
         """
-        features_list = []
-        for img in images:
-            features = self.extract_features(img)
-            features_list.append(features)
-        return np.array(features_list)
+        if not images:
+            return np.empty((0, 0), dtype=np.float32)
+        
+        # 整批一次前向计算
+        pixel_values = self._pixel_values([self._to_pil(img) for img in images], reuse=True)
+        return self._image_features(pixel_values)
+    
+    def extract_text_features_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        批量提取文本特征向量（PLIP文本塔），与图像特征处于同一向量空间
+        
+        已计算过的文本直接从LRU缓存返回，未命中的文本合并为一次前向计算
+        
+        Args:
+            texts: 文本列表（如形态学描述）
+            
+        Returns:
+            归一化后的特征向量矩阵（n_texts, feature_dim）
+        """
+        keys = [t.strip() for t in texts]
+        cached = {}
+        with self._text_cache_lock:
+            for key in keys:
+                if key in self._text_cache:
+                    self._text_cache.move_to_end(key)
+                    cached[key] = self._text_cache[key]
+        
+        missing = [key for key in dict.fromkeys(keys) if key not in cached]
+        self.text_cache_hits += len(keys) - len(missing)
+        self.text_cache_misses += len(missing)
+        if missing:
+            with torch.inference_mode():
+                inputs = self.processor(
+                    text=missing,
+                    return_tensors="pt",
+                    padding=True,
+                    truncation=True,
+                    max_length=TEXT_MAX_LENGTH
+                )
+                outputs = self._text_features(
+                    inputs['input_ids'].to(self.device),
+                    inputs['attention_mask'].to(self.device)
+                )
+                features = outputs / outputs.norm(dim=-1, keepdim=True)
+                features = features.cpu().numpy()
+            with self._text_cache_lock:
+                for key, feat in zip(missing, features):
+                    cached[key] = feat
+                    self._text_cache[key] = feat
+                while len(self._text_cache) > TEXT_CACHE_SIZE:
+                    self._text_cache.popitem(last=False)
+        
+        return np.array([cached[key] for key in keys])
+    
+    def extract_text_features(self, text: str) -> np.ndarray:
+        """
+        提取单条文本的特征向量
+        
+        Args:
+            text: 文本描述
+            
+        Returns:
+            特征向量（numpy数组）
+        """
+        return self.extract_text_features_batch([text])[0]
 
 
 # 全局模型实例（懒加载）
@@ -0,0 +1,350 @@
+"""
+多进程图像搜索服务（pre-fork）
+单进程的PLIP推理受GIL和单进程线程池限制，本脚本在一个SSE端口后面运行N个worker进程:
+
+- 父进程先加载PLIP模型和紧凑向量索引（内存映射），再fork出worker，模型权重以写时复制方式共享，
+  索引数据通过同一个文件的内存映射共享页缓存，N个worker不会产生N份模型和图谱
+- 每个worker在本机独立端口上运行 server.py 的MCP应用，intra-op线程数为 核数/worker数，避免线程超订
+- 父进程在对外端口上做负载均衡代理：新的SSE连接分配给当前连接数最少的worker，
+  并根据SSE的endpoint事件记录 session_id -> worker，之后该会话的消息请求转发到同一个worker
+
+用法:
+    python serve_multi.py --workers 4
+    curl http://localhost:18930/workers   # 各worker的连接数、消息数和内存（RSS/PSS）
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import server
+import plip_model
+from plip_model import configure_threads
+
+# 对外端口（与 server.py 一致）
+PORT = 18930
+# worker监听的本机端口起始值（worker i 使用 WORKER_BASE_PORT + i）
+WORKER_BASE_PORT = int(os.getenv("IMAGE_SEARCH_WORKER_PORT", "18931"))
+# 检查worker进程存活的间隔（秒）
+HEALTH_INTERVAL = 1.0
+
+_SESSION_PATTERN = re.compile(rb"session_id=([0-9a-fA-F-]+)")
+
+
+def _memory_mb(pid: int) -> Dict[str, float]:
+    """进程的RSS和PSS（按共享进程数分摊后的内存），单位MB"""
+    usage = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] in ("Rss:", "Pss:"):
+                    usage[parts[0][:-1].lower() + "_mb"] = round(int(parts[1]) / 1024, 1)
+    except OSError:
+        pass
+    return usage
+
+
+def preload():
+    """
+    在父进程中加载需要跨worker共享的只读数据（fork前调用）
+
+    父进程只用单线程计算，fork时不存在已启动的OpenMP线程池；
+    ChromaDB客户端不跨fork使用，由各worker自行打开
+    """
+    plip_model.NUM_THREADS = None
+    plip_model.INTEROP_THREADS = None
+    configure_threads(1)
+    if server.get_vector_index() is None:
+        print(f"未找到紧凑向量索引 {server.INDEX_PATH}，worker将各自通过ChromaDB检索")
+    server._get_extractor()
+    # 冻结已有对象，避免worker中的垃圾回收写入这些对象所在的页而触发复制
+    gc.collect()
+    gc.freeze()
+
+
+def run_worker(index: int, port: int, threads: int):
+    """worker进程入口：配置线程数，后台初始化分类器，在本机端口上运行MCP应用"""
+    import uvicorn
+
+    configure_threads(threads)
+    server._chroma_client = None
+    server._collection = None
+    server._slide_collections = {}
+    threading.Thread(target=server._warmup, name="warmup", daemon=True).start()
+    server.start_background_tasks()
+    print(f"  worker {index} (pid {os.getpid()}) 监听 127.0.0.1:{port}，{threads} 个线程")
+    uvicorn.run(server.mcp.http_app(transport="sse"), host="127.0.0.1", port=port, log_level="warning")
+
+
+class WorkerPool:
+    """worker进程表与会话路由表"""
+
+    def __init__(self, ports: List[int]):
+        self.workers = [
+            {"index": i, "port": port, "pid": None, "alive": True, "streams": 0, "requests": 0}
+            for i, port in enumerate(ports)
+        ]
+        self.sessions: Dict[str, dict] = {}
+
+    def pick(self) -> Optional[dict]:
+        """选择活动SSE连接最少的worker（相同时选已处理请求最少的）"""
+        alive = [w for w in self.workers if w["alive"]]
+        if not alive:
+            return None
+        return min(alive, key=lambda w: (w["streams"], w["requests"]))
+
+    def reap(self):
+        """回收已退出的worker，标记为不可用"""
+        for worker in self.workers:
+            if not worker["alive"]:
+                continue
+            try:
+                pid, status = os.waitpid(worker["pid"], os.WNOHANG)
+            except ChildProcessError:
+                pid, status = worker["pid"], -1
+            if pid:
+                worker["alive"] = False
+                print(f"⚠️  worker {worker['index']} (pid {pid}) 已退出，状态码 {status}")
+
+    def stats(self) -> List[dict]:
+        return [
+            {**w, **(_memory_mb(w["pid"]) if w["alive"] else {})}
+            for w in self.workers
+        ]
+
+
+def create_proxy_app(pool: WorkerPool):
+    """对外端口上的负载均衡代理（Starlette应用）"""
+    import httpx
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+    from starlette.routing import Route
+
+    client = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=5.0))
+
+    async def sse(request: Request):
+        worker = pool.pick()
+        if worker is None:
+            return JSONResponse({"error": "没有可用的worker"}, status_code=503)
+        try:
+            upstream = await client.send(
+                client.build_request("GET", f"http://127.0.0.1:{worker['port']}/sse",
+                                     headers={"accept": "text/event-stream"}),
+                stream=True
+            )
+        except httpx.HTTPError as e:
+            return JSONResponse({"error": f"worker {worker['index']} 不可用: {e}"}, status_code=503)
+
+        worker["streams"] += 1
+        state = {"session_id": None, "buffer": b""}
+
+        async def relay():
+            try:
+                async for chunk in upstream.aiter_raw():
+                    if state["session_id"] is None:
+                        # 第一个事件是endpoint事件，其中包含该会话的消息地址
+                        state["buffer"] += chunk
+                        match = _SESSION_PATTERN.search(state["buffer"])
+                        if match:
+                            state["session_id"] = match.group(1).decode()
+                            pool.sessions[state["session_id"]] = worker
+                            state["buffer"] = b""
+                    yield chunk
+            finally:
+                await upstream.aclose()
+                worker["streams"] -= 1
+                if state["session_id"]:
+                    pool.sessions.pop(state["session_id"], None)
+
+        return StreamingResponse(
+            relay(),
+            status_code=upstream.status_code,
+            media_type="text/event-stream",
+            headers={"cache-control": "no-store"}
+        )
+
+    async def messages(request: Request):
+        worker = pool.sessions.get(request.query_params.get("session_id", ""))
+        if worker is None or not worker["alive"]:
+            return JSONResponse({"error": "会话不存在或已断开"}, status_code=404)
+        worker["requests"] += 1
+        try:
+            upstream = await client.post(
+                f"http://127.0.0.1:{worker['port']}/messages/",
+                params=request.query_params,
+                content=await request.body(),
+                headers={"content-type": request.headers.get("content-type", "application/json")}
+            )
+        except httpx.HTTPError as e:
+            return JSONResponse({"error": f"worker {worker['index']} 不可用: {e}"}, status_code=503)
+        return Response(upstream.content, status_code=upstream.status_code,
+                        media_type=upstream.headers.get("content-type"))
+
+    async def blobs(request: Request):
+        # 暂存区目录由所有worker共用，上传可以转发给任意worker
+        worker = pool.pick()
+        if worker is None:
+            return JSONResponse({"error": "没有可用的worker"}, status_code=503)
+        try:
+            upstream = await client.request(
+                request.method,
+                f"http://127.0.0.1:{worker['port']}/blobs",
+                content=request.stream(),
+                headers={"content-type": request.headers.get("content-type", "application/octet-stream")}
+            )
+        except httpx.HTTPError as e:
+            return JSONResponse({"error": f"worker {worker['index']} 不可用: {e}"}, status_code=503)
+        return Response(upstream.content, status_code=upstream.status_code,
+                        media_type=upstream.headers.get("content-type"))
+
+    async def thumbs(request: Request):
+        # 缩略图缓存目录由所有worker共用，转发给任意worker
+        worker = pool.pick()
+        if worker is None:
+            return JSONResponse({"error": "没有可用的worker"}, status_code=503)
+        try:
+            upstream = await client.get(f"http://127.0.0.1:{worker['port']}{request.url.path}")
+        except httpx.HTTPError as e:
+            return JSONResponse({"error": f"worker {worker['index']} 不可用: {e}"}, status_code=503)
+        return Response(upstream.content, status_code=upstream.status_code,
+                        media_type=upstream.headers.get("content-type"),
+                        headers={k: v for k, v in upstream.headers.items() if k == "cache-control"})
+
+    async def metrics(request: Request):
+        # 汇总各worker的指标，每条样本加上 worker 标签；同一指标的样本需连续输出，按指标分组
+        families: Dict[str, List[str]] = {}
+        for worker in pool.workers:
+            if not worker["alive"]:
+                continue
+            try:
+                text = (await client.get(f"http://127.0.0.1:{worker['port']}/metrics")).text
+            except httpx.HTTPError:
+                continue
+            label = f'worker="{worker["index"]}"'
+            family = None
+            for line in text.splitlines():
+                if line.startswith("#"):
+                    family = line.split()[2]
+                    block = families.setdefault(family, [])
+                    if line not in block:
+                        block.insert(len([l for l in block if l.startswith("#")]), line)
+                elif line and family:
+                    name, _, value = line.rpartition(" ")
+                    if "{" in name:
+                        name = name.replace("{", "{" + label + ",", 1)
+                    else:
+                        name = name + "{" + label + "}"
+                    families[family].append(f"{name} {value}")
+        body = "\n".join(line for block in families.values() for line in block)
+        return PlainTextResponse(body + "\n", media_type="text/plain; version=0.0.4")
+
+    async def workers(request: Request):
+        return JSONResponse({
+            "workers": pool.stats(),
+            "proxy": {"pid": os.getpid(), **_memory_mb(os.getpid())},
+            "sessions": len(pool.sessions)
+        })
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        async def monitor():
+            while True:
+                pool.reap()
+                if not any(w["alive"] for w in pool.workers):
+                    print("错误: 所有worker均已退出")
+                    os.kill(os.getpid(), signal.SIGTERM)
+                    return
+                await asyncio.sleep(HEALTH_INTERVAL)
+
+        task = asyncio.create_task(monitor())
+        yield
+        task.cancel()
+        await client.aclose()
+
+    return Starlette(
+        routes=[
+            Route("/sse", sse, methods=["GET"]),
+            Route("/messages/", messages, methods=["POST"]),
+            Route("/blobs", blobs, methods=["PUT", "POST"]),
+            Route("/thumbs/{key}/{size}", thumbs, methods=["GET"]),
+            Route("/metrics", metrics, methods=["GET"]),
+            Route("/workers", workers, methods=["GET"]),
+        ],
+        lifespan=lifespan
+    )
+
+
+def serve(n_workers: int, port: int = PORT, threads: Optional[int] = None):
+    """
+    启动多进程服务
+
+    Args:
+        n_workers: worker进程数
+        port: 对外SSE端口
+        threads: 每个worker的intra-op线程数，None时为 核数 // worker数
+    """
+    import uvicorn
+
+    threads = threads or max(1, (os.cpu_count() or 1) // n_workers)
+    start = time.perf_counter()
+    print("正在父进程中预加载模型和向量索引...")
+    preload()
+    print(f"✅ 预加载完成，用时 {time.perf_counter() - start:.2f} s")
+
+    pool = WorkerPool([WORKER_BASE_PORT + i for i in range(n_workers)])
+    for worker in pool.workers:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(worker["index"], worker["port"], threads)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        worker["pid"] = pid
+
+    print(f"负载均衡代理监听: http://0.0.0.0:{port}/sse（{n_workers} 个worker）")
+    try:
+        uvicorn.run(create_proxy_app(pool), host="0.0.0.0", port=port, log_level="warning")
+    finally:
+        for worker in pool.workers:
+            if worker["alive"]:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(worker["pid"], signal.SIGTERM)
+        for worker in pool.workers:
+            with contextlib.suppress(ChildProcessError):
+                os.waitpid(worker["pid"], 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多进程图谱以图搜图 MCP Server")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker进程数（默认: CPU核数）")
+    parser.add_argument("--port", type=int, default=PORT, help=f"对外SSE端口（默认: {PORT}）")
+    parser.add_argument("--threads", type=int, default=None, help="每个worker的线程数（默认: 核数/worker数）")
+
+    args = parser.parse_args()
+
+    if sys.platform == "win32":
+        print("错误: 多进程模式依赖fork，不支持Windows")
+        sys.exit(1)
+
+    try:
+        serve(args.workers, args.port, args.threads)
+    except KeyboardInterrupt:
+        print("\n\n服务器被用户中断")
+    except Exception as e:
+        print(f"\n错误: {e}")
+        import traceback
+        traceback.print_exc()
@@ -1,22 +1,44 @@
 """
 图谱以图搜图 MCP Server
 使用FastMCP提供图像搜索服务
+
+torch / transformers / chromadb 均在首次使用时才导入，服务器启动后在后台线程预加载模型和索引，
+SSE端口无需等待模型加载即可就绪
 """
-import base64
-import io
+import time
+
+_PROCESS_START = time.perf_counter()
+
+import asyncio
 import json
 import os
-from typing import List, Dict
+import re
+import shutil
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from typing import List, Dict, Optional, Union
 from PIL import Image
 import numpy as np
 from fastmcp import FastMCP
-import chromadb
-from chromadb.config import Settings
-from plip_model import get_extractor, PLIPEmbeddingFunction
+from blob_store import MAX_CHUNK_BYTES, get_blob_store, is_blob_handle
+from case_log import CASES_PATH, CaseLog, DeltaIndex, encode_vector
+from classifier import TileClassifier
+from image_io import decode_base64, image_extension, open_image
+from thumbnails import DEFAULT_THUMB_SIZE, THUMB_MIME, get_thumbnail_cache
+from slide_index import AGGREGATION_METHODS, aggregate_tiles, load_codebook, slide_collection_name
+from vector_store import (
+    MMR_CANDIDATES, AtlasVectorIndex, current_version, l2_distance, mmr_select, publish_snapshot, resolve_index_path,
+    set_current
+)
+
+# 共用的指标采集与日志组件（仓库根目录下的 mcp_common）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp_common import get_logger, install_metrics, register_cache, stage, timed  # noqa: E402
 
-# 配置代理（用于模型下载和图片下载）
-os.environ['HTTP_PROXY'] = 'http://10.196.180.160:7897'
-os.environ['HTTPS_PROXY'] = 'http://10.196.180.160:7897'
+# 图片下载代理（与plip_model.py使用同一环境变量，设为空字符串则不使用代理）
+PROXY_URL = os.getenv("PLIP_PROXY", "http://10.196.180.160:7897")
 
 # 检查requests库是否可用
 HAS_REQUESTS = False
@@ -29,14 +51,64 @@ except ImportError:
 # 数据库配置
 DB_PATH = "./pathology_atlas_db"
 COLLECTION_NAME = "pathology_cases"
+# 文件路径的最大长度（更长的输入直接按Base64处理）
+MAX_PATH_LENGTH = 4096
+# 紧凑向量索引目录（vector_store.py export 导出），存在时图块搜索优先使用它
+INDEX_PATH = os.getenv("ATLAS_INDEX_PATH", "./atlas_index")
+# 两阶段搜索（索引带PCA预筛选向量时）的预筛选候选数，0表示使用 vector_store 的默认值
+SHORTLIST = int(os.getenv("ATLAS_SHORTLIST", "0"))
+# 检查快照当前版本（CURRENT）变化的间隔（秒），0表示只通过 reload_atlas_index 工具切换
+INDEX_WATCH_INTERVAL = float(os.getenv("ATLAS_INDEX_WATCH", "30"))
+# 读取其他进程新增病例的间隔（秒）
+CASE_POLL_INTERVAL = float(os.getenv("ATLAS_CASE_POLL", "2"))
+# 增量合并进主索引的间隔（秒）和增量条数上限（达到时立即合并）
+COMPACT_INTERVAL = float(os.getenv("ATLAS_COMPACT_INTERVAL", "600"))
+DELTA_MAX_CASES = int(os.getenv("ATLAS_DELTA_MAX", "2000"))
+# 新增病例的id（同时用作图片副本的文件名）
+_CASE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
 
 # 初始化MCP服务器
 mcp = FastMCP(name="Pathology Atlas Image Search MCP")
+install_metrics(mcp, "image_search")
+log = get_logger("image_search")
 
 # 全局变量
 _chroma_client = None
 _collection = None
 _extractor = None
+_classifier = None
+# 当前分类器构建时是否读取了图谱（False 表示仅文本提示，图谱可用后重建）
+_classifier_has_atlas = False
+_slide_collections = {}
+_vector_index = None
+# 当前加载的索引目录和版本
+_vector_index_info = {}
+# 主索引中的记录id（判断新增病例是否已合并）
+_vector_index_ids = frozenset()
+# 新增病例的预写日志和增量索引
+_case_log = None
+_delta = DeltaIndex()
+_compact_event = threading.Event()
+_case_log_lock = threading.Lock()
+_extractor_lock = threading.Lock()
+_index_lock = threading.Lock()
+_classifier_lock = threading.Lock()
+# 启动各阶段耗时（秒）
+STARTUP_TIMINGS = {}
+# 结果中缩略图的返回方式
+THUMBNAIL_MODES = ("none", "handle", "inline")
+# 没有 thumb 元数据的旧索引记录：图片路径 -> 首次生成的缩略图键（LRU，淘汰后再次需要时重新计算内容哈希）
+_lazy_thumb_keys = OrderedDict()
+_lazy_thumb_lock = threading.Lock()
+LAZY_THUMB_KEYS_MAX = 50000
+register_cache(
+    "thumbnails",
+    lambda: (get_thumbnail_cache().hits, get_thumbnail_cache().misses)
+)
+register_cache(
+    "plip_text",
+    lambda: (_extractor.text_cache_hits, _extractor.text_cache_misses) if _extractor is not None else (0, 0)
+)
 
 
 def get_collection():
@@ -50,7 +122,11 @@ def get_collection():
                 f"请先运行 indexer.py 构建索引"
             )
         
-        print(f"正在连接ChromaDB数据库: {DB_PATH}")
+        import chromadb
+        from chromadb.config import Settings
+        from plip_model import PLIPEmbeddingFunction
+        
+        log.info("正在连接ChromaDB数据库", path=DB_PATH)
         _chroma_client = chromadb.PersistentClient(
             path=DB_PATH,
             settings=Settings(anonymized_telemetry=False)
@@ -63,81 +139,692 @@ def get_collection():
         )
         
         count = _collection.count()
-        print(f"数据库连接成功，包含 {count} 条记录")
+        log.info("数据库连接成功", records=count)
     
     return _collection
 
 
-def decode_image(image_data: str) -> Image.Image:
+def _get_extractor():
+    """获取PLIP特征提取器（懒加载，并发调用时等待同一次加载完成）"""
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                log.info("初始化PLIP特征提取器")
+                from plip_model import get_extractor
+                _extractor = get_extractor()
+    return _extractor
+
+
+def _load_vector_index(path: str) -> AtlasVectorIndex:
+    """加载索引并做一次预热查询（把向量页读入页缓存），切换后的首批查询不会变慢"""
+    start = time.perf_counter()
+    index = AtlasVectorIndex.load(path)
+    if len(index):
+        probe = np.ones(index.dim, dtype=np.float32) / np.sqrt(index.dim)
+        index.search(probe, 1, collapse=index.representatives is not None)
+    mem = index.memory_bytes()
+    log.info(
+        "向量索引加载成功",
+        path=path,
+        records=len(index),
+        dtype=index.dtype,
+        resident_mb=round(mem['codes'] / 2 ** 20, 1),
+        float32_mb=round(mem['float32_equivalent'] / 2 ** 20, 1),
+        seconds=round(time.perf_counter() - start, 2)
+    )
+    return index
+
+
+def get_vector_index():
+    """获取紧凑向量索引（懒加载），未导出索引时返回None"""
+    if _vector_index is None and resolve_index_path(INDEX_PATH) is not None:
+        with _index_lock:
+            if _vector_index is None:
+                _swap_vector_index(resolve_index_path(INDEX_PATH))
+    return _vector_index
+
+
+def _swap_vector_index(path: str):
+    """加载新索引后替换全局引用（调用方持有 _index_lock）"""
+    global _vector_index, _vector_index_info, _vector_index_ids
+    index = _load_vector_index(path)
+    # 单次赋值即原子切换：进行中的查询已持有旧索引的引用，会在旧索引上完成
+    _vector_index = index
+    _vector_index_ids = frozenset(index.ids)
+    # 已合并进新版本的新增病例从增量中移除（查询按case_id去重，切换与移除之间不会重复返回）
+    _delta.drop(_vector_index_ids)
+    _vector_index_info = {
+        "path": path,
+        "version": os.path.basename(path) if current_version(INDEX_PATH) else None,
+        "records": len(index),
+        "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+
+def reload_vector_index(version: Optional[str] = None, force: bool = False) -> dict:
     """
-    将Base64编码的图片、文件路径或URL解码为PIL Image
-    支持多种输入格式，兼容Nexent平台的文件处理方式
+    重新加载紧凑向量索引：在当前线程加载新版本并预热，完成后原子切换，加载期间查询继续使用旧索引
+
+    Args:
+        version: 快照版本名（默认 CURRENT 指向的版本；普通索引目录时忽略）
+        force: 目录未变化时也重新加载（原地重建的普通索引目录）
+
+    Returns:
+        {"changed": 是否切换, "previous": 切换前的索引信息, **当前索引信息}
+    """
+    path = resolve_index_path(INDEX_PATH, version)
+    if path is None:
+        raise FileNotFoundError(f"向量索引不存在: {INDEX_PATH}" + (f"（版本 {version}）" if version else ""))
+    with _index_lock:
+        previous = dict(_vector_index_info)
+        if _vector_index is not None and path == previous.get("path") and not force:
+            return {"changed": False, **previous}
+        _swap_vector_index(path)
+        info = dict(_vector_index_info)
+        log.info("向量索引已切换", previous=previous.get("version") or previous.get("path"), current=info["version"] or path)
+    _refresh_classifier()
+    return {"changed": True, "previous": previous or None, **info}
+
+
+def _watch_index():
+    """后台检查快照根目录的当前版本，变化时热切换"""
+    while True:
+        time.sleep(INDEX_WATCH_INTERVAL)
+        version = current_version(INDEX_PATH)
+        if not version or version == _vector_index_info.get("version"):
+            continue
+        try:
+            reload_vector_index(version)
+        except Exception as e:
+            log.warning("向量索引热切换失败，继续使用当前版本", version=version, error=str(e))
+
+
+# ---------- 在线新增病例 ----------
+
+def _get_case_log() -> CaseLog:
+    global _case_log
+    if _case_log is None:
+        with _case_log_lock:
+            if _case_log is None:
+                _case_log = CaseLog(CASES_PATH)
+    return _case_log
+
+
+def _in_main(ids: List[str]) -> set:
+    """已在主索引中的id（有紧凑向量索引时查内存中的id集合，否则查询ChromaDB）"""
+    if not ids:
+        return set()
+    if get_vector_index() is not None:
+        return {i for i in ids if i in _vector_index_ids}
+    if not os.path.exists(DB_PATH):
+        return set()
+    return set(get_collection().get(ids=list(ids), include=[])['ids'])
+
+
+def sync_cases() -> int:
+    """把预写日志中新追加的记录（包括其他进程写入的）加入增量索引，返回新加入的条数"""
+    records, rewritten = _get_case_log().read_new()
+    if rewritten:
+        # 其他进程压缩后重写了日志：不在新日志中的记录已合并，主索引包含它们后才从增量移除
+        remaining = {r['id'] for r in records}
+        _delta.drop(_in_main([i for i in _delta.ids if i not in remaining]))
+    merged = _in_main([r['id'] for r in records])
+    added = _delta.add([r for r in records if r['id'] not in merged])
+    if len(_delta) >= DELTA_MAX_CASES:
+        _compact_event.set()
+    return added
+
+
+def add_case(
+    image: Union[Image.Image, str, bytes],
+    features: np.ndarray,
+    diagnosis: str,
+    source: str = "",
+    case_id: str = "",
+    description: str = ""
+) -> dict:
+    """
+    新增确诊病例：保存图片副本，写入预写日志（fsync后返回），并加入增量索引，立即可被检索
     
     Args:
-        image_data: 可以是以下格式之一：
-                   - Base64编码字符串（支持data:image/...格式）
-                   - 本地文件路径
-                   - HTTP/HTTPS URL（会下载图片）
+        image: 归档的病例图片，应为上传的原始内容（文件路径或字节，原样保存）；
+               传入PIL Image时保存为PNG（用于检索的解码图像可能是缩小解码的，不要传入）
+        features: 图片特征向量
+    
+    Returns:
+        写入的元数据
+    """
+    diagnosis = (diagnosis or "").strip()
+    if not diagnosis:
+        raise ValueError("diagnosis 不能为空")
+    case_id = case_id.strip() or f"confirmed_{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    if not _CASE_ID_PATTERN.match(case_id):
+        raise ValueError(f"case_id 只能包含字母、数字、'_'、'-'、'.'（最长128个字符）: {case_id}")
+    case_log = _get_case_log()
+    # 检查id和写入日志之间持有锁，并发新增同一case_id时只有一个成功（不会覆盖图片）
+    with case_log.add_lock():
+        sync_cases()
+        if case_id in _delta.ids or _in_main([case_id]):
+            raise ValueError(f"病例已存在: {case_id}")
+    
+        if isinstance(image, Image.Image):
+            image_path = os.path.abspath(os.path.join(case_log.images_dir, f"{case_id}.png"))
+            image.save(image_path)
+        else:
+            image_path = os.path.abspath(os.path.join(case_log.images_dir, f"{case_id}{image_extension(image)}"))
+            if isinstance(image, str):
+                shutil.copyfile(image, image_path)
+            else:
+                with open(image_path, "wb") as f:
+                    f.write(image)
+        metadata = {
+            "diagnosis": diagnosis,
+            "source": source or "Online Confirmed",
+            "filename": os.path.basename(image_path),
+            "image_path": image_path,
+            "case_id": case_id,
+            "added_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            # 新增病例各自成为一个近重复组
+            "dup_group": case_id
+        }
+        if description:
+            metadata["description"] = description
+        try:
+            metadata["thumb"] = get_thumbnail_cache().generate(image_path)
+        except Exception as e:
+            log.warning("新增病例缩略图生成失败", case_id=case_id, error=str(e))
+        case_log.append({"id": case_id, "embedding": encode_vector(features), "metadata": metadata})
+    sync_cases()
+    log.info("新增确诊病例", case_id=case_id, diagnosis=diagnosis, pending=len(_delta))
+    return metadata
+
+
+def compact_cases() -> dict:
+    """
+    把增量合并进主索引，不阻塞查询
+    
+    - 有ChromaDB时写入（upsert，重试幂等），之后离线重建/导出的索引也包含这些病例
+    - 有紧凑向量索引时在后台构建追加后的新索引，发布为新快照并热切换
+      （索引必须是快照根目录；普通导出目录不合并，病例保留在预写日志和增量索引中）
+    - 最后从预写日志删除已合并的记录；多进程时只有取得压缩锁的进程执行
+    """
+    case_log = _get_case_log()
+    with case_log.compaction_lock() as acquired:
+        if not acquired:
+            return {"compacted": 0, "skipped": "其他进程正在合并"}
+        # 基于最新发布的版本追加（可能已有其他进程或离线任务发布了新版本）
+        if resolve_index_path(INDEX_PATH) is not None:
+            reload_vector_index()
+        sync_cases()
+        ids, vectors, metadatas = _delta.snapshot()
+        if not ids:
+            return {"compacted": 0}
+        if get_vector_index() is None and not os.path.exists(DB_PATH):
+            return {"compacted": 0, "skipped": "没有可合并的主索引，新增病例保留在预写日志中"}
+        if get_vector_index() is not None and current_version(INDEX_PATH) is None:
+            # 普通导出目录：发布快照会把它变成快照根目录，之后 export --out 到同一路径不再生效
+            return {
+                "compacted": 0,
+                "skipped": "紧凑向量索引不是快照根目录（请用 export --publish 导出），新增病例保留在预写日志中"
+            }
+        
+        start = time.perf_counter()
+        if os.path.exists(DB_PATH):
+            get_collection().upsert(ids=ids, embeddings=vectors.tolist(), metadatas=metadatas)
+        version = None
+        index = get_vector_index()
+        if index is not None:
+            extended = index.extended(ids, vectors, metadatas)
+            if _vector_index is not index:
+                return {"compacted": 0, "skipped": "合并期间主索引已切换，下次重试"}
+            version = publish_snapshot(extended, INDEX_PATH)
+            reload_vector_index(version)
         
+        compacted = set(ids)
+        remaining = case_log.rewrite(lambda r: r['id'] not in compacted)
+        _delta.drop(compacted)
+        log.info(
+            "新增病例已合并进主索引",
+            compacted=len(ids),
+            remaining=remaining,
+            version=version,
+            seconds=round(time.perf_counter() - start, 2)
+        )
+        return {"compacted": len(ids), "remaining": remaining, "index_version": version}
+
+
+def _case_maintenance():
+    """后台读取其他进程新增的病例，定期或增量达到上限时合并"""
+    last_compaction = time.monotonic()
+    while True:
+        triggered = _compact_event.wait(CASE_POLL_INTERVAL)
+        try:
+            sync_cases()
+            if len(_delta) and (triggered or time.monotonic() - last_compaction >= COMPACT_INTERVAL):
+                _compact_event.clear()
+                compact_cases()
+                last_compaction = time.monotonic()
+        except Exception as e:
+            _compact_event.clear()
+            log.warning("新增病例同步/合并失败，稍后重试", error=str(e))
+
+
+def start_background_tasks():
+    """启动索引版本检查和新增病例同步/合并线程（单进程和每个worker各启动一次）"""
+    if INDEX_WATCH_INTERVAL > 0:
+        threading.Thread(target=_watch_index, name="index-watch", daemon=True).start()
+    threading.Thread(target=_case_maintenance, name="case-maintenance", daemon=True).start()
+
+
+def check_atlas():
+    """确认图谱索引可用（紧凑向量索引或ChromaDB），不可用时抛出FileNotFoundError"""
+    if get_vector_index() is None:
+        get_collection()
+
+
+def _build_where(filters: Optional[Dict]) -> Optional[Dict]:
+    """把过滤条件转换为ChromaDB的where表达式"""
+    if not filters:
+        return None
+    clauses = []
+    if filters.get("diagnoses"):
+        clauses.append({"diagnosis": {"$in": list(filters["diagnoses"])}})
+    if filters.get("exclude_diagnoses"):
+        clauses.append({"diagnosis": {"$nin": list(filters["exclude_diagnoses"])}})
+    if filters.get("sources"):
+        clauses.append({"source": {"$in": list(filters["sources"])}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _make_filters(
+    diagnoses: Optional[List[str]],
+    exclude_diagnoses: Optional[List[str]],
+    sources: Optional[List[str]]
+) -> Optional[Dict]:
+    """整理工具的过滤参数，没有过滤条件时返回None"""
+    filters = {
+        "diagnoses": diagnoses or None,
+        "exclude_diagnoses": exclude_diagnoses or None,
+        "sources": sources or None
+    }
+    return filters if any(filters.values()) else None
+
+
+def _query_atlas(
+    query_features: np.ndarray,
+    top_k: int,
+    filters: Optional[Dict] = None,
+    collapse: bool = True,
+    diversity: float = 0.0
+) -> List[tuple]:
+    """
+    在图谱中查询最相似的图块（主索引 + 尚未合并的新增病例），参数和返回值同 _query_main
+    
+    新增病例按距离并入结果；diversity只作用于主索引，新增病例合并进主索引后参与MMR
+    """
+    hits = _query_main(query_features, top_k, filters, collapse, diversity)
+    delta_hits = _delta.search(query_features, top_k, filters)
+    if not delta_hits:
+        return hits
+    # 合并与移除增量之间的短暂窗口内，同一病例可能同时出现在主索引和增量中
+    seen = {meta.get('case_id') for meta, _, _ in hits if meta.get('case_id')}
+    merged = hits + [
+        (meta, float(l2_distance(score)), 1 if collapse else None)
+        for meta, score in delta_hits if meta.get('case_id') not in seen
+    ]
+    merged.sort(key=lambda hit: hit[1])
+    return merged[:top_k]
+
+
+def _query_main(
+    query_features: np.ndarray,
+    top_k: int,
+    filters: Optional[Dict] = None,
+    collapse: bool = True,
+    diversity: float = 0.0
+) -> List[tuple]:
+    """
+    在主索引（紧凑向量索引或ChromaDB）中查询最相似的图块
+    
+    Args:
+        query_features: 归一化查询特征向量
+        top_k: 返回数量
+        filters: 元数据过滤条件（diagnoses / exclude_diagnoses / sources），
+                 在搜索前过滤，满足条件的记录足够时总是返回top_k条
+        collapse: 折叠近重复（同一近重复组只返回代表图块，需要索引时计算的 dup_group）
+        diversity: MMR多样性权重（0为纯相似度排序）
+    
     Returns:
-        PIL Image对象
+        [(元数据, 距离, 近重复组大小), ...]，距离为归一化向量的平方L2距离（与ChromaDB默认一致），
+        组大小未知时为None
     """
-    # 检查是否是HTTP/HTTPS URL
+    index = get_vector_index()
+    if index is not None:
+        # 只扫描过滤条件对应的预建分区；折叠近重复时只扫描各组的代表行，不需要多取候选
+        rows = index.filter_rows(**filters) if filters else None
+        hits = index.search(
+            query_features, top_k, rows=rows, collapse=collapse, diversity=diversity, shortlist=SHORTLIST or None
+        )
+        return [
+            (index.metadatas[row], float(l2_distance(score)), index.group_size(row) if collapse else None)
+            for row, score in hits
+        ]
+    
+    # 注意：ChromaDB的query方法在使用自定义embedding function时，
+    # 可以直接传入query_embeddings（已提取的特征向量）
+    collection = get_collection()
+    where = _build_where(filters)
+    # ChromaDB没有代表行分区，折叠近重复或MMR时多取候选
+    n_candidates = top_k * MMR_CANDIDATES if collapse or diversity > 0 else top_k
+    max_results = min(n_candidates, collection.count())
+    if max_results == 0:
+        return []
+    query_kwargs = {"where": where} if where else {}
+    results = collection.query(
+        query_embeddings=[query_features.tolist()],
+        n_results=max_results,
+        include=["metadatas", "distances", "embeddings"] if diversity > 0 else ["metadatas", "distances"],
+        **query_kwargs
+    )
+    if not results['ids'] or not results['ids'][0]:
+        return []
+    metadatas, distances = results['metadatas'][0], results['distances'][0]
+    candidates = list(range(len(metadatas)))
+    if collapse:
+        seen = set()
+        kept = []
+        for i in candidates:
+            group = (metadatas[i] or {}).get('dup_group', results['ids'][0][i])
+            if group not in seen:
+                seen.add(group)
+                kept.append(i)
+        candidates = kept
+    if diversity > 0:
+        relevance = 1.0 - np.asarray([distances[i] for i in candidates], dtype=np.float32) / 2.0
+        vectors = np.asarray([results['embeddings'][0][i] for i in candidates], dtype=np.float32)
+        candidates = [candidates[j] for j in mmr_select(relevance, vectors, top_k, diversity)]
+    return [(metadatas[i], distances[i], None) for i in candidates[:top_k]]
+
+
+def get_slide_collection(method: str):
+    """获取切片级collection（懒加载）"""
+    if method not in _slide_collections:
+        get_collection()
+        try:
+            _slide_collections[method] = _chroma_client.get_collection(name=slide_collection_name(method))
+        except Exception:
+            raise FileNotFoundError(
+                f"切片级索引 {slide_collection_name(method)} 不存在\n"
+                f"请先运行 slide_index.py 构建切片索引"
+            )
+    return _slide_collections[method]
+
+
+def _build_classifier():
+    """预计算类别文本特征和图谱类别中心后替换全局分类器（调用方持有 _classifier_lock）"""
+    global _classifier, _classifier_has_atlas
+    try:
+        collection = get_collection()
+    except FileNotFoundError:
+        log.warning("图谱数据库不存在，分类器仅使用文本提示")
+        collection = None
+    _classifier = TileClassifier(_get_extractor(), collection)
+    _classifier_has_atlas = collection is not None
+
+
+def _get_classifier():
+    """获取零样本分类器（懒加载；之前仅用文本提示构建、现在图谱已可用时重建）"""
+    if _classifier is None or (not _classifier_has_atlas and os.path.exists(DB_PATH)):
+        with _classifier_lock:
+            if _classifier is None or (not _classifier_has_atlas and os.path.exists(DB_PATH)):
+                _build_classifier()
+    return _classifier
+
+
+def _refresh_classifier():
+    """图谱索引切换后重新计算分类器的类别中心（分类器尚未构建时跳过，首次调用时再构建）"""
+    if _classifier is None:
+        return
+    try:
+        with _classifier_lock:
+            _build_classifier()
+    except Exception as e:
+        log.warning("索引切换后分类器重建失败，继续使用旧分类器", error=str(e))
+
+
+def read_image_source(image_data: str) -> Union[str, bytes]:
+    """
+    图片输入的原始内容（不解码）：图片句柄和本地文件返回文件路径，URL和Base64返回原始字节
+    
+    Args:
+        image_data: 图片句柄、Base64编码、文件路径或HTTP/HTTPS URL（格式见 decode_image）
+    """
+    if is_blob_handle(image_data):
+        return get_blob_store().path(image_data)
     if image_data.startswith(('http://', 'https://')):
         if not HAS_REQUESTS:
             raise ValueError("requests库未安装，无法从URL下载图片。请安装: pip install requests")
         try:
-            print(f"正在从URL下载图片: {image_data}")
-            response = requests.get(image_data, timeout=30)
+            log.debug("正在从URL下载图片", url=image_data)
+            proxies = {"http": PROXY_URL, "https": PROXY_URL} if PROXY_URL else None
+            response = requests.get(image_data, timeout=30, proxies=proxies)
             response.raise_for_status()
-            image = Image.open(io.BytesIO(response.content))
+            return response.content
         except Exception as e:
             raise ValueError(f"无法从URL下载图片: {e}")
+    # 本地文件路径（Base64载荷远长于路径，不做文件系统查询）
+    if len(image_data) <= MAX_PATH_LENGTH and os.path.exists(image_data):
+        log.debug("从文件路径读取图片", path=image_data)
+        return image_data
+    # 否则认为是Base64编码（支持data:image/...前缀）
+    log.debug("检测到Base64编码格式", length=len(image_data))
+    try:
+        return decode_base64(image_data)
+    except Exception as e:
+        raise ValueError(f"Base64解码失败: {e}。请确保输入是正确的Base64编码或文件路径")
+
+
+@timed("decode")
+def decode_image(image_data: str) -> Image.Image:
+    """
+    将Base64编码的图片、文件路径或URL解码为PIL Image
+    支持多种输入格式，兼容Nexent平台的文件处理方式
     
-    # 检查是否是本地文件路径
-    elif os.path.exists(image_data):
-        print(f"从文件路径读取图片: {image_data}")
-        image = Image.open(image_data)
+    Args:
+        image_data: 可以是以下格式之一：
+                   - 图片句柄 blob:<sha256>（upload_image_chunk / PUT /blobs 上传后返回）
+                   - Base64编码字符串（支持data:image/...格式）
+                   - 本地文件路径
+                   - HTTP/HTTPS URL（会下载图片）
+        
+    Returns:
+        RGB PIL Image对象（JPEG按PLIP输入尺寸缩小解码）
+    """
+    return _open_source(read_image_source(image_data))
+
+
+def _open_source(source: Union[str, bytes]) -> Image.Image:
+    """解码 read_image_source 返回的原始内容（字节解码失败时给出输入格式提示）"""
+    if isinstance(source, str):
+        return open_image(source)
+    try:
+        return open_image(source)
+    except Exception as e:
+        raise ValueError(f"图片解码失败: {e}。请确保输入是正确的Base64编码或文件路径")
+
+
+def describe_input(image_data: str) -> str:
+    """输入图片的简短描述（用于日志和错误信息，不输出Base64内容）"""
+    if is_blob_handle(image_data) or image_data.startswith(('http://', 'https://')):
+        return image_data[:300]
+    if len(image_data) <= MAX_PATH_LENGTH and os.path.exists(image_data):
+        return f"文件 {image_data}"
+    return f"Base64数据（{len(image_data)} 字符）"
+
+
+def _search_by_embedding(
+    query_features: np.ndarray,
+    top_k: int,
+    note: str = None,
+    filters: Optional[Dict] = None,
+    collapse_duplicates: bool = True,
+    diversity: float = 0.0,
+    thumbnails: str = "none",
+    thumbnail_size: int = DEFAULT_THUMB_SIZE
+) -> str:
+    """
+    用特征向量在图谱库中搜索，并格式化为工具返回的JSON
     
-    # 否则认为是Base64编码
-    else:
-        print("检测到Base64编码格式")
-        # 移除data URL前缀（如果有）
-        if "," in image_data:
-            image_data = image_data.split(",")[1]
+    Args:
+        query_features: 归一化后的查询特征向量（图像或文本）
+        top_k: 返回数量
+        note: 每条结果附带的说明
+        filters: 元数据过滤条件
+        collapse_duplicates: 是否折叠近重复图块
+        diversity: MMR多样性权重（0-1）
+        thumbnails: 结果中的缩略图，none / handle（缩略图句柄）/ inline（data URL）
+        thumbnail_size: 缩略图边长（取不小于该值的一级）
         
-        try:
-            # Base64解码
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
-        except Exception as e:
-            raise ValueError(f"Base64解码失败: {e}。请确保输入是正确的Base64编码或文件路径")
+    Returns:
+        JSON字符串，包含相似病例列表
+    """
+    if thumbnails not in THUMBNAIL_MODES:
+        raise ValueError(f"thumbnails 可选: {', '.join(THUMBNAIL_MODES)}")
+    diversity = max(0.0, min(float(diversity or 0.0), 1.0))
+    with stage("search"):
+        hits = _query_atlas(query_features, top_k, filters, collapse=collapse_duplicates, diversity=diversity)
+    if not hits:
+        if filters:
+            return json.dumps({
+                "query_status": "success",
+                "total_results": 0,
+                "cases": [],
+                "filters": filters
+            }, indent=2, ensure_ascii=False)
+        return json.dumps({
+            "query_status": "error",
+            "error": "数据库为空，请先运行 indexer.py 构建索引"
+        }, indent=2, ensure_ascii=False)
+    
+    # 格式化结果
+    found_cases = []
+    
+    for i, (meta, dist, group_size) in enumerate(hits):
+        # 计算相似度得分（距离越小越相似，转换为0-100分）
+        # ChromaDB使用余弦距离，范围通常是0-2，这里转换为相似度百分比
+        similarity_score = max(0, (1 - dist) * 100)
+        
+        case_info = {
+            "rank": i + 1,
+            "diagnosis": meta.get('diagnosis', 'Unknown'),
+            "similarity_score": f"{similarity_score:.2f}%",
+            "distance": f"{dist:.4f}",
+            "image_path": meta.get('image_path', ''),
+            "filename": meta.get('filename', ''),
+            "source": meta.get('source', 'Internal Atlas'),
+            "note": note or "Visual match based on tissue architecture and morphological features."
+        }
+        # 折叠掉的近重复图块数（同一切片相邻图块、增强版本等）
+        if group_size and group_size > 1:
+            case_info["near_duplicates"] = group_size - 1
+        # 索引时按感知哈希合并掉的相同图块数（id记录在元数据 aliases 中）
+        if meta.get('alias_count'):
+            case_info["alias_count"] = meta['alias_count']
+        if thumbnails != "none":
+            case_info["thumbnail"] = _thumbnail(meta, thumbnails, thumbnail_size)
+        # 在线新增的确诊病例
+        if 'case_id' in meta:
+            case_info["case_id"] = meta['case_id']
+            case_info["added_at"] = meta.get('added_at')
+        # 来自全切片图像（wsi_tiler.py）的图块附带切片和坐标信息
+        if 'slide_id' in meta:
+            case_info["slide_id"] = meta['slide_id']
+            case_info["coordinates"] = {"x": meta.get('x'), "y": meta.get('y'), "level": meta.get('level')}
+        
+        found_cases.append(case_info)
+    
+    log.debug("搜索完成", top_k=top_k, found=len(found_cases))
     
-    # 转换为RGB（确保兼容性）
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
+    # 返回JSON格式结果
+    result = {
+        "query_status": "success",
+        "total_results": len(found_cases),
+        "cases": found_cases
+    }
+    if filters:
+        result["filters"] = filters
+    if diversity > 0:
+        result["diversity"] = diversity
     
-    return image
+    return json.dumps(result, indent=2, ensure_ascii=False)
+
+
+def _thumbnail(meta: dict, mode: str, size: int) -> Optional[str]:
+    """
+    结果图块的缩略图句柄或data URL
+    
+    索引时已生成缩略图的记录只读取缓存（内存LRU或小文件）；旧索引没有 thumb 元数据时
+    首次从原图生成一次，之后同样走缓存；原图不可用时返回None
+    """
+    cache = get_thumbnail_cache()
+    key = meta.get('thumb')
+    try:
+        if key is None:
+            image_path = meta.get('image_path', '')
+            with _lazy_thumb_lock:
+                key = _lazy_thumb_keys.get(image_path)
+                if key is not None:
+                    _lazy_thumb_keys.move_to_end(image_path)
+            if key is None:
+                if not os.path.exists(image_path):
+                    return None
+                key = cache.generate(image_path)
+                with _lazy_thumb_lock:
+                    _lazy_thumb_keys[image_path] = key
+                    while len(_lazy_thumb_keys) > LAZY_THUMB_KEYS_MAX:
+                        _lazy_thumb_keys.popitem(last=False)
+        return cache.data_url(key, size) if mode == "inline" else cache.handle(key, size)
+    except (OSError, ValueError) as e:
+        log.debug("缩略图不可用", key=key, error=str(e))
+        return None
 
 
 @mcp.tool(
     name="search_similar_cases",
-    description="以图搜图工具。接收一张病理切片图片，在图谱库中搜索视觉特征最相似的历史确诊病例，返回Top-K个最相似的病例及其诊断信息。支持多种输入格式：Base64编码（data:image/...格式）、文件路径、或HTTP/HTTPS URL。支持jpg、png、tif等格式。适用于Nexent平台的文件上传功能。"
+    description="以图搜图工具。接收一张病理切片图片，在图谱库中搜索视觉特征最相似的历史确诊病例，返回Top-K个最相似的病例及其诊断信息。可用 diagnoses / exclude_diagnoses / sources 限定搜索范围（如只搜 TUM 和 STR、排除 BACK）。近重复图块默认折叠（collapse_duplicates），需要更多样的结果时设置 diversity（如0.3），不必加大 top_k。需要展示结果图块时设置 thumbnails=handle（缩略图句柄）或 inline（小缩略图data URL），不要再读取原图。支持多种输入格式：图片句柄（blob:<sha256>，大图片建议先用 upload_image_chunk 上传）、Base64编码（data:image/...格式）、文件路径、或HTTP/HTTPS URL。支持jpg、png、tif等格式。适用于Nexent平台的文件上传功能。"
 )
 def search_similar_cases(
     query_image: str,
-    top_k: int = 5
+    top_k: int = 5,
+    diagnoses: Optional[List[str]] = None,
+    exclude_diagnoses: Optional[List[str]] = None,
+    sources: Optional[List[str]] = None,
+    collapse_duplicates: bool = True,
+    diversity: float = 0.0,
+    thumbnails: str = "none",
+    thumbnail_size: int = DEFAULT_THUMB_SIZE
 ) -> str:
     """
     搜索相似病例
     
     Args:
         query_image: 查询图片，支持多种格式（自动识别）：
+                    - 图片句柄 blob:<sha256>（先上传到服务器暂存区，大图片推荐）
                     - Base64编码字符串（推荐data:image/jpeg;base64,...格式）
                     - 本地文件路径（如 /path/to/image.jpg）
                     - HTTP/HTTPS URL（如 https://example.com/image.jpg）
                     Nexent平台上传文件后，通常会提供Base64编码或文件路径
         top_k: 返回最相似的病例数量，默认5个，范围1-20
+        diagnoses: 只在这些诊断类别中搜索（如 ["TUM", "STR"]）
+        exclude_diagnoses: 排除这些诊断类别（如 ["BACK"]）
+        sources: 只在这些数据来源中搜索
+        collapse_duplicates: 折叠近重复图块（同一切片相邻图块、增强版本只返回一个，附带 near_duplicates 数量）
+        diversity: MMR多样性权重（0-1，默认0为纯相似度排序；如0.3可让结果覆盖更多不同形态）
+        thumbnails: 结果附带缩略图：none（默认）/ handle（句柄 thumb:<键>/<边长>，GET /thumbs/<键>/<边长> 获取）/ inline（data URL）
+        thumbnail_size: 缩略图边长（64/128/256，默认128）
         
     Returns:
         JSON字符串，包含相似病例列表
@@ -146,45 +833,31 @@ def search_similar_cases(
         # 验证top_k参数
         top_k = max(1, min(top_k, 20))  # 限制在1-20之间
         
-        print(f"收到搜索请求，top_k={top_k}")
+        # 确认图谱索引可用
+        check_atlas()
         
-        # 获取collection
-        collection = get_collection()
-        
-        # 解码查询图片（自动识别格式：Base64、文件路径或URL）
+        # 解码查询图片（自动识别格式：图片句柄、Base64、文件路径或URL）
         try:
-            print(f"输入长度: {len(query_image)} 字符")
-            print(f"输入前100字符: {query_image[:100]}...")
             query_image_obj = decode_image(query_image)
-            print(f"图片解码成功，尺寸: {query_image_obj.size}, 模式: {query_image_obj.mode}")
+            log.debug("图片解码成功", top_k=top_k, size=query_image_obj.size)
         except Exception as e:
-            import traceback
-            error_trace = traceback.format_exc()
-            print(f"图片解码失败: {e}")
-            print(f"错误详情: {error_trace}")
+            log.warning("图片解码失败", error=str(e), input=describe_input(query_image))
             return json.dumps({
                 "query_status": "error",
                 "error": f"图片解码失败: {str(e)}",
                 "error_type": type(e).__name__,
-                "suggestion": "请确保输入是有效的Base64编码、文件路径或URL。如果是Nexent平台上传的文件，可能需要等待文件处理完成。",
-                "input_preview": query_image[:200] if len(query_image) > 200 else query_image
+                "suggestion": "请确保输入是有效的图片句柄、Base64编码、文件路径或URL。如果是Nexent平台上传的文件，可能需要等待文件处理完成。",
+                "input": describe_input(query_image)
             }, indent=2, ensure_ascii=False)
         
         # 提取特征向量
-        print("正在提取查询图片的特征向量...")
-        global _extractor
-        if _extractor is None:
-            print("初始化PLIP特征提取器...")
-            _extractor = get_extractor()
+        extractor = _get_extractor()
         
         try:
-            query_features = _extractor.extract_features(query_image_obj)
-            print(f"特征提取成功，特征向量维度: {len(query_features)}")
+            with stage("embed"):
+                query_features = extractor.extract_features(query_image_obj)
         except Exception as e:
-            import traceback
-            error_trace = traceback.format_exc()
-            print(f"特征提取失败: {e}")
-            print(f"错误详情: {error_trace}")
+            log.exception("特征提取失败")
             return json.dumps({
                 "query_status": "error",
                 "error": f"特征提取失败: {str(e)}",
@@ -193,60 +866,17 @@ def search_similar_cases(
             }, indent=2, ensure_ascii=False)
         
         # 在数据库中搜索
-        # 注意：ChromaDB的query方法在使用自定义embedding function时，
-        # 可以直接传入query_embeddings（已提取的特征向量）
-        print(f"正在搜索最相似的 {top_k} 个病例...")
-        max_results = min(top_k, collection.count())
-        if max_results == 0:
-            return json.dumps({
-                "query_status": "error",
-                "error": "数据库为空，请先运行 indexer.py 构建索引"
-            }, indent=2, ensure_ascii=False)
-        
-        results = collection.query(
-            query_embeddings=[query_features.tolist()],
-            n_results=max_results,
-            include=["metadatas", "distances"]
+        filters = _make_filters(diagnoses, exclude_diagnoses, sources)
+        return _search_by_embedding(
+            query_features,
+            top_k,
+            filters=filters,
+            collapse_duplicates=collapse_duplicates,
+            diversity=diversity,
+            thumbnails=thumbnails,
+            thumbnail_size=thumbnail_size
         )
         
-        # 格式化结果
-        found_cases = []
-        
-        if results['ids'] and len(results['ids'][0]) > 0:
-            metadatas = results['metadatas'][0]
-            distances = results['distances'][0]
-            
-            for i, (meta, dist) in enumerate(zip(metadatas, distances)):
-                # 计算相似度得分（距离越小越相似，转换为0-100分）
-                # ChromaDB使用余弦距离，范围通常是0-2，这里转换为相似度百分比
-                similarity_score = max(0, (1 - dist) * 100)
-                
-                case_info = {
-                    "rank": i + 1,
-                    "diagnosis": meta.get('diagnosis', 'Unknown'),
-                    "similarity_score": f"{similarity_score:.2f}%",
-                    "distance": f"{dist:.4f}",
-                    "image_path": meta.get('image_path', ''),
-                    "filename": meta.get('filename', ''),
-                    "source": meta.get('source', 'Internal Atlas'),
-                    "note": "Visual match based on tissue architecture and morphological features."
-                }
-                
-                found_cases.append(case_info)
-            
-            print(f"找到 {len(found_cases)} 个相似病例")
-        else:
-            print("未找到相似病例")
-        
-        # 返回JSON格式结果
-        result = {
-            "query_status": "success",
-            "total_results": len(found_cases),
-            "cases": found_cases
-        }
-        
-        return json.dumps(result, indent=2, ensure_ascii=False)
-        
     except FileNotFoundError as e:
         error_msg = {
             "query_status": "error",
@@ -262,8 +892,7 @@ def search_similar_cases(
             "error": str(e),
             "traceback": traceback.format_exc()
         }
-        print(f"搜索失败: {e}")
-        traceback.print_exc()
+        log.exception("搜索失败")
         return json.dumps(error_msg, indent=2, ensure_ascii=False)
 
 
@@ -273,7 +902,14 @@ def search_similar_cases(
 )
 def search_similar_cases_from_file(
     image_path: str,
-    top_k: int = 5
+    top_k: int = 5,
+    diagnoses: Optional[List[str]] = None,
+    exclude_diagnoses: Optional[List[str]] = None,
+    sources: Optional[List[str]] = None,
+    collapse_duplicates: bool = True,
+    diversity: float = 0.0,
+    thumbnails: str = "none",
+    thumbnail_size: int = DEFAULT_THUMB_SIZE
 ) -> str:
     """
     从文件路径搜索相似病例（便捷函数）
@@ -281,11 +917,503 @@ def search_similar_cases_from_file(
     Args:
         image_path: 图片文件路径（服务器可访问的路径）
         top_k: 返回最相似的病例数量，默认5个
+        diagnoses: 只在这些诊断类别中搜索
+        exclude_diagnoses: 排除这些诊断类别
+        sources: 只在这些数据来源中搜索
+        collapse_duplicates: 折叠近重复图块（同一切片相邻图块、增强版本只返回一个，附带 near_duplicates 数量）
+        diversity: MMR多样性权重（0-1，默认0为纯相似度排序；如0.3可让结果覆盖更多不同形态）
+        thumbnails: 结果附带缩略图：none（默认）/ handle（句柄 thumb:<键>/<边长>，GET /thumbs/<键>/<边长> 获取）/ inline（data URL）
+        thumbnail_size: 缩略图边长（64/128/256，默认128）
         
     Returns:
         JSON字符串，包含相似病例列表
     """
-    return search_similar_cases(query_image=image_path, top_k=top_k)
+    return search_similar_cases(
+        query_image=image_path,
+        top_k=top_k,
+        diagnoses=diagnoses,
+        exclude_diagnoses=exclude_diagnoses,
+        sources=sources,
+        collapse_duplicates=collapse_duplicates,
+        diversity=diversity,
+        thumbnails=thumbnails,
+        thumbnail_size=thumbnail_size
+    )
+
+
+@mcp.tool(
+    name="search_similar_slides",
+    description="以切片搜切片工具。接收同一张切片的多个图块（图片句柄、Base64、文件路径或URL列表），将图块特征聚合为切片描述子，在切片级索引中搜索最相似的历史切片；可选在候选切片的图块上做精细重排。method可选 mean（默认）、attention、histogram。"
+)
+def search_similar_slides(
+    query_images: List[str],
+    top_k: int = 5,
+    method: str = "mean",
+    rerank_tiles: bool = False,
+    candidate_slides: int = 20
+) -> str:
+    """
+    搜索相似切片
+    
+    Args:
+        query_images: 查询切片的图块列表，每项格式同 search_similar_cases 的 query_image
+        top_k: 返回切片数量，默认5个，范围1-20
+        method: 切片描述子聚合方式（mean / attention / histogram）
+        rerank_tiles: 是否在候选切片的图块上做精细重排
+        candidate_slides: 精细重排时粗搜索返回的候选切片数
+        
+    Returns:
+        JSON字符串，包含相似切片列表
+    """
+    try:
+        top_k = max(1, min(top_k, 20))
+        if method not in AGGREGATION_METHODS:
+            return json.dumps({
+                "query_status": "error",
+                "error": f"不支持的聚合方式: {method}，可选: {', '.join(AGGREGATION_METHODS)}"
+            }, indent=2, ensure_ascii=False)
+        if not query_images:
+            return json.dumps({
+                "query_status": "error",
+                "error": "query_images 不能为空"
+            }, indent=2, ensure_ascii=False)
+        
+        slide_collection = get_slide_collection(method)
+        
+        tiles = []
+        for i, query_image in enumerate(query_images):
+            try:
+                tiles.append(decode_image(query_image))
+            except Exception as e:
+                return json.dumps({
+                    "query_status": "error",
+                    "error": f"第 {i + 1} 个图块解码失败: {str(e)}",
+                    "error_type": type(e).__name__
+                }, indent=2, ensure_ascii=False)
+        
+        with stage("embed_batch"):
+            query_tiles = _get_extractor().extract_features_batch(tiles)
+        codebook = load_codebook(DB_PATH) if method == "histogram" else None
+        descriptor = aggregate_tiles(query_tiles, method, codebook)
+        
+        # 粗搜索：切片级索引，开销与切片数相关
+        n_candidates = max(top_k, candidate_slides) if rerank_tiles else top_k
+        n_candidates = min(n_candidates, slide_collection.count())
+        if n_candidates == 0:
+            return json.dumps({
+                "query_status": "error",
+                "error": "切片级索引为空，请先运行 slide_index.py 构建切片索引"
+            }, indent=2, ensure_ascii=False)
+        
+        with stage("slide_search"):
+            results = slide_collection.query(
+                query_embeddings=[descriptor.tolist()],
+                n_results=n_candidates,
+                include=["metadatas", "distances"]
+            )
+        candidates = [
+            {"meta": meta, "slide_score": 1 - dist}
+            for meta, dist in zip(results['metadatas'][0], results['distances'][0])
+        ]
+        
+        # 精细重排：只在候选切片的图块上计算，每个查询图块取与候选切片最相似图块的相似度再取平均
+        if rerank_tiles and candidates:
+            slide_ids = [c["meta"]["slide_id"] for c in candidates]
+            tile_records = get_collection().get(
+                where={"slide_id": {"$in": slide_ids}},
+                include=["embeddings", "metadatas"]
+            )
+            by_slide = {}
+            for emb, meta in zip(tile_records['embeddings'], tile_records['metadatas']):
+                by_slide.setdefault(meta['slide_id'], []).append(emb)
+            for c in candidates:
+                slide_tiles = np.asarray(by_slide.get(c["meta"]["slide_id"], []), dtype=np.float32)
+                if len(slide_tiles) == 0:
+                    c["tile_score"] = 0.0
+                    continue
+                c["tile_score"] = float((query_tiles @ slide_tiles.T).max(axis=1).mean())
+            candidates.sort(key=lambda c: c["tile_score"], reverse=True)
+        
+        found_slides = []
+        for i, c in enumerate(candidates[:top_k]):
+            meta = c["meta"]
+            slide_info = {
+                "rank": i + 1,
+                "slide_id": meta.get('slide_id'),
+                "diagnosis": meta.get('diagnosis', 'Unknown'),
+                "slide_similarity": f"{c['slide_score'] * 100:.2f}%",
+                "n_tiles": meta.get('n_tiles'),
+                "image_path": meta.get('image_path', '')
+            }
+            if "tile_score" in c:
+                slide_info["tile_similarity"] = f"{c['tile_score'] * 100:.2f}%"
+            found_slides.append(slide_info)
+        
+        return json.dumps({
+            "query_status": "success",
+            "method": method,
+            "query_tiles": len(query_tiles),
+            "total_results": len(found_slides),
+            "slides": found_slides
+        }, indent=2, ensure_ascii=False)
+    
+    except FileNotFoundError as e:
+        return json.dumps({
+            "query_status": "error",
+            "error": str(e),
+            "suggestion": "请先运行 wsi_tiler.py 写入切片图块，再运行 slide_index.py 构建切片索引"
+        }, indent=2, ensure_ascii=False)
+    
+    except Exception as e:
+        import traceback
+        log.exception("切片搜索失败")
+        return json.dumps({
+            "query_status": "error",
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }, indent=2, ensure_ascii=False)
+
+
+@mcp.tool(
+    name="classify_tile",
+    description="组织类别分类工具。接收一张病理切片图片（图片句柄、Base64、文件路径或URL），无需在图谱中做K近邻搜索，直接返回各组织类别（默认NCT-CRC-HE的ADI/BACK/DEB/LYM/MUC/MUS/NORM/STR/TUM）的标定后概率。method可选 ensemble（默认）、text（仅文本提示零样本）、centroid（仅图谱类别中心）。"
+)
+def classify_tile(
+    query_image: str,
+    method: str = "ensemble"
+) -> str:
+    """
+    零样本组织分类
+    
+    Args:
+        query_image: 查询图片，格式同 search_similar_cases
+        method: ensemble / text / centroid
+        
+    Returns:
+        JSON字符串，包含预测类别和各类别概率
+    """
+    try:
+        try:
+            query_image_obj = decode_image(query_image)
+        except Exception as e:
+            return json.dumps({
+                "query_status": "error",
+                "error": f"图片解码失败: {str(e)}",
+                "error_type": type(e).__name__,
+                "suggestion": "请确保输入是有效的Base64编码、文件路径或URL。"
+            }, indent=2, ensure_ascii=False)
+        
+        classifier = _get_classifier()
+        with stage("embed"):
+            query_features = _get_extractor().extract_features(query_image_obj)
+        with stage("classify"):
+            probabilities = classifier.classify(query_features, method=method)
+        
+        prediction = next(iter(probabilities))
+        return json.dumps({
+            "query_status": "success",
+            "prediction": prediction,
+            "description": classifier.labels.get(prediction, ""),
+            "confidence": f"{probabilities[prediction] * 100:.2f}%",
+            "probabilities": {code: round(p, 4) for code, p in probabilities.items()},
+            "method": method
+        }, indent=2, ensure_ascii=False)
+    
+    except ValueError as e:
+        return json.dumps({
+            "query_status": "error",
+            "error": str(e)
+        }, indent=2, ensure_ascii=False)
+    
+    except Exception as e:
+        import traceback
+        log.exception("分类失败")
+        return json.dumps({
+            "query_status": "error",
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }, indent=2, ensure_ascii=False)
+
+
+@mcp.tool(
+    name="search_atlas_by_text",
+    description="以文搜图工具。接收一段自由文本的形态学描述（建议英文，如 'poorly differentiated adenocarcinoma with glandular structures'），使用PLIP文本编码器在同一图谱向量库中检索最匹配的病例图像，返回Top-K个病例及其诊断信息。近重复图块默认折叠，diversity>0 时按MMR提高结果多样性。"
+)
+def search_atlas_by_text(
+    query_text: str,
+    top_k: int = 5,
+    diagnoses: Optional[List[str]] = None,
+    exclude_diagnoses: Optional[List[str]] = None,
+    sources: Optional[List[str]] = None,
+    collapse_duplicates: bool = True,
+    diversity: float = 0.0,
+    thumbnails: str = "none",
+    thumbnail_size: int = DEFAULT_THUMB_SIZE
+) -> str:
+    """
+    以文本描述搜索图谱
+    
+    Args:
+        query_text: 形态学/组织学描述文本（PLIP以英文语料训练，英文效果更好）
+        top_k: 返回最匹配的病例数量，默认5个，范围1-20
+        diagnoses: 只在这些诊断类别中搜索
+        exclude_diagnoses: 排除这些诊断类别
+        sources: 只在这些数据来源中搜索
+        collapse_duplicates: 折叠近重复图块
+        diversity: MMR多样性权重（0-1）
+        thumbnails: 结果附带缩略图：none / handle / inline
+        thumbnail_size: 缩略图边长
+        
+    Returns:
+        JSON字符串，包含匹配病例列表（图文相似度整体低于图图相似度，应关注相对排序）
+    """
+    try:
+        top_k = max(1, min(top_k, 20))
+        if not query_text or not query_text.strip():
+            return json.dumps({
+                "query_status": "error",
+                "error": "query_text 不能为空"
+            }, indent=2, ensure_ascii=False)
+        
+        log.debug("收到文本搜索请求", top_k=top_k, text=query_text[:100])
+        check_atlas()
+        
+        try:
+            with stage("embed_text"):
+                query_features = _get_extractor().extract_text_features(query_text)
+        except Exception as e:
+            log.exception("文本特征提取失败")
+            return json.dumps({
+                "query_status": "error",
+                "error": f"文本特征提取失败: {str(e)}",
+                "error_type": type(e).__name__,
+                "suggestion": "请检查模型状态"
+            }, indent=2, ensure_ascii=False)
+        
+        return _search_by_embedding(
+            query_features,
+            top_k,
+            note="Cross-modal match between the text description and tile morphology.",
+            filters=_make_filters(diagnoses, exclude_diagnoses, sources),
+            collapse_duplicates=collapse_duplicates,
+            diversity=diversity,
+            thumbnails=thumbnails,
+            thumbnail_size=thumbnail_size
+        )
+    
+    except FileNotFoundError as e:
+        return json.dumps({
+            "query_status": "error",
+            "error": str(e),
+            "suggestion": "请先运行 indexer.py 构建图谱索引"
+        }, indent=2, ensure_ascii=False)
+    
+    except Exception as e:
+        import traceback
+        log.exception("文本搜索失败")
+        return json.dumps({
+            "query_status": "error",
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        }, indent=2, ensure_ascii=False)
+
+
+@mcp.tool(
+    name="upload_image_chunk",
+    description=f"图片分块上传工具。大图片（如大尺寸TIFF）不要整张Base64放进搜索请求，而是分块上传到服务器暂存区：首次调用不传 upload_id（返回新的 upload_id），之后按偏移依次上传每块的Base64数据（每块解码后不超过 {MAX_CHUNK_BYTES // 2 ** 20} MB），最后一块设置 final=true，返回图片句柄 blob:<sha256>，可直接作为各搜索/分类工具的图片参数重复使用。"
+)
+def upload_image_chunk(
+    data: str,
+    upload_id: str = "",
+    offset: int = 0,
+    final: bool = False,
+    sha256: str = ""
+) -> str:
+    """
+    分块上传图片到暂存区
+    
+    Args:
+        data: 本块内容的Base64编码
+        upload_id: 上传ID（首块留空，服务器创建新的上传会话）
+        offset: 本块在文件中的字节偏移
+        final: 是否为最后一块（为true时完成上传并返回句柄）
+        sha256: 整个文件的SHA-256（可选，final时校验）
+        
+    Returns:
+        JSON字符串，包含upload_id、已接收字节数；final时包含图片句柄
+    """
+    store = get_blob_store()
+    try:
+        if not upload_id:
+            upload_id = store.begin_upload()
+        received = store.write_chunk(upload_id, offset, decode_base64(data)) if data else None
+        if not final:
+            return json.dumps({
+                "query_status": "success",
+                "upload_id": upload_id,
+                "received_bytes": received
+            }, indent=2, ensure_ascii=False)
+        
+        blob = store.commit_upload(upload_id, sha256 or None)
+        log.info("图片上传完成", handle=blob['handle'], size=blob['size'])
+        return json.dumps({"query_status": "success", "upload_id": upload_id, **blob}, indent=2, ensure_ascii=False)
+    except Exception as e:
+        return json.dumps({
+            "query_status": "error",
+            "upload_id": upload_id,
+            "error": str(e),
+            "error_type": type(e).__name__
+        }, indent=2, ensure_ascii=False)
+
+
+@mcp.tool(
+    name="add_confirmed_case",
+    description="新增确诊病例到图谱：提取图片特征，写入持久化的预写日志后立即可被所有搜索工具检索（无需重建索引），后台定期合并进主索引。需要提供确诊诊断（diagnosis，如 TUM）；source 为来源（默认 Online Confirmed）；case_id 留空时自动生成。图片输入格式同 search_similar_cases。"
+)
+def add_confirmed_case(
+    case_image: str,
+    diagnosis: str,
+    source: str = "",
+    case_id: str = "",
+    description: str = ""
+) -> str:
+    """
+    新增确诊病例
+    
+    Args:
+        case_image: 图片句柄、Base64编码、文件路径或URL
+        diagnosis: 确诊诊断
+        source: 来源
+        case_id: 病例id（留空自动生成）
+        description: 病例说明（可选）
+        
+    Returns:
+        JSON字符串，包含病例id和尚未合并的新增病例数
+    """
+    try:
+        # 归档上传的原始图片；解码图像（JPEG按PLIP输入尺寸缩小解码）只用于提取特征
+        original = read_image_source(case_image)
+        with stage("decode"):
+            image = _open_source(original)
+        with stage("embed"):
+            features = _get_extractor().extract_features(image)
+        metadata = add_case(original, features, diagnosis, source, case_id, description)
+        return json.dumps({
+            "query_status": "success",
+            "case_id": metadata["case_id"],
+            "diagnosis": metadata["diagnosis"],
+            "source": metadata["source"],
+            "image_path": metadata["image_path"],
+            "pending_cases": len(_delta)
+        }, indent=2, ensure_ascii=False)
+    except Exception as e:
+        log.warning("新增病例失败", input=describe_input(case_image), error=str(e))
+        return json.dumps({
+            "query_status": "error",
+            "error": str(e),
+            "error_type": type(e).__name__
+        }, indent=2, ensure_ascii=False)
+
+
+@mcp.tool(
+    name="reload_atlas_index",
+    description="热切换图谱向量索引：在后台加载新版本（默认为快照目录 CURRENT 指向的版本，也可指定 version 回滚；指定版本时同时把 CURRENT 指向该版本，多进程部署的其他worker也会切换），预热后原子切换，加载期间和进行中的查询继续使用旧索引，不需要重启服务。返回切换前后的版本信息。"
+)
+async def reload_atlas_index(version: str = "", force: bool = False) -> str:
+    """
+    热切换图谱向量索引
+    
+    Args:
+        version: 快照版本名（留空为CURRENT指向的版本；指定时把CURRENT指向该版本，
+                 各worker的后台检查线程随后都会切换，本worker立即切换）
+        force: 索引目录未变化时也重新加载
+        
+    Returns:
+        JSON字符串，包含是否切换以及当前/之前的索引版本
+    """
+    try:
+        if version and current_version(INDEX_PATH) is not None:
+            # 回滚要写入CURRENT，否则后台检查线程会切回CURRENT指向的版本，其他worker也不会切换
+            await asyncio.to_thread(set_current, INDEX_PATH, version)
+        # 在线程中加载，不阻塞事件循环上的其他查询
+        result = await asyncio.to_thread(reload_vector_index, version or None, force)
+        return json.dumps({"query_status": "success", **result}, indent=2, ensure_ascii=False)
+    except Exception as e:
+        return json.dumps({
+            "query_status": "error",
+            "error": str(e),
+            "error_type": type(e).__name__
+        }, indent=2, ensure_ascii=False)
+
+
+@mcp.custom_route("/blobs", methods=["PUT", "POST"])
+async def upload_blob(request):
+    """
+    HTTP直接上传图片原始字节（请求体即文件内容，无Base64开销），返回图片句柄
+    
+    示例: curl -T slide.tif http://host:18930/blobs
+    """
+    from starlette.responses import JSONResponse
+    
+    writer = get_blob_store().writer()
+    try:
+        async for chunk in request.stream():
+            writer.write(chunk)
+        blob = writer.commit()
+    except Exception as e:
+        writer.abort()
+        return JSONResponse({"query_status": "error", "error": str(e)}, status_code=400)
+    log.info("图片上传完成", handle=blob['handle'], size=blob['size'])
+    return JSONResponse({"query_status": "success", **blob})
+
+
+@mcp.custom_route("/thumbs/{key}/{size}", methods=["GET"])
+async def get_thumbnail(request):
+    """按缩略图句柄获取缩略图（内容寻址，可长期缓存）"""
+    from starlette.responses import JSONResponse, Response
+    
+    try:
+        data = get_thumbnail_cache().get(request.path_params["key"], int(request.path_params["size"]))
+    except (OSError, ValueError) as e:
+        return JSONResponse({"query_status": "error", "error": str(e)}, status_code=404)
+    return Response(data, media_type=THUMB_MIME, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+def _warmup():
+    """预加载紧凑向量索引、PLIP模型和零样本分类器，并报告冷启动耗时"""
+    start = time.perf_counter()
+    try:
+        if get_vector_index() is None:
+            log.info("未找到紧凑向量索引，图块搜索使用ChromaDB", path=INDEX_PATH)
+    except Exception as e:
+        log.warning("紧凑向量索引加载失败", error=str(e))
+    try:
+        replayed = sync_cases()
+        if replayed:
+            log.info("已从预写日志恢复尚未合并的新增病例", cases=replayed)
+    except Exception as e:
+        log.warning("新增病例预写日志读取失败", error=str(e))
+    STARTUP_TIMINGS["index_load"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    try:
+        _get_extractor()
+        STARTUP_TIMINGS["model_load"] = time.perf_counter() - start
+        log.info("PLIP模型预加载完成", seconds=round(STARTUP_TIMINGS['model_load'], 2))
+    except Exception as e:
+        log.warning("PLIP模型预加载失败，将在首次查询时尝试加载", error=str(e))
+        return
+    
+    # 预计算分类器的类别特征（类别文本提示 + 图谱类别中心）
+    start = time.perf_counter()
+    try:
+        _get_classifier()
+        STARTUP_TIMINGS["classifier_init"] = time.perf_counter() - start
+    except Exception as e:
+        log.warning("零样本分类器初始化失败，将在首次调用 classify_tile 时重试", error=str(e))
+    
+    STARTUP_TIMINGS["warm"] = time.perf_counter() - _PROCESS_START
+    log.info("冷启动耗时", **{k: round(v, 2) for k, v in STARTUP_TIMINGS.items()})
 
 
 if __name__ == "__main__":
@@ -294,31 +1422,32 @@ if __name__ == "__main__":
     print("=" * 60)
     print(f"数据库路径: {DB_PATH}")
     print(f"Collection: {COLLECTION_NAME}")
-    print(f"服务器监听: http://0.0.0.0:18930/sse")
+    print("服务器监听: http://0.0.0.0:18930/sse")
     print("=" * 60)
     print()
     print("可用工具:")
     print("  1. search_similar_cases: 接收Base64编码或文件路径")
     print("  2. search_similar_cases_from_file: 接收文件路径（便捷版本）")
+    print("  3. search_atlas_by_text: 接收形态学文本描述（以文搜图）")
+    print("  4. classify_tile: 零样本组织类别分类")
+    print("  5. search_similar_slides: 接收多个图块，搜索相似切片")
+    print("  6. upload_image_chunk: 大图片分块上传，返回图片句柄（或 PUT /blobs 直接上传）")
+    print("  7. get_server_stats: 运行统计（Prometheus格式指标: GET /metrics）")
+    print("  8. reload_atlas_index: 热切换图谱向量索引（新快照发布后自动切换）")
+    print("  9. add_confirmed_case: 新增确诊病例（写入后立即可检索，后台合并进主索引）")
     print()
     
     # 检查数据库是否存在
-    if not os.path.exists(DB_PATH):
+    if not os.path.exists(DB_PATH) and resolve_index_path(INDEX_PATH) is None:
         print("⚠️  警告: 数据库不存在，请先运行 indexer.py 构建索引")
         print()
     
-    # 预加载模型（避免首次查询时的延迟）
-    print("正在预加载PLIP模型...")
-    try:
-        # 在模块级别直接访问全局变量，不需要global声明
-        if globals()['_extractor'] is None:
-            globals()['_extractor'] = get_extractor()
-            print("✅ PLIP模型预加载完成")
-        else:
-            print("✅ PLIP模型已加载")
-    except Exception as e:
-        print(f"⚠️  PLIP模型预加载失败: {e}")
-        print("   模型将在首次查询时尝试加载")
+    # 后台预加载索引、模型和分类器（避免首次查询时的延迟），SSE端口立即就绪；
+    # 预加载完成前到达的查询会等待同一次加载
+    threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+    start_background_tasks()
+    STARTUP_TIMINGS["server_ready"] = time.perf_counter() - _PROCESS_START
+    print(f"✅ 服务器启动用时 {STARTUP_TIMINGS['server_ready']:.2f} s（模型在后台加载）")
     print()
     
     # 启动服务器
@@ -0,0 +1,193 @@
+"""
+切片级索引构建与聚合
+把同一张切片（wsi_tiler.py写入的slide_id）的所有图块特征聚合为一个切片描述子，
+存入与图块索引同库的切片级collection，使"找相似切片"的查询开销与切片数而非图块数相关
+
+聚合方式:
+- mean: 图块特征均值
+- attention: 以图块与均值的相似度做softmax注意力加权的均值（弱化离群/背景图块）
+- histogram: 图块在视觉词典（k-means聚类中心）上的分布直方图
+"""
+import argparse
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from clustering import assign_clusters, minibatch_kmeans
+
+SLIDE_COLLECTION_PREFIX = "pathology_slides"
+AGGREGATION_METHODS = ("mean", "attention", "histogram")
+# 视觉词典文件（存放在图块索引的数据库目录下）
+CODEBOOK_FILENAME = "slide_codebook.npy"
+# 视觉词典大小
+N_CLUSTERS = 64
+# 训练视觉词典时使用的图块样本上限
+CODEBOOK_SAMPLES = 20000
+# 注意力池化的温度
+ATTENTION_TEMPERATURE = 10.0
+PAGE_SIZE = 5000
+
+
+def slide_collection_name(method: str) -> str:
+    """每种聚合方式一个collection（向量维度不同）"""
+    return f"{SLIDE_COLLECTION_PREFIX}_{method}"
+
+
+def codebook_path(db_path: str) -> str:
+    return os.path.join(db_path, CODEBOOK_FILENAME)
+
+
+def _normalize(vec: np.ndarray) -> np.ndarray:
+    return vec / (np.linalg.norm(vec) + 1e-12)
+
+
+def aggregate_tiles(tile_features: np.ndarray, method: str, codebook: np.ndarray = None) -> np.ndarray:
+    """
+    把一组图块特征聚合为切片描述子
+
+    Args:
+        tile_features: 归一化图块特征（n_tiles, dim）
+        method: mean / attention / histogram
+        codebook: 视觉词典（histogram方式需要）
+
+    Returns:
+        归一化切片描述子
+    """
+    tile_features = np.asarray(tile_features, dtype=np.float32)
+    if method == "mean":
+        return _normalize(tile_features.mean(axis=0))
+    if method == "attention":
+        center = _normalize(tile_features.mean(axis=0))
+        logits = ATTENTION_TEMPERATURE * (tile_features @ center)
+        weights = np.exp(logits - logits.max())
+        weights /= weights.sum()
+        return _normalize(weights @ tile_features)
+    if method == "histogram":
+        if codebook is None:
+            raise ValueError("histogram 聚合需要视觉词典，请先运行 slide_index.py 构建切片索引")
+        labels = assign_clusters(tile_features, codebook)
+        hist = np.bincount(labels, minlength=len(codebook)).astype(np.float32)
+        # Hellinger映射：开方后L2归一化，余弦相似度即Bhattacharyya系数
+        return _normalize(np.sqrt(hist / hist.sum()))
+    raise ValueError(f"不支持的聚合方式: {method}，可选: {', '.join(AGGREGATION_METHODS)}")
+
+
+def load_codebook(db_path: str):
+    path = codebook_path(db_path)
+    return np.load(path) if os.path.exists(path) else None
+
+
+def _scan_tiles(tile_collection):
+    """
+    第一遍扫描：收集切片列表，并蓄水池抽样图块特征用于训练视觉词典
+
+    Returns:
+        (slide_id -> {diagnosis, n_tiles, image_path}, 样本特征矩阵)
+    """
+    slides: Dict[str, dict] = {}
+    samples: List[np.ndarray] = []
+    rng = np.random.default_rng(0)
+    seen = 0
+
+    total = tile_collection.count()
+    for offset in range(0, total, PAGE_SIZE):
+        page = tile_collection.get(limit=PAGE_SIZE, offset=offset, include=["embeddings", "metadatas"])
+        for emb, meta in zip(page["embeddings"], page["metadatas"]):
+            slide_id = (meta or {}).get("slide_id")
+            if not slide_id:
+                continue
+            info = slides.setdefault(slide_id, {
+                "diagnosis": meta.get("diagnosis", "Unknown"),
+                "image_path": meta.get("image_path", ""),
+                "n_tiles": 0
+            })
+            info["n_tiles"] += 1
+            seen += 1
+            if len(samples) < CODEBOOK_SAMPLES:
+                samples.append(np.asarray(emb, dtype=np.float32))
+            else:
+                j = int(rng.integers(seen))
+                if j < CODEBOOK_SAMPLES:
+                    samples[j] = np.asarray(emb, dtype=np.float32)
+
+    return slides, (np.stack(samples) if samples else None)
+
+
+def build_slide_index(db_path: str, methods: List[str] = AGGREGATION_METHODS, n_clusters: int = N_CLUSTERS):
+    """
+    从图块索引构建切片级索引
+
+    Args:
+        db_path: ChromaDB数据库路径（图块索引所在库）
+        methods: 要构建的聚合方式
+        n_clusters: 视觉词典大小（histogram方式）
+    """
+    import chromadb
+    from chromadb.config import Settings
+    from indexer import COLLECTION_NAME
+
+    for method in methods:
+        if method not in AGGREGATION_METHODS:
+            raise ValueError(f"不支持的聚合方式: {method}")
+
+    print(f"正在连接ChromaDB数据库: {db_path}")
+    client = chromadb.PersistentClient(path=db_path, settings=Settings(anonymized_telemetry=False))
+    tile_collection = client.get_collection(name=COLLECTION_NAME)
+
+    print("正在扫描图块索引...")
+    slides, samples = _scan_tiles(tile_collection)
+    if not slides:
+        print("错误: 图块索引中没有带 slide_id 的记录，请先用 wsi_tiler.py 写入切片图块")
+        return
+    print(f"找到 {len(slides)} 张切片，共 {sum(s['n_tiles'] for s in slides.values())} 个图块")
+
+    codebook = None
+    if "histogram" in methods:
+        print(f"正在训练视觉词典（{n_clusters} 个聚类，{len(samples)} 个样本）...")
+        codebook = minibatch_kmeans(samples, n_clusters)
+        np.save(codebook_path(db_path), codebook)
+
+    collections = {}
+    for method in methods:
+        name = slide_collection_name(method)
+        try:
+            client.delete_collection(name=name)
+        except Exception:
+            pass
+        collections[method] = client.create_collection(name=name, metadata={"hnsw:space": "cosine"})
+
+    for i, (slide_id, info) in enumerate(sorted(slides.items()), 1):
+        tiles = tile_collection.get(where={"slide_id": slide_id}, include=["embeddings"])
+        features = np.asarray(tiles["embeddings"], dtype=np.float32)
+        for method, collection in collections.items():
+            descriptor = aggregate_tiles(features, method, codebook)
+            collection.add(
+                ids=[slide_id],
+                embeddings=[descriptor.tolist()],
+                metadatas=[{"slide_id": slide_id, **info}]
+            )
+        print(f"  [{i}/{len(slides)}] {slide_id}: {info['n_tiles']} 个图块")
+
+    print(f"\n✅ 切片级索引构建完成！聚合方式: {', '.join(methods)}")
+
+
+if __name__ == "__main__":
+    from indexer import DB_PATH
+
+    parser = argparse.ArgumentParser(description="从图块索引构建切片级索引")
+    parser.add_argument("--db_path", type=str, default=DB_PATH, help=f"ChromaDB数据库路径（默认: {DB_PATH}）")
+    parser.add_argument("--methods", type=str, nargs="+", default=list(AGGREGATION_METHODS),
+                        help="聚合方式（默认: mean attention histogram）")
+    parser.add_argument("--n_clusters", type=int, default=N_CLUSTERS, help=f"视觉词典大小（默认: {N_CLUSTERS}）")
+
+    args = parser.parse_args()
+
+    try:
+        build_slide_index(args.db_path, args.methods, args.n_clusters)
+    except KeyboardInterrupt:
+        print("\n\n构建被用户中断")
+    except Exception as e:
+        print(f"\n错误: {e}")
+        import traceback
+        traceback.print_exc()
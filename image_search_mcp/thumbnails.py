@@ -0,0 +1,173 @@
+"""
+图谱图块的缩略图金字塔缓存
+搜索结果需要展示图块时不再读取全尺寸图谱图片（大TIFF），而是返回缓存中的小缩略图
+
+- 索引构建时（indexer.py）为每张图谱图片生成多级缩略图（默认边长 64/128/256），
+  按原图内容的SHA-256寻址，同内容只保存一份；键写入元数据 thumb
+- 优先使用WebP（PIL不支持时使用JPEG），逐级缩小，每级从上一级缩小而不是从原图缩小
+- 读取时有内存LRU层（按字节数限制），热门病例的缩略图不再读磁盘
+- 多进程部署（serve_multi.py）时各worker共用同一个目录；文件先写临时文件再原子重命名
+
+目录结构:
+  <THUMB_CACHE_PATH>/<键前2位>/<键>_<边长>.webp
+"""
+import base64
+import hashlib
+import io
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+from PIL import Image, features
+
+THUMB_PREFIX = "thumb:"
+# 缩略图缓存目录
+THUMB_CACHE_PATH = os.getenv("THUMB_CACHE_PATH", "./thumb_cache")
+# 金字塔各级的最长边（像素），从大到小生成
+THUMB_SIZES = (256, 128, 64)
+DEFAULT_THUMB_SIZE = 128
+THUMB_QUALITY = 80
+# 内存LRU层的容量（字节）
+THUMB_MEMORY_BYTES = int(os.getenv("THUMB_MEMORY_BYTES", str(64 * 2 ** 20)))
+# 批量生成的线程数
+THUMB_WORKERS = 8
+
+HAS_WEBP = features.check("webp")
+THUMB_FORMAT = "WEBP" if HAS_WEBP else "JPEG"
+THUMB_EXT = ".webp" if HAS_WEBP else ".jpg"
+THUMB_MIME = "image/webp" if HAS_WEBP else "image/jpeg"
+
+_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# 读取原图计算内容哈希的缓冲区大小
+_READ_BUFFER = 2 ** 20
+
+
+def is_thumb_handle(value: str) -> bool:
+    return value.startswith(THUMB_PREFIX)
+
+
+def pick_size(size: int) -> int:
+    """不小于请求边长的最小一级（请求大于最大级时使用最大级）"""
+    for level in sorted(THUMB_SIZES):
+        if level >= size:
+            return level
+    return max(THUMB_SIZES)
+
+
+class ThumbnailCache:
+    """内容寻址的缩略图缓存（磁盘 + 内存LRU）"""
+
+    def __init__(self, root: str = THUMB_CACHE_PATH, memory_bytes: int = THUMB_MEMORY_BYTES):
+        self.root = root
+        self.memory_bytes = memory_bytes
+        os.makedirs(root, exist_ok=True)
+        self._memory: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key: str, size: int) -> str:
+        if not _KEY_PATTERN.match(key or ""):
+            raise ValueError(f"无效的缩略图键: {key}")
+        return os.path.join(self.root, key[:2], f"{key}_{size}{THUMB_EXT}")
+
+    def contains(self, key: str) -> bool:
+        return all(os.path.exists(self.path(key, size)) for size in THUMB_SIZES)
+
+    # ---------- 生成 ----------
+
+    def generate(self, image_path: str) -> str:
+        """
+        为一张图片生成缩略图金字塔（已存在时跳过）
+
+        Returns:
+            缩略图键（原图内容的SHA-256）
+        """
+        digest = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(_READ_BUFFER), b""):
+                digest.update(chunk)
+        key = digest.hexdigest()
+        if not self.contains(key):
+            with Image.open(image_path) as image:
+                if image.format == "JPEG":
+                    image.draft("RGB", (max(THUMB_SIZES), max(THUMB_SIZES)))
+                self._write_pyramid(key, image.convert("RGB"))
+        return key
+
+    def generate_many(self, image_paths: Sequence[str], workers: int = THUMB_WORKERS) -> List[Optional[str]]:
+        """并行生成一批图片的缩略图，失败的图片为None"""
+        def _safe(path):
+            try:
+                return self.generate(path)
+            except Exception:
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_safe, image_paths))
+
+    def _write_pyramid(self, key: str, image: Image.Image):
+        os.makedirs(os.path.join(self.root, key[:2]), exist_ok=True)
+        level = image
+        for size in sorted(THUMB_SIZES, reverse=True):
+            level = level.copy()
+            # thumbnail 保持宽高比，只缩小不放大
+            level.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            level.save(buffer, THUMB_FORMAT, quality=THUMB_QUALITY)
+            target = self.path(key, size)
+            tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, target)
+
+    # ---------- 读取 ----------
+
+    def get(self, key: str, size: int = DEFAULT_THUMB_SIZE) -> bytes:
+        """读取缩略图字节（先查内存LRU层），不存在时抛出FileNotFoundError"""
+        size = pick_size(size)
+        cache_key = (key, size)
+        with self._lock:
+            data = self._memory.get(cache_key)
+            if data is not None:
+                self._memory.move_to_end(cache_key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        with open(self.path(key, size), "rb") as f:
+            data = f.read()
+        with self._lock:
+            if cache_key not in self._memory and len(data) <= self.memory_bytes:
+                self._memory[cache_key] = data
+                self._memory_used += len(data)
+                while self._memory_used > self.memory_bytes:
+                    _, evicted = self._memory.popitem(last=False)
+                    self._memory_used -= len(evicted)
+        return data
+
+    def handle(self, key: str, size: int = DEFAULT_THUMB_SIZE) -> str:
+        """缩略图句柄 thumb:<键>/<边长>（对应HTTP路径 /thumbs/<键>/<边长>）"""
+        return f"{THUMB_PREFIX}{key}/{pick_size(size)}"
+
+    def data_url(self, key: str, size: int = DEFAULT_THUMB_SIZE) -> str:
+        """内联的data URL"""
+        return f"data:{THUMB_MIME};base64," + base64.b64encode(self.get(key, size)).decode("ascii")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    """获取全局缩略图缓存实例"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ThumbnailCache()
+    return _cache
@@ -0,0 +1,827 @@
+"""
+紧凑向量索引模块
+把图谱特征从ChromaDB导出为连续数组，支持float16或按维度缩放的int8编码存储，
+查询时分块转换为float32后用BLAS矩阵乘法打分，并可用float32原始向量对候选做精确重排
+
+索引目录结构:
+  index.json      索引信息（编码类型、维度、条数）
+  records.json    每条记录的id和元数据
+  codes.npy       编码后的向量（n, dim），float32/float16/int8
+  scale.npy       int8编码的每维缩放系数（dim,）
+  full.npy        float32原始向量（可选，仅用于精确重排，mmap加载、只读取候选行）
+  partitions.npz  按诊断/来源划分的行号分区，过滤查询只扫描相关分区
+  groups.npy      近重复分组（每行所属组的代表行号，可选），折叠近重复时只扫描代表行
+  pca.npz         预筛选PCA投影（均值、主成分，可选）
+  prefilter.npy   PCA降维后的预筛选向量（n, r），两阶段搜索先扫描它得到候选再用完整向量重新打分
+
+版本化快照（export --publish）:
+  <根目录>/snapshots/<版本>/   每个版本一个完整的索引目录，写完后才重命名到位
+  <根目录>/CURRENT             当前版本名，原子替换；服务按它加载并在变化时热切换
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+INDEX_DTYPES = ("float32", "float16", "int8")
+# 打分时每块转换的行数（块缓冲区约 BLOCK_ROWS * dim * 4 字节，保持在L2缓存内）
+BLOCK_ROWS = 256
+# 精确重排的候选倍数（候选数 = top_k * RERANK_FACTOR）
+RERANK_FACTOR = 4
+PAGE_SIZE = 5000
+# 构建行号分区的元数据字段
+PARTITION_FIELDS = ("diagnosis", "source")
+# 近重复分组的余弦相似度阈值
+DUP_THRESHOLD = 0.95
+# MMR多样性重排的候选倍数（候选数 = top_k * MMR_CANDIDATES）
+MMR_CANDIDATES = 4
+# 两阶段搜索：预筛选候选数 = max(top_k * SHORTLIST_FACTOR, MIN_SHORTLIST)
+SHORTLIST_FACTOR = 32
+MIN_SHORTLIST = 256
+# 拟合PCA时最多使用的样本数
+PCA_FIT_SAMPLES = 20000
+# 版本化快照
+CURRENT_FILE = "CURRENT"
+SNAPSHOT_DIR = "snapshots"
+# 发布新版本后保留的快照数（含当前版本，用于回滚）
+KEEP_SNAPSHOTS = 3
+# 自动版本名冲突时最多尝试的序号数
+PUBLISH_ATTEMPTS = 100
+
+
+def l2_distance(scores: np.ndarray) -> np.ndarray:
+    """归一化向量的余弦相似度 -> 平方L2距离（与ChromaDB默认距离一致）"""
+    return 2.0 - 2.0 * scores
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+def mmr_select(relevance: np.ndarray, vectors: np.ndarray, top_k: int, diversity: float) -> List[int]:
+    """
+    最大边际相关（MMR）选择：每步选 (1 - diversity) * 与查询的相似度 - diversity * 与已选结果的最大相似度 最大的候选
+
+    Args:
+        relevance: 候选与查询的余弦相似度（n,）
+        vectors: 候选的归一化向量（n, dim）
+        top_k: 选择数量
+        diversity: 多样性权重（0为纯相似度排序，越大结果越分散）
+
+    Returns:
+        选中候选的下标，按选择顺序
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n = len(relevance)
+    selected: List[int] = []
+    # 与已选结果的最大相似度（尚未选择时为0，第一步即按相似度选择）
+    redundancy = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(min(top_k, n)):
+        gain = np.where(available, (1 - diversity) * relevance - diversity * redundancy, -np.inf)
+        pick = int(gain.argmax())
+        selected.append(pick)
+        available[pick] = False
+        redundancy = np.maximum(redundancy, vectors @ vectors[pick])
+    return selected
+
+
+def groups_from_metadata(ids: List[str], metadatas: List[dict]) -> Optional[np.ndarray]:
+    """由元数据中的 dup_group（代表记录id，indexer.py 写入）得到每行的代表行号，缺少分组信息时返回None"""
+    row_of = {record_id: row for row, record_id in enumerate(ids)}
+    groups = np.empty(len(ids), dtype=np.int64)
+    for row, meta in enumerate(metadatas):
+        leader = (meta or {}).get("dup_group")
+        if leader is None:
+            return None
+        # 代表记录不在本索引中时（如被删除），该组第一次出现的行成为代表
+        groups[row] = row_of.setdefault(leader, row)
+    return groups
+
+
+class AtlasVectorIndex:
+    """基于连续数组的图谱向量索引"""
+
+    def __init__(
+        self,
+        ids: List[str],
+        metadatas: List[dict],
+        codes: np.ndarray,
+        dtype: str,
+        scale: Optional[np.ndarray] = None,
+        full: Optional[np.ndarray] = None,
+        partitions: Optional[Dict[str, Dict[str, np.ndarray]]] = None,
+        groups: Optional[np.ndarray] = None,
+        pca: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+        prefilter: Optional[np.ndarray] = None
+    ):
+        self.ids = ids
+        self.metadatas = metadatas
+        self.codes = codes
+        self.dtype = dtype
+        self.scale = scale
+        self.full = full
+        self.dim = codes.shape[1] if codes.ndim == 2 else 0
+        self.partitions = partitions if partitions is not None else self._build_partitions(metadatas)
+        self.groups = groups
+        # PCA投影 (均值 (dim,), 主成分 (dim, r)) 和预筛选向量 (n, r)
+        self.pca = pca
+        self.prefilter = prefilter
+        self._representatives = None
+        self._group_sizes = None
+
+    @staticmethod
+    def _build_partitions(metadatas: List[dict]) -> Dict[str, Dict[str, np.ndarray]]:
+        """字段 -> 取值 -> 升序行号数组"""
+        partitions: Dict[str, Dict[str, list]] = {field: {} for field in PARTITION_FIELDS}
+        for row, meta in enumerate(metadatas):
+            for field in PARTITION_FIELDS:
+                value = (meta or {}).get(field)
+                if value is not None:
+                    partitions[field].setdefault(str(value), []).append(row)
+        return {
+            field: {value: np.asarray(rows, dtype=np.int64) for value, rows in values.items()}
+            for field, values in partitions.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def representatives(self) -> Optional[np.ndarray]:
+        """各近重复组代表行的行号（升序），没有分组时返回None"""
+        if self.groups is None:
+            return None
+        if self._representatives is None:
+            self._representatives = np.flatnonzero(self.groups == np.arange(len(self)))
+        return self._representatives
+
+    def group_size(self, row: int) -> int:
+        """行所在近重复组的大小"""
+        if self.groups is None:
+            return 1
+        if self._group_sizes is None:
+            self._group_sizes = np.bincount(self.groups, minlength=len(self))
+        return int(self._group_sizes[self.groups[row]])
+
+    # ---------- 构建与持久化 ----------
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        embeddings: np.ndarray,
+        metadatas: List[dict],
+        dtype: str = "int8",
+        keep_full: bool = True,
+        groups: Optional[np.ndarray] = None,
+        prefilter_dim: int = 0,
+        pca: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    ) -> "AtlasVectorIndex":
+        """
+        从float32特征构建索引
+
+        Args:
+            ids: 记录id
+            embeddings: 归一化特征矩阵（n, dim）
+            metadatas: 元数据
+            dtype: 编码类型 float32 / float16 / int8
+            keep_full: 是否保留float32原始向量用于精确重排
+            groups: 近重复分组（每行的代表行号），None时从元数据的 dup_group 读取
+            prefilter_dim: 大于0时拟合该维数的PCA，构建两阶段搜索的预筛选向量
+            pca: 沿用已有的PCA投影（追加记录时保持投影不变），优先于 prefilter_dim
+        """
+        if dtype not in INDEX_DTYPES:
+            raise ValueError(f"不支持的编码类型: {dtype}，可选: {', '.join(INDEX_DTYPES)}")
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+        scale = None
+        if dtype == "int8":
+            # 对称量化，每个维度独立的缩放系数
+            scale = np.abs(embeddings).max(axis=0) / 127.0
+            scale[scale == 0] = 1.0
+            codes = np.clip(np.rint(embeddings / scale), -127, 127).astype(np.int8)
+            scale = scale.astype(np.float32)
+        else:
+            codes = embeddings.astype(dtype)
+
+        full = embeddings if keep_full and dtype != "float32" else None
+        if groups is None:
+            groups = groups_from_metadata(list(ids), list(metadatas))
+        index = cls(list(ids), list(metadatas), codes, dtype, scale, full, groups=groups)
+        if pca is not None:
+            index.pca = pca
+            index.prefilter = index._project(embeddings)
+        elif prefilter_dim > 0:
+            index.fit_prefilter(prefilter_dim, embeddings)
+        return index
+
+    def fit_prefilter(self, dim: int, embeddings: Optional[np.ndarray] = None, seed: int = 0):
+        """
+        拟合PCA投影并计算预筛选向量
+
+        Args:
+            dim: 降维后的维数
+            embeddings: float32特征（None时使用原始向量或解码后的编码）
+            seed: 样本多于 PCA_FIT_SAMPLES 时随机抽样的种子
+        """
+        if embeddings is None:
+            embeddings = self.vectors(np.arange(len(self)))
+        dim = min(dim, self.dim)
+        sample = embeddings
+        if len(embeddings) > PCA_FIT_SAMPLES:
+            rows = np.random.default_rng(seed).choice(len(embeddings), PCA_FIT_SAMPLES, replace=False)
+            sample = embeddings[np.sort(rows)]
+        mean = sample.mean(axis=0)
+        centered = sample - mean
+        # 协方差矩阵只有 dim x dim，特征分解比对样本做SVD更省
+        eigvals, eigvecs = np.linalg.eigh(centered.T @ centered)
+        components = eigvecs[:, np.argsort(eigvals)[::-1][:dim]]
+        self.pca = (mean.astype(np.float32), np.ascontiguousarray(components, dtype=np.float32))
+        self.prefilter = self._project(embeddings)
+
+    def _project(self, vectors: np.ndarray) -> np.ndarray:
+        mean, components = self.pca
+        return np.ascontiguousarray((np.asarray(vectors, dtype=np.float32) - mean) @ components)
+
+    def extended(self, ids: List[str], embeddings: np.ndarray, metadatas: List[dict]) -> "AtlasVectorIndex":
+        """
+        追加记录后的新索引（原索引不变，查询可以继续使用），新记录各自成为一个近重复组
+
+        有原始向量时int8编码按合并后的数据重新计算缩放系数；没有原始向量时已有记录沿用原编码、
+        缩放系数和预筛选向量（解码后重新量化会在每次合并时累积误差），新记录按原缩放系数量化
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        groups = None
+        if self.groups is not None:
+            groups = np.concatenate([self.groups, np.arange(len(self), len(self) + len(ids), dtype=np.int64)])
+        if self.full is None and self.scale is not None and len(self):
+            codes = np.concatenate([
+                np.asarray(self.codes),
+                np.clip(np.rint(embeddings / self.scale), -127, 127).astype(np.int8)
+            ])
+            index = AtlasVectorIndex(
+                self.ids + list(ids), self.metadatas + list(metadatas), codes, self.dtype, self.scale, None,
+                groups=groups
+            )
+            if self.pca is not None:
+                index.pca = self.pca
+                index.prefilter = np.concatenate([np.asarray(self.prefilter), index._project(embeddings)])
+            return index
+        if len(self):
+            embeddings = np.concatenate([self.vectors(np.arange(len(self))), embeddings])
+        return AtlasVectorIndex.build(
+            self.ids + list(ids),
+            embeddings,
+            self.metadatas + list(metadatas),
+            dtype=self.dtype,
+            keep_full=self.full is not None,
+            groups=groups,
+            pca=self.pca
+        )
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "codes.npy"), self.codes)
+        if self.scale is not None:
+            np.save(os.path.join(path, "scale.npy"), self.scale)
+        if self.full is not None:
+            np.save(os.path.join(path, "full.npy"), self.full)
+        if self.groups is not None:
+            np.save(os.path.join(path, "groups.npy"), self.groups)
+        if self.pca is not None:
+            np.savez(os.path.join(path, "pca.npz"), mean=self.pca[0], components=self.pca[1])
+            np.save(os.path.join(path, "prefilter.npy"), self.prefilter)
+        np.savez(
+            os.path.join(path, "partitions.npz"),
+            **{f"{field}::{value}": rows for field, values in self.partitions.items() for value, rows in values.items()}
+        )
+        with open(os.path.join(path, "records.json"), "w", encoding="utf-8") as f:
+            json.dump([{"id": i, "metadata": m} for i, m in zip(self.ids, self.metadatas)], f, ensure_ascii=False)
+        # 最后写入索引信息，作为目录完整的标志
+        with open(os.path.join(path, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "dtype": self.dtype,
+                "dim": self.dim,
+                "count": len(self),
+                "prefilter_dim": self.prefilter.shape[1] if self.prefilter is not None else 0
+            }, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "AtlasVectorIndex":
+        """
+        加载索引
+
+        Args:
+            path: 索引目录
+            mmap: 是否以内存映射方式加载数组（多进程共享页缓存，按需读入）
+        """
+        info_path = os.path.join(path, "index.json")
+        if not os.path.exists(info_path):
+            raise FileNotFoundError(f"向量索引不存在: {path}\n请先运行 vector_store.py export 导出索引")
+        with open(info_path, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        with open(os.path.join(path, "records.json"), "r", encoding="utf-8") as f:
+            records = json.load(f)
+
+        mode = "r" if mmap else None
+
+        def _optional(name):
+            p = os.path.join(path, name)
+            return np.load(p, mmap_mode=mode) if os.path.exists(p) else None
+
+        partitions = None
+        partitions_path = os.path.join(path, "partitions.npz")
+        if os.path.exists(partitions_path):
+            partitions = {field: {} for field in PARTITION_FIELDS}
+            with np.load(partitions_path) as data:
+                for key in data.files:
+                    field, value = key.split("::", 1)
+                    partitions.setdefault(field, {})[value] = data[key]
+
+        pca = None
+        pca_path = os.path.join(path, "pca.npz")
+        if os.path.exists(pca_path):
+            with np.load(pca_path) as data:
+                pca = (data["mean"], data["components"])
+
+        codes = np.load(os.path.join(path, "codes.npy"), mmap_mode=mode)
+        return cls(
+            [r["id"] for r in records],
+            [r["metadata"] for r in records],
+            codes,
+            info["dtype"],
+            _optional("scale.npy"),
+            _optional("full.npy"),
+            partitions,
+            # 分组数组很小，直接读入内存
+            np.load(os.path.join(path, "groups.npy")) if os.path.exists(os.path.join(path, "groups.npy")) else None,
+            pca,
+            _optional("prefilter.npy") if pca is not None else None
+        )
+
+    # ---------- 查询 ----------
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """各部分占用字节数（full仅在精确重排时按需读取候选行）"""
+        return {
+            "codes": int(self.codes.nbytes),
+            "float32_equivalent": int(len(self) * self.dim * 4),
+            "full": int(self.full.nbytes) if self.full is not None else 0,
+            "prefilter": int(self.prefilter.nbytes) if self.prefilter is not None else 0
+        }
+
+    def filter_rows(
+        self,
+        diagnoses: Optional[List[str]] = None,
+        exclude_diagnoses: Optional[List[str]] = None,
+        sources: Optional[List[str]] = None
+    ) -> Optional[np.ndarray]:
+        """
+        按元数据过滤条件合并分区，得到需要扫描的行号
+
+        Returns:
+            升序行号数组；没有任何过滤条件时返回None（扫描全部）
+        """
+        if not diagnoses and not exclude_diagnoses and not sources:
+            return None
+
+        def _union(field: str, values: List[str]) -> np.ndarray:
+            parts = [self.partitions.get(field, {}).get(str(v)) for v in values]
+            parts = [p for p in parts if p is not None]
+            return np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+        rows = _union("diagnosis", diagnoses) if diagnoses else np.arange(len(self), dtype=np.int64)
+        if exclude_diagnoses:
+            rows = np.setdiff1d(rows, _union("diagnosis", exclude_diagnoses), assume_unique=True)
+        if sources:
+            rows = np.intersect1d(rows, _union("source", sources), assume_unique=True)
+        return rows
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        """指定行的float32向量（有原始向量时读取原始向量，否则解码编码）"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.full is not None:
+            return np.asarray(self.full[rows], dtype=np.float32)
+        vectors = np.asarray(self.codes[rows], dtype=np.float32)
+        return vectors * self.scale if self.scale is not None else vectors
+
+    def score(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        计算查询与（部分）索引向量的近似余弦相似度
+
+        分块把编码转换为float32后做矩阵-向量乘法；int8的缩放系数预先乘进查询向量，
+        块内只需一次类型转换和一次BLAS调用
+
+        Args:
+            query: 归一化查询向量（dim,）
+            rows: 只对这些行打分（None表示全部）
+        """
+        query = np.asarray(query, dtype=np.float32)
+        q = query * self.scale if self.scale is not None else query
+        n = len(self) if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        if self.dtype == "float32" and rows is None:
+            return np.dot(self.codes, q, out=scores) if n else scores
+
+        # 块缓冲区复用，避免每块分配内存
+        buf = np.empty((min(BLOCK_ROWS, max(n, 1)), self.dim), dtype=np.float32)
+        for start in range(0, n, BLOCK_ROWS):
+            end = min(start + BLOCK_ROWS, n)
+            block = self.codes[start:end] if rows is None else self.codes[rows[start:end]]
+            np.copyto(buf[:end - start], block, casting="unsafe")
+            np.dot(buf[:end - start], q, out=scores[start:end])
+        return scores
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        rerank: bool = True,
+        rerank_factor: int = RERANK_FACTOR,
+        rows: Optional[np.ndarray] = None,
+        collapse: bool = False,
+        diversity: float = 0.0,
+        prefilter: bool = True,
+        shortlist: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        搜索最相似的记录
+
+        Args:
+            query: 归一化查询向量
+            top_k: 返回数量
+            rerank: 是否用float32原始向量对前 top_k * rerank_factor 个候选精确重排
+            rerank_factor: 精确重排的候选倍数
+            rows: 只在这些行中搜索（None表示全部）
+            collapse: 折叠近重复，只在各近重复组的代表行中搜索（索引没有分组时忽略）
+            diversity: MMR多样性权重，大于0时在 top_k * MMR_CANDIDATES 个候选上做MMR重排
+            prefilter: 索引有PCA预筛选向量时两阶段搜索：先扫描低维向量取 shortlist 个候选，
+                       再只对候选用编码向量打分（和精确重排）
+            shortlist: 预筛选候选数（默认 max(top_k * SHORTLIST_FACTOR, MIN_SHORTLIST)），越大召回越高
+
+        Returns:
+            [(行号, 余弦相似度), ...]，按相似度降序（MMR时按选择顺序）
+        """
+        if collapse and self.representatives is not None:
+            reps = self.representatives
+            rows = reps if rows is None else np.intersect1d(rows, reps, assume_unique=True)
+        if diversity > 0:
+            candidates = self.search(
+                query, top_k * MMR_CANDIDATES, rerank, rerank_factor, rows, prefilter=prefilter, shortlist=shortlist
+            )
+            if not candidates:
+                return []
+            cand_rows = np.array([r for r, _ in candidates], dtype=np.int64)
+            relevance = np.array([s for _, s in candidates], dtype=np.float32)
+            picked = mmr_select(relevance, self.vectors(cand_rows), top_k, diversity)
+            return [candidates[i] for i in picked]
+
+        if prefilter and self.prefilter is not None:
+            rows = self._shortlist(query, rows, shortlist or max(top_k * SHORTLIST_FACTOR, MIN_SHORTLIST))
+
+        scores = self.score(query, rows)
+        exact = rerank and self.full is not None
+        cand = _top_k(scores, top_k * rerank_factor if exact else top_k)
+        row_ids = cand if rows is None else np.asarray(rows)[cand]
+        if not exact:
+            return [(int(r), float(s)) for r, s in zip(row_ids, scores[cand])]
+
+        # 候选行排序后读取，mmap下顺序访问更友好
+        order = np.argsort(row_ids)
+        exact_scores = np.empty(len(row_ids), dtype=np.float32)
+        exact_scores[order] = np.asarray(self.full[row_ids[order]], dtype=np.float32) @ np.asarray(query, dtype=np.float32)
+        best = _top_k(exact_scores, top_k)
+        return [(int(row_ids[i]), float(exact_scores[i])) for i in best]
+
+    def _shortlist(self, query: np.ndarray, rows: Optional[np.ndarray], size: int) -> Optional[np.ndarray]:
+        """
+        第一阶段：在PCA低维空间打分，返回得分最高的 size 行（升序，便于第二阶段顺序读取）
+
+        x·q ≈ mean·q + (P^T(x - mean))·(P^T q)，mean·q 对所有行相同，排序只需低维内积
+        """
+        n = len(self) if rows is None else len(rows)
+        if n <= size:
+            return rows
+        q = np.asarray(query, dtype=np.float32) @ self.pca[1]
+        scores = self.prefilter @ q if rows is None else self.prefilter[rows] @ q
+        cand = _top_k(scores, size)
+        return np.sort(cand if rows is None else np.asarray(rows)[cand])
+
+
+# ---------- 版本化快照 ----------
+
+def current_version(root: str) -> Optional[str]:
+    """快照根目录的当前版本名，不是快照根目录时返回None"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_index_path(path: str, version: Optional[str] = None) -> Optional[str]:
+    """
+    实际加载的索引目录：快照根目录解析为指定版本（默认当前版本），普通索引目录原样返回；
+    索引不存在时返回None
+    """
+    version = version or current_version(path)
+    if version:
+        path = os.path.join(path, SNAPSHOT_DIR, version)
+    return path if os.path.exists(os.path.join(path, "index.json")) else None
+
+
+def list_snapshots(root: str) -> List[str]:
+    """已完成的快照版本（按版本名排序，默认版本名即时间戳）"""
+    snapshot_root = os.path.join(root, SNAPSHOT_DIR)
+    if not os.path.isdir(snapshot_root):
+        return []
+    return sorted(
+        name for name in os.listdir(snapshot_root)
+        if not name.endswith(".tmp") and os.path.exists(os.path.join(snapshot_root, name, "index.json"))
+    )
+
+
+def set_current(root: str, version: str):
+    """原子地切换当前版本（也用于回滚）"""
+    if resolve_index_path(root, version) is None:
+        raise FileNotFoundError(f"快照不存在: {version}（可用: {', '.join(list_snapshots(root)) or '无'}）")
+    tmp_path = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+
+def _auto_versions(count: int) -> List[str]:
+    """自动版本名：精确到微秒的时间戳（按名称排序即时间顺序），其后是冲突时使用的带序号名称"""
+    now = time.time()
+    base = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now % 1 * 1e6):06d}"
+    return [base] + [f"{base}-{i}" for i in range(1, count)]
+
+
+def publish_snapshot(
+    index: "AtlasVectorIndex",
+    root: str,
+    version: Optional[str] = None,
+    keep: int = KEEP_SNAPSHOTS
+) -> str:
+    """
+    把索引保存为新版本快照并切换为当前版本
+
+    先写入临时目录再重命名，CURRENT最后原子替换，服务端任何时刻读到的都是完整的版本；
+    旧快照只保留最近 keep 个（已加载旧版本的服务通过mmap继续读取，删除不影响进行中的查询）
+
+    未指定版本名时使用精确到微秒的时间戳；同名版本已存在时（同一时刻的多次发布）追加序号，不报错
+
+    Returns:
+        版本名
+    """
+    snapshot_root = os.path.join(root, SNAPSHOT_DIR)
+    # 指定版本名时不改名，已存在即报错；自动版本名冲突时追加序号
+    candidates = [version] if version else _auto_versions(PUBLISH_ATTEMPTS)
+    if version and os.path.exists(os.path.join(snapshot_root, version)):
+        raise FileExistsError(f"快照已存在: {os.path.join(snapshot_root, version)}")
+    os.makedirs(snapshot_root, exist_ok=True)
+    # 每次发布使用独立的临时目录（.tmp 结尾，list_snapshots 忽略），并发发布互不覆盖
+    tmp_path = tempfile.mkdtemp(prefix=candidates[0] + ".", suffix=".tmp", dir=snapshot_root)
+    try:
+        index.save(tmp_path)
+        for version in candidates:
+            target = os.path.join(snapshot_root, version)
+            if os.path.exists(target):
+                continue
+            try:
+                os.rename(tmp_path, target)
+                break
+            except OSError:
+                # 检查与重命名之间被其他进程占用（目标目录非空时 rename 失败）
+                if not os.path.exists(target):
+                    raise
+        else:
+            raise FileExistsError(f"快照已存在: {os.path.join(snapshot_root, candidates[-1])}")
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    set_current(root, version)
+
+    for old in list_snapshots(root)[:-keep] if keep > 0 else []:
+        if old != version:
+            shutil.rmtree(os.path.join(snapshot_root, old), ignore_errors=True)
+    return version
+
+
+def export_from_collection(
+    collection,
+    dtype: str = "int8",
+    keep_full: bool = True,
+    dup_threshold: float = DUP_THRESHOLD,
+    prefilter_dim: int = 0
+) -> AtlasVectorIndex:
+    """
+    分页读取ChromaDB collection，构建紧凑向量索引（prefilter_dim > 0 时同时构建两阶段搜索的预筛选向量）
+
+    记录带有 dup_group 元数据时沿用该分组；旧索引没有分组时按 dup_threshold 重新计算（0表示不分组）
+    """
+    ids, metadatas, chunks = [], [], []
+    total = collection.count()
+    for offset in range(0, total, PAGE_SIZE):
+        page = collection.get(limit=PAGE_SIZE, offset=offset, include=["embeddings", "metadatas"])
+        ids.extend(page["ids"])
+        metadatas.extend(m or {} for m in page["metadatas"])
+        chunks.append(np.asarray(page["embeddings"], dtype=np.float32))
+    embeddings = np.concatenate(chunks) if chunks else np.empty((0, 0), dtype=np.float32)
+    groups = groups_from_metadata(ids, metadatas)
+    if groups is None and dup_threshold > 0 and len(ids):
+        from clustering import duplicate_groups
+
+        groups = duplicate_groups(
+            embeddings,
+            dup_threshold,
+            partition_keys=[tuple(m.get(f) for f in PARTITION_FIELDS) for m in metadatas]
+        )
+        metadatas = [{**m, "dup_group": ids[g]} for m, g in zip(metadatas, groups)]
+    return AtlasVectorIndex.build(
+        ids, embeddings, metadatas, dtype=dtype, keep_full=keep_full, groups=groups, prefilter_dim=prefilter_dim
+    )
+
+
+def benchmark(
+    index: AtlasVectorIndex,
+    n_queries: int = 200,
+    top_k: int = 10,
+    noise: float = 0.05,
+    shortlists: Optional[List[int]] = None
+) -> Dict:
+    """
+    评估召回率/内存/延迟的取舍（以float32精确搜索为基准）
+
+    查询向量为随机抽取的索引向量加高斯噪声后重新归一化；索引有PCA预筛选向量时
+    对每个预筛选候选数评估两阶段搜索的召回率、延迟和每次查询的乘加次数（相对全维扫描）
+    """
+    if index.full is None and index.dtype != "float32":
+        raise ValueError("基准测试需要float32原始向量（导出时不要使用 --no_full）")
+    reference = np.asarray(index.full if index.full is not None else index.codes, dtype=np.float32)
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(index), size=min(n_queries, len(index)), replace=False)
+    queries = reference[rows] + noise * rng.normal(size=(len(rows), index.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    def _run(fn):
+        hits, start = [], time.perf_counter()
+        for q in queries:
+            hits.append({r for r, _ in fn(q)})
+        return hits, (time.perf_counter() - start) / len(queries) * 1000
+
+    truth, exact_ms = _run(lambda q: [(int(i), 0.0) for i in _top_k(reference @ q, top_k)])
+    approx, approx_ms = _run(lambda q: index.search(q, top_k, rerank=False, prefilter=False))
+    reranked, rerank_ms = _run(lambda q: index.search(q, top_k, rerank=True, prefilter=False))
+
+    def _recall(hits):
+        return float(np.mean([len(h & t) / len(t) for h, t in zip(hits, truth)]))
+
+    two_stage = []
+    if index.prefilter is not None:
+        n, dim, r = len(index), index.dim, index.prefilter.shape[1]
+        for size in shortlists or [max(top_k * SHORTLIST_FACTOR, MIN_SHORTLIST)]:
+            hits, ms = _run(lambda q: index.search(q, top_k, rerank=True, shortlist=size))
+            shortlisted = min(size, n)
+            two_stage.append({
+                "shortlist": size,
+                f"recall@{top_k}": round(_recall(hits), 4),
+                "query_ms": round(ms, 3),
+                # 第一阶段 n*r + 第二阶段 shortlist*dim，相对全维扫描 n*dim
+                "flops_ratio": round((n * r + shortlisted * dim) / (n * dim), 4) if shortlisted < n else 1.0
+            })
+
+    mem = index.memory_bytes()
+    result = {
+        "dtype": index.dtype,
+        "count": len(index),
+        "dim": index.dim,
+        "top_k": top_k,
+        f"recall@{top_k}": round(_recall(approx), 4),
+        f"recall@{top_k}_reranked": round(_recall(reranked), 4),
+        "query_ms_float32_exact": round(exact_ms, 3),
+        "query_ms": round(approx_ms, 3),
+        "query_ms_reranked": round(rerank_ms, 3),
+        "resident_mb": round(mem["codes"] / 2 ** 20, 2),
+        "float32_mb": round(mem["float32_equivalent"] / 2 ** 20, 2),
+        "compression": round(mem["float32_equivalent"] / max(mem["codes"], 1), 2)
+    }
+    if two_stage:
+        result["prefilter_dim"] = index.prefilter.shape[1]
+        result["prefilter_mb"] = round(mem["prefilter"] / 2 ** 20, 2)
+        result["two_stage"] = two_stage
+    return result
+
+
+def _export_cli(args):
+    import chromadb
+    from chromadb.config import Settings
+    from indexer import COLLECTION_NAME
+
+    print(f"正在连接ChromaDB数据库: {args.db_path}")
+    client = chromadb.PersistentClient(path=args.db_path, settings=Settings(anonymized_telemetry=False))
+    collection = client.get_collection(name=COLLECTION_NAME)
+    print(f"正在导出 {collection.count()} 条记录（编码: {args.dtype}）...")
+    index = export_from_collection(
+        collection,
+        dtype=args.dtype,
+        keep_full=not args.no_full,
+        dup_threshold=args.dup_threshold,
+        prefilter_dim=args.prefilter_dim
+    )
+    if args.publish:
+        version = publish_snapshot(index, args.out, args.version, keep=args.keep)
+        print(f"✅ 已发布快照 {version}: {os.path.join(args.out, SNAPSHOT_DIR, version)}")
+    else:
+        index.save(args.out)
+        print(f"✅ 向量索引已保存: {args.out}")
+    mem = index.memory_bytes()
+    print(f"   常驻向量: {mem['codes'] / 2 ** 20:.2f} MB（float32: {mem['float32_equivalent'] / 2 ** 20:.2f} MB）")
+    if index.representatives is not None:
+        print(f"   近重复分组: {len(index.representatives)} 组（{len(index)} 条记录）")
+    if index.prefilter is not None:
+        print(f"   预筛选向量: {index.prefilter.shape[1]} 维（{mem['prefilter'] / 2 ** 20:.2f} MB）")
+
+
+def _snapshots_cli(args):
+    if args.use:
+        set_current(args.root, args.use)
+        print(f"✅ 当前版本已切换为 {args.use}（运行中的服务会自动热切换）")
+    current = current_version(args.root)
+    for version in list_snapshots(args.root):
+        print(f"{'*' if version == current else ' '} {version}")
+
+
+def _benchmark_cli(args):
+    index = AtlasVectorIndex.load(resolve_index_path(args.index) or args.index)
+    if args.prefilter_dim:
+        # 只在内存中拟合，用于导出前选择维数
+        index.fit_prefilter(args.prefilter_dim)
+    shortlists = [int(v) for v in args.shortlists.split(",")] if args.shortlists else None
+    print(json.dumps(
+        benchmark(index, n_queries=args.queries, top_k=args.top_k, shortlists=shortlists),
+        indent=2,
+        ensure_ascii=False
+    ))
+
+
+if __name__ == "__main__":
+    from indexer import DB_PATH
+
+    parser = argparse.ArgumentParser(description="紧凑向量索引导出与基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="从ChromaDB导出紧凑向量索引")
+    p_export.add_argument("--db_path", type=str, default=DB_PATH, help=f"ChromaDB数据库路径（默认: {DB_PATH}）")
+    p_export.add_argument("--out", type=str, default="./atlas_index", help="索引输出目录（默认: ./atlas_index）")
+    p_export.add_argument("--dtype", type=str, default="int8", choices=INDEX_DTYPES, help="编码类型（默认: int8）")
+    p_export.add_argument("--no_full", action="store_true", help="不保存float32原始向量（无法精确重排）")
+    p_export.add_argument("--dup_threshold", type=float, default=DUP_THRESHOLD,
+                          help=f"记录没有 dup_group 时重新分组的近重复阈值（默认: {DUP_THRESHOLD}，0表示不分组）")
+    p_export.add_argument("--prefilter_dim", type=int, default=0,
+                          help="两阶段搜索的PCA预筛选维数（默认: 0，不构建；PLIP 512维时建议 64）")
+    p_export.add_argument("--publish", action="store_true",
+                          help="把 --out 作为快照根目录，发布为新版本并切换（运行中的服务热切换）")
+    p_export.add_argument("--version", type=str, default=None, help="快照版本名（默认: 当前时间）")
+    p_export.add_argument("--keep", type=int, default=KEEP_SNAPSHOTS,
+                          help=f"保留的快照数（默认: {KEEP_SNAPSHOTS}，0表示全部保留）")
+    p_export.set_defaults(func=_export_cli)
+
+    p_snap = sub.add_parser("snapshots", help="列出快照版本，或切换/回滚当前版本")
+    p_snap.add_argument("--root", type=str, default="./atlas_index", help="快照根目录（默认: ./atlas_index）")
+    p_snap.add_argument("--use", type=str, default=None, help="切换到指定版本")
+    p_snap.set_defaults(func=_snapshots_cli)
+
+    p_bench = sub.add_parser("benchmark", help="评估召回率/内存/延迟")
+    p_bench.add_argument("--index", type=str, default="./atlas_index", help="索引目录（默认: ./atlas_index）")
+    p_bench.add_argument("--queries", type=int, default=200, help="查询数（默认: 200）")
+    p_bench.add_argument("--top_k", type=int, default=10, help="top_k（默认: 10）")
+    p_bench.add_argument("--prefilter_dim", type=int, default=0,
+                         help="在内存中拟合该维数的PCA预筛选后评估两阶段搜索（默认使用索引自带的预筛选向量）")
+    p_bench.add_argument("--shortlists", type=str, default=None,
+                         help=f"逗号分隔的预筛选候选数（默认: max(top_k*{SHORTLIST_FACTOR}, {MIN_SHORTLIST})）")
+    p_bench.set_defaults(func=_benchmark_cli)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except KeyboardInterrupt:
+        print("\n\n操作被用户中断")
+    except Exception as e:
+        print(f"\n错误: {e}")
+        import traceback
+        traceback.print_exc()
@@ -0,0 +1,307 @@
+"""
+全切片图像（WSI）切块与流式特征提取
+逐区域读取大尺寸金字塔TIFF/SVS，不加载整张图像；用低分辨率缩略图做组织检测跳过背景，
+切出的图块直接送入PLIP批量提取特征，并带上切片/坐标元数据写入图谱索引
+
+峰值内存只与 区域大小 + 批大小 + 缩略图大小 有关，与切片尺寸无关
+
+依赖: openslide-python（pip install openslide-python，另需系统库 libopenslide）
+"""
+import argparse
+import os
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+HAS_OPENSLIDE = False
+try:
+    import openslide
+    HAS_OPENSLIDE = True
+except ImportError:
+    pass
+
+# 默认图块大小（与NCT-CRC-HE图块和PLIP输入一致）
+TILE_SIZE = 224
+# 每次读取的区域边长（以图块数计），区域越大IO次数越少、内存占用越高
+REGION_TILES = 8
+# 组织检测缩略图的最大边长
+THUMBNAIL_MAX_SIZE = 2048
+# HSV饱和度阈值（0-255），H&E染色组织饱和度明显高于白色背景
+SATURATION_THRESHOLD = 20
+# 图块中组织像素占比低于此值视为背景
+MIN_TISSUE_FRACTION = 0.5
+# 特征提取批大小
+BATCH_SIZE = 32
+
+SLIDE_FORMATS = ('.svs', '.tif', '.tiff', '.ndpi', '.mrxs', '.scn', '.vms', '.vmu', '.bif')
+
+
+def _tissue_mask(image: Image.Image) -> np.ndarray:
+    """基于HSV饱和度的组织掩膜（True表示组织）"""
+    saturation = np.asarray(image.convert('HSV'))[..., 1]
+    return saturation > SATURATION_THRESHOLD
+
+
+class SlideTiler:
+    """按区域流式切分一张全切片图像"""
+
+    def __init__(
+        self,
+        slide_path: str,
+        tile_size: int = TILE_SIZE,
+        level: int = 0,
+        region_tiles: int = REGION_TILES,
+        min_tissue: float = MIN_TISSUE_FRACTION
+    ):
+        """
+        Args:
+            slide_path: 切片文件路径
+            tile_size: 图块边长（在所选层级上的像素）
+            level: 金字塔层级（0为最高分辨率）
+            region_tiles: 每次读取的区域边长（图块数）
+            min_tissue: 图块保留所需的最小组织占比
+        """
+        if not HAS_OPENSLIDE:
+            raise RuntimeError("openslide-python未安装，无法读取全切片图像。请安装: pip install openslide-python")
+
+        self.slide_path = slide_path
+        self.slide = openslide.OpenSlide(slide_path)
+        if not 0 <= level < self.slide.level_count:
+            raise ValueError(f"层级 {level} 超出范围（共 {self.slide.level_count} 层）")
+
+        self.tile_size = tile_size
+        self.level = level
+        self.region_tiles = region_tiles
+        self.min_tissue = min_tissue
+        self.downsample = self.slide.level_downsamples[level]
+        self.width, self.height = self.slide.level_dimensions[level]
+        self.cols = self.width // tile_size
+        self.rows = self.height // tile_size
+
+        self.tissue_grid = self._tissue_grid()
+
+    def _tissue_grid(self) -> np.ndarray:
+        """在缩略图上计算每个图块的组织占比（rows, cols）"""
+        thumb = self.slide.get_thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE))
+        mask = _tissue_mask(thumb)
+        scale_x = mask.shape[1] / self.width
+        scale_y = mask.shape[0] / self.height
+
+        grid = np.zeros((self.rows, self.cols), dtype=np.float32)
+        for r in range(self.rows):
+            y0 = int(r * self.tile_size * scale_y)
+            y1 = max(y0 + 1, int((r + 1) * self.tile_size * scale_y))
+            for c in range(self.cols):
+                x0 = int(c * self.tile_size * scale_x)
+                x1 = max(x0 + 1, int((c + 1) * self.tile_size * scale_x))
+                grid[r, c] = mask[y0:y1, x0:x1].mean()
+        return grid
+
+    @property
+    def tissue_tile_count(self) -> int:
+        return int((self.tissue_grid >= self.min_tissue).sum())
+
+    def iter_tiles(self) -> Iterator[Tuple[Image.Image, int, int]]:
+        """
+        逐区域读取并切块
+
+        Yields:
+            (图块RGB图像, 第0层x坐标, 第0层y坐标)
+        """
+        step = self.region_tiles
+        for r0 in range(0, self.rows, step):
+            for c0 in range(0, self.cols, step):
+                keep = self.tissue_grid[r0:r0 + step, c0:c0 + step] >= self.min_tissue
+                if not keep.any():
+                    # 整个区域都是背景，不读取
+                    continue
+
+                n_rows, n_cols = keep.shape
+                x0 = int(c0 * self.tile_size * self.downsample)
+                y0 = int(r0 * self.tile_size * self.downsample)
+                region = self.slide.read_region(
+                    (x0, y0),
+                    self.level,
+                    (n_cols * self.tile_size, n_rows * self.tile_size)
+                ).convert('RGB')
+
+                for dr, dc in zip(*np.nonzero(keep)):
+                    left, top = int(dc) * self.tile_size, int(dr) * self.tile_size
+                    tile = region.crop((left, top, left + self.tile_size, top + self.tile_size))
+                    # 缩略图分辨率有限，在全分辨率图块上再确认一次
+                    if _tissue_mask(tile).mean() < self.min_tissue:
+                        continue
+                    yield (
+                        tile,
+                        int((c0 + dc) * self.tile_size * self.downsample),
+                        int((r0 + dr) * self.tile_size * self.downsample)
+                    )
+                del region
+
+    def close(self):
+        self.slide.close()
+
+
+def _flush(collection, extractor, tiles: List[Image.Image], ids: List[str], metadatas: List[dict]):
+    embeddings = extractor.extract_features_batch(tiles)
+    collection.add(ids=ids, embeddings=embeddings.tolist(), metadatas=metadatas)
+
+
+def embed_slide(
+    slide_path: str,
+    collection,
+    extractor,
+    diagnosis: str = "Unknown",
+    source: str = "Internal WSI",
+    tile_size: int = TILE_SIZE,
+    level: int = 0,
+    batch_size: int = BATCH_SIZE,
+    min_tissue: float = MIN_TISSUE_FRACTION
+) -> int:
+    """
+    切分一张切片并把组织图块的特征写入collection
+
+    Args:
+        slide_path: 切片文件路径
+        collection: ChromaDB collection
+        extractor: PLIPFeatureExtractor实例
+        diagnosis: 切片诊断标签（写入每个图块的元数据）
+        source: 数据来源
+        tile_size: 图块边长
+        level: 金字塔层级
+        batch_size: 特征提取批大小
+        min_tissue: 最小组织占比
+
+    Returns:
+        写入的图块数
+    """
+    slide_id = Path(slide_path).stem
+    tiler = SlideTiler(slide_path, tile_size=tile_size, level=level, min_tissue=min_tissue)
+    print(f"  {slide_id}: {tiler.width}x{tiler.height} (层级 {level}), "
+          f"{tiler.rows * tiler.cols} 个图块中约 {tiler.tissue_tile_count} 个含组织")
+
+    tiles, ids, metadatas = [], [], []
+    written = 0
+    try:
+        for tile, x, y in tiler.iter_tiles():
+            tiles.append(tile)
+            ids.append(f"{slide_id}_L{level}_{x}_{y}")
+            metadatas.append({
+                "diagnosis": diagnosis,
+                "source": source,
+                "image_path": str(slide_path),
+                "filename": Path(slide_path).name,
+                "slide_id": slide_id,
+                "x": x,
+                "y": y,
+                "level": level,
+                "tile_size": tile_size
+            })
+            if len(tiles) >= batch_size:
+                _flush(collection, extractor, tiles, ids, metadatas)
+                written += len(tiles)
+                tiles, ids, metadatas = [], [], []
+        if tiles:
+            _flush(collection, extractor, tiles, ids, metadatas)
+            written += len(tiles)
+    finally:
+        tiler.close()
+
+    print(f"    写入 {written} 个图块")
+    return written
+
+
+def _collect_slides(paths: List[str]) -> List[str]:
+    slides = []
+    for p in paths:
+        if os.path.isdir(p):
+            slides.extend(
+                str(f) for f in sorted(Path(p).iterdir())
+                if f.suffix.lower() in SLIDE_FORMATS
+            )
+        else:
+            slides.append(p)
+    return slides
+
+
+def index_slides(
+    slide_paths: List[str],
+    db_path: str,
+    diagnosis: str = "Unknown",
+    level: int = 0,
+    tile_size: int = TILE_SIZE,
+    batch_size: int = BATCH_SIZE,
+    min_tissue: float = MIN_TISSUE_FRACTION
+):
+    """把一批切片的组织图块写入图谱索引"""
+    import chromadb
+    from chromadb.config import Settings
+    from plip_model import get_extractor, PLIPEmbeddingFunction
+    from indexer import COLLECTION_NAME
+
+    slides = _collect_slides(slide_paths)
+    if not slides:
+        print("错误: 未找到任何切片文件")
+        return
+
+    print(f"正在连接ChromaDB数据库: {db_path}")
+    chroma_client = chromadb.PersistentClient(path=db_path, settings=Settings(anonymized_telemetry=False))
+    collection = chroma_client.get_or_create_collection(
+        name=COLLECTION_NAME,
+        embedding_function=PLIPEmbeddingFunction()
+    )
+    extractor = get_extractor()
+
+    total = 0
+    for slide_path in slides:
+        try:
+            total += embed_slide(
+                slide_path,
+                collection,
+                extractor,
+                diagnosis=diagnosis,
+                tile_size=tile_size,
+                level=level,
+                batch_size=batch_size,
+                min_tissue=min_tissue
+            )
+        except Exception as e:
+            print(f"  跳过切片 {slide_path}: {e}")
+
+    print(f"\n✅ 切片索引完成！共 {len(slides)} 张切片，{total} 个图块")
+    print(f"总记录数: {collection.count()}")
+
+
+if __name__ == "__main__":
+    from indexer import DB_PATH
+
+    parser = argparse.ArgumentParser(description="全切片图像切块并写入病理图谱索引")
+    parser.add_argument("--slides", type=str, nargs="+", required=True, help="切片文件或包含切片的目录")
+    parser.add_argument("--db_path", type=str, default=DB_PATH, help=f"ChromaDB数据库路径（默认: {DB_PATH}）")
+    parser.add_argument("--diagnosis", type=str, default="Unknown", help="切片诊断标签（默认: Unknown）")
+    parser.add_argument("--level", type=int, default=0, help="金字塔层级（默认: 0，最高分辨率）")
+    parser.add_argument("--tile_size", type=int, default=TILE_SIZE, help=f"图块边长（默认: {TILE_SIZE}）")
+    parser.add_argument("--batch_size", type=int, default=BATCH_SIZE, help=f"特征提取批大小（默认: {BATCH_SIZE}）")
+    parser.add_argument("--min_tissue", type=float, default=MIN_TISSUE_FRACTION,
+                        help=f"图块最小组织占比（默认: {MIN_TISSUE_FRACTION}）")
+
+    args = parser.parse_args()
+
+    try:
+        index_slides(
+            args.slides,
+            args.db_path,
+            diagnosis=args.diagnosis,
+            level=args.level,
+            tile_size=args.tile_size,
+            batch_size=args.batch_size,
+            min_tissue=args.min_tissue
+        )
+    except KeyboardInterrupt:
+        print("\n\n切片索引被用户中断")
+    except Exception as e:
+        print(f"\n错误: {e}")
+        import traceback
+        traceback.print_exc()
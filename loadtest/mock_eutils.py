@@ -0,0 +1,148 @@
+"""
+本地模拟的 NCBI E-utilities 服务（esearch / esummary / efetch）
+压测 PubMed 服务时代替真实的 eutils，不访问网络、不受NCBI限速影响
+
+- 返回结果由检索式和PMID确定性生成，同一请求总是得到相同的响应
+- 可注入固定延迟 + 随机抖动，模拟真实上游的网络耗时
+- 可按比例注入 429 / 503 错误，用于检查错误路径
+
+用法:
+    python mock_eutils.py --port 18990 --latency_ms 80 --jitter_ms 40
+    PUBMED_EUTILS_URL=http://127.0.0.1:18990 python ../pubmed_mcp/server.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+PORT = 18990
+# esearch 每个检索式模拟的命中总数
+TOTAL_HITS = 500
+
+_JOURNALS = ["Journal of Clinical Pathology", "Diagnostic Pathology", "BMC Cancer", "Human Pathology", "Cureus"]
+_TOPICS = ["adenocarcinoma", "lymphoma", "sarcoma", "neuroendocrine tumor", "metastatic carcinoma"]
+_SITES = ["colon", "lung", "stomach", "breast", "liver", "kidney"]
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "big")
+
+
+def _pmids(term: str, retmax: int) -> List[str]:
+    """检索式对应的确定性PMID列表"""
+    rng = random.Random(_seed(term))
+    return [str(rng.randint(30000000, 39999999)) for _ in range(min(retmax, TOTAL_HITS))]
+
+
+def _record(pmid: str) -> dict:
+    rng = random.Random(_seed(pmid))
+    topic, site = rng.choice(_TOPICS), rng.choice(_SITES)
+    return {
+        "uid": pmid,
+        "title": f"A rare case of {site} {topic}: case report and review of the literature",
+        "fulljournalname": rng.choice(_JOURNALS),
+        "pubdate": f"{rng.randint(2015, 2025)} {rng.choice(['Jan', 'Apr', 'Jul', 'Oct'])}",
+        "authors": [{"name": f"Author{rng.randint(1, 999)} {chr(65 + i)}"} for i in range(rng.randint(1, 6))],
+        "pubtype": ["Journal Article", "Case Reports"],
+        "elocationid": f"doi: 10.{rng.randint(1000, 9999)}/mock.{pmid}",
+        "abstract": (
+            f"We report a patient with {topic} of the {site}. "
+            f"Histology showed {rng.choice(['glandular', 'solid', 'papillary', 'diffuse'])} growth "
+            f"and immunohistochemistry was positive for {rng.choice(['CK20', 'CDX2', 'TTF-1', 'CD20', 'Synaptophysin'])}. "
+            "The clinical course, differential diagnosis and treatment are discussed."
+        )
+    }
+
+
+def _efetch_xml(pmids: List[str]) -> str:
+    articles = []
+    for pmid in pmids:
+        rec = _record(pmid)
+        articles.append(
+            "<PubmedArticle><MedlineCitation>"
+            f"<PMID>{pmid}</PMID><Article><ArticleTitle>{escape(rec['title'])}</ArticleTitle>"
+            f"<Abstract><AbstractText>{escape(rec['abstract'])}</AbstractText></Abstract>"
+            "</Article></MedlineCitation></PubmedArticle>"
+        )
+    return '<?xml version="1.0" ?><PubmedArticleSet>' + "".join(articles) + "</PubmedArticleSet>"
+
+
+class EutilsHandler(BaseHTTPRequestHandler):
+    """处理 /esearch.fcgi、/esummary.fcgi、/efetch.fcgi"""
+
+    latency_ms = 0.0
+    jitter_ms = 0.0
+    error_rate = 0.0
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        endpoint = url.path.rsplit("/", 1)[-1]
+
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            self._send(random.choice([429, 503]), "text/plain", b"mock upstream error")
+            return
+
+        if endpoint == "esearch.fcgi":
+            ids = _pmids(params.get("term", ""), int(params.get("retmax", "20")))
+            body = {"esearchresult": {"count": str(TOTAL_HITS), "retmax": str(len(ids)), "idlist": ids}}
+            self._send(200, "application/json", json.dumps(body).encode("utf-8"))
+        elif endpoint == "esummary.fcgi":
+            ids = [i for i in params.get("id", "").split(",") if i]
+            result = {"uids": ids}
+            for pmid in ids:
+                rec = _record(pmid)
+                rec.pop("abstract")
+                result[pmid] = rec
+            self._send(200, "application/json", json.dumps({"result": result}).encode("utf-8"))
+        elif endpoint == "efetch.fcgi":
+            ids = [i for i in params.get("id", "").split(",") if i]
+            self._send(200, "text/xml", _efetch_xml(ids).encode("utf-8"))
+        else:
+            self._send(404, "text/plain", b"unknown endpoint")
+
+    def _send(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 压测时每秒上百条访问日志，不输出
+        pass
+
+
+def serve(port: int = PORT, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0):
+    """启动模拟服务（阻塞）"""
+    EutilsHandler.latency_ms = latency_ms
+    EutilsHandler.jitter_ms = jitter_ms
+    EutilsHandler.error_rate = error_rate
+    server = ThreadingHTTPServer(("127.0.0.1", port), EutilsHandler)
+    server.daemon_threads = True
+    print(f"模拟 eutils 服务: http://127.0.0.1:{port}（延迟 {latency_ms}+{jitter_ms} ms，错误率 {error_rate:.1%}）")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟的 NCBI E-utilities 服务")
+    parser.add_argument("--port", type=int, default=PORT, help=f"监听端口（默认: {PORT}）")
+    parser.add_argument("--latency_ms", type=float, default=0.0, help="每个请求的固定延迟（毫秒）")
+    parser.add_argument("--jitter_ms", type=float, default=0.0, help="额外的随机延迟上限（毫秒）")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="注入 429/503 错误的比例（0-1）")
+
+    args = parser.parse_args()
+
+    try:
+        serve(args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    except KeyboardInterrupt:
+        print("\n\n服务已停止")
@@ -0,0 +1,500 @@
+"""
+三个MCP SSE服务的端到端压测
+按配置的并发数和请求配比同时调用 图像搜索（18930）/ 报告解析（18910）/ PubMed检索（18920），
+报告每类请求和整体的吞吐（QPS）、延迟分位数和错误率，结果保存为JSON，可与基线结果对比
+
+默认在本地启动全部替身：
+- 微型随机权重CLIP代替PLIP，合成图块构建的紧凑向量索引代替图谱（standins.py）
+- 本地模拟的eutils服务代替NCBI（mock_eutils.py）
+因此不需要网络或GPU；--attach 时不启动任何进程，直接压测已在运行的服务
+
+用法:
+    python run_load.py --concurrency 16 --duration 60 --mix image=4,text=1,report=4,pubmed=2
+    python run_load.py --duration 60 --baseline results/baseline.json
+    python run_load.py --attach --host 10.0.0.5 --mix report=1
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import standins
+
+_LOADTEST_DIR = os.path.dirname(os.path.abspath(__file__))
+_REPO_DIR = os.path.dirname(_LOADTEST_DIR)
+
+# 各服务端口（与各 server.py 一致）
+SERVICE_PORTS = {"pathology": 18910, "pubmed": 18920, "image_search": 18930}
+SERVICE_SCRIPTS = {
+    "pathology": os.path.join(_REPO_DIR, "pathology_mcp", "server.py"),
+    "pubmed": os.path.join(_REPO_DIR, "pubmed_mcp", "server.py"),
+    "image_search": os.path.join(_REPO_DIR, "image_search_mcp", "server.py")
+}
+EUTILS_PORT = 18990
+DEFAULT_WORKDIR = os.path.join(_LOADTEST_DIR, "work")
+DEFAULT_MIX = "image=4,text=1,report=4,pubmed=2"
+# 等待服务启动的超时时间（秒）
+STARTUP_TIMEOUT = 300
+# 预热调用（含图像服务加载模型）的超时时间（秒）
+WARMUP_TIMEOUT = 600
+# 对比基线时超过该比例的变差判定为回退
+DEFAULT_TOLERANCE = 0.10
+# 错误率绝对值上升超过该值判定为回退
+ERROR_RATE_TOLERANCE = 0.01
+# 查询图块池大小
+QUERY_POOL = 32
+
+TEXT_QUERIES = [
+    "poorly differentiated adenocarcinoma with glandular structures",
+    "dense lymphocytic infiltrate",
+    "smooth muscle bundles",
+    "mucinous pools with floating tumor cells",
+    "necrotic debris",
+    "desmoplastic stroma"
+]
+
+REPORTS = [
+    ("extract_pathology_fields", (
+        "患者，男性，65岁。右肺上叶切除标本。\n"
+        "病理诊断：右肺上叶浸润性腺癌，分化差（G3），大小约 2.5 x 1.8 cm。\n"
+        "TNM 分期：pT2N1M0。\n"
+        "免疫组化：TTF-1(+), Napsin(+), P40(-), CK5/6(-), Ki67(30%)。\n"
+        "基因检测：EGFR L858R 突变阳性，ALK 阴性，KRAS 阴性。"
+    )),
+    ("extract_pathology_fields", (
+        "女，52岁。乳腺肿物切除。浸润性导管癌，组织学分级 II 级，肿瘤大小 3.1 cm。\n"
+        "ER(+, 90%), PR(+, 60%), HER2(2+), Ki-67(25%)。pT2N0M0。"
+    )),
+    ("extract_blood_test_fields", (
+        "血常规检查报告\nWBC: 6.5 ×10^9/L (参考范围: 3.5-10.0)\nRBC: 4.2 ×10^12/L (参考范围: 4.0-5.5)\n"
+        "HGB: 125 g/L (参考范围: 120-160)\nPLT: 220 ×10^9/L (参考范围: 100-300)\n"
+        "ALT: 45 U/L (参考范围: 0-40)\nCREA: 85 μmol/L (参考范围: 60-110)"
+    )),
+    ("extract_tumor_marker_fields", (
+        "肿瘤标志物检测\nCEA: 8.2 ng/mL (参考范围: 0-5)\nCA19-9: 45 U/mL (参考范围: 0-37)\n"
+        "AFP: 3.1 ng/mL (参考范围: 0-7)\nCA125: 20 U/mL (参考范围: 0-35)"
+    ))
+]
+
+PUBMED_QUERIES = [
+    "colorectal adenocarcinoma",
+    "pulmonary sclerosing pneumocytoma",
+    "gastric signet ring cell carcinoma",
+    "EGFR L858R lung adenocarcinoma",
+    "primary hepatic lymphoma"
+]
+
+
+class RequestMix:
+    """请求类型 -> (服务, 构造工具调用的函数)，按权重随机选择"""
+
+    OPERATIONS = {
+        "image": "image_search",
+        "text": "image_search",
+        "report": "pathology",
+        "pubmed": "pubmed"
+    }
+
+    def __init__(self, spec: str, seed: int = 0):
+        self.weights: Dict[str, float] = {}
+        for part in spec.split(","):
+            if not part.strip():
+                continue
+            name, _, weight = part.partition("=")
+            name = name.strip()
+            if name not in self.OPERATIONS:
+                raise ValueError(f"未知的请求类型: {name}，可选: {', '.join(self.OPERATIONS)}")
+            self.weights[name] = float(weight or 1)
+        self.weights = {k: v for k, v in self.weights.items() if v > 0}
+        if not self.weights:
+            raise ValueError(f"请求配比为空: {spec}")
+        self.seed = seed
+        self._payloads: List[str] = []
+
+    @property
+    def services(self) -> List[str]:
+        return sorted({self.OPERATIONS[name] for name in self.weights})
+
+    def prepare(self):
+        """预先编码查询图块（Base64 PNG），压测过程中不做编码"""
+        if "image" not in self.weights:
+            return
+        for _, tile in standins.synthetic_tiles(QUERY_POOL, self.seed + 1):
+            buf = io.BytesIO()
+            tile.save(buf, format="PNG")
+            self._payloads.append(base64.b64encode(buf.getvalue()).decode())
+
+    def call(self, name: str, rng: random.Random) -> tuple:
+        """返回 (服务, 工具名, 参数)"""
+        service = self.OPERATIONS[name]
+        if name == "image":
+            return service, "search_similar_cases", {"query_image": rng.choice(self._payloads), "top_k": 5}
+        if name == "text":
+            return service, "search_atlas_by_text", {"query_text": rng.choice(TEXT_QUERIES), "top_k": 5}
+        if name == "report":
+            tool, text = rng.choice(REPORTS)
+            return service, tool, {"report_text": text}
+        return service, "search_pubmed", {"query": rng.choice(PUBMED_QUERIES), "max_results": 10}
+
+    def pick(self, rng: random.Random) -> str:
+        names = list(self.weights)
+        return rng.choices(names, weights=[self.weights[n] for n in names])[0]
+
+
+# ---------- 进程管理 ----------
+
+def _port_open(host: str, port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.settimeout(0.5)
+        return sock.connect_ex((host, port)) == 0
+
+
+def _wait_http(url: str, timeout: float = STARTUP_TIMEOUT):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"{url} 在 {timeout} s 内未就绪")
+            time.sleep(0.5)
+
+
+class StandInStack:
+    """在本地启动替身和被压测的服务，退出时全部终止"""
+
+    def __init__(self, workdir: str, services: List[str], eutils_latency_ms: float,
+                 eutils_jitter_ms: float, eutils_error_rate: float):
+        self.workdir = os.path.abspath(workdir)
+        self.services = services
+        self.eutils_args = [
+            "--latency_ms", str(eutils_latency_ms),
+            "--jitter_ms", str(eutils_jitter_ms),
+            "--error_rate", str(eutils_error_rate)
+        ]
+        self.processes: List[subprocess.Popen] = []
+        self._logs = []
+
+    def _spawn(self, name: str, args: List[str], env: dict) -> subprocess.Popen:
+        log_dir = os.path.join(self.workdir, "logs")
+        os.makedirs(log_dir, exist_ok=True)
+        log_file = open(os.path.join(log_dir, f"{name}.log"), "w", encoding="utf-8")
+        self._logs.append(log_file)
+        proc = subprocess.Popen(
+            [sys.executable] + args,
+            cwd=self.workdir,
+            env={**os.environ, **env},
+            stdout=log_file,
+            stderr=subprocess.STDOUT
+        )
+        self.processes.append(proc)
+        return proc
+
+    def start(self):
+        busy = [f"{name}:{SERVICE_PORTS[name]}" for name in self.services if _port_open("127.0.0.1", SERVICE_PORTS[name])]
+        if busy:
+            raise RuntimeError(f"端口已被占用: {', '.join(busy)}。请先停止这些服务，或使用 --attach 压测已运行的服务")
+
+        env = {
+            "PLIP_LOCAL_PATH": standins.model_dir(self.workdir),
+            "PLIP_OFFLINE": "1",
+            "PLIP_PROXY": "",
+            "ATLAS_INDEX_PATH": standins.index_dir(self.workdir),
+            "BLOB_STORE_PATH": os.path.join(self.workdir, "blob_store"),
+            "PUBMED_EUTILS_URL": f"http://127.0.0.1:{EUTILS_PORT}",
+            "MCP_LOG_LEVEL": os.getenv("MCP_LOG_LEVEL", "WARNING"),
+            "PYTHONUNBUFFERED": "1"
+        }
+        if "pubmed" in self.services:
+            self._spawn("mock_eutils", [os.path.join(_LOADTEST_DIR, "mock_eutils.py"),
+                                        "--port", str(EUTILS_PORT)] + self.eutils_args, env)
+            _wait_http(f"http://127.0.0.1:{EUTILS_PORT}/esearch.fcgi?term=warmup&retmax=1")
+        for name in self.services:
+            self._spawn(name, [SERVICE_SCRIPTS[name]], env)
+
+        for name in self.services:
+            _wait_http(f"http://127.0.0.1:{SERVICE_PORTS[name]}/metrics")
+            print(f"  {name} 已就绪 (:{SERVICE_PORTS[name]})")
+        for proc in self.processes:
+            if proc.poll() is not None:
+                raise RuntimeError(f"进程意外退出: {' '.join(proc.args)}，日志见 {os.path.join(self.workdir, 'logs')}")
+
+    def stop(self):
+        for proc in self.processes:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in self.processes:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        for log_file in self._logs:
+            log_file.close()
+
+
+# ---------- 压测 ----------
+
+def _is_error(result) -> bool:
+    """工具以JSON返回的错误（query_status=error 或 {"error": ...}）也计为失败"""
+    for block in getattr(result, "content", None) or []:
+        head = (getattr(block, "text", "") or "")[:200]
+        return '"query_status": "error"' in head or head.startswith('{"error"')
+    return False
+
+
+async def _warmup(urls: Dict[str, str], mix: RequestMix):
+    """每类请求调用一次（触发模型加载、索引映射等懒加载），不计入统计"""
+    from fastmcp import Client
+
+    rng = random.Random(mix.seed)
+    for name in mix.weights:
+        service, tool, arguments = mix.call(name, rng)
+        async with Client(urls[service], timeout=WARMUP_TIMEOUT) as client:
+            result = await client.call_tool(tool, arguments)
+            if _is_error(result):
+                raise RuntimeError(f"预热调用 {tool} 返回错误: {result.content[0].text[:500]}")
+
+
+async def _worker(worker_id: int, urls: Dict[str, str], mix: RequestMix, deadline: float,
+                  budget: List[int], samples: List[tuple]):
+    """一个并发客户端：与各服务各保持一个会话，按配比循环发请求（闭环，上一个返回后发下一个）"""
+    from contextlib import AsyncExitStack
+    from fastmcp import Client
+
+    rng = random.Random(mix.seed * 1000 + worker_id)
+    async with AsyncExitStack() as stack:
+        clients = {}
+        for service in mix.services:
+            clients[service] = await stack.enter_async_context(Client(urls[service]))
+        while time.perf_counter() < deadline:
+            if budget[0] <= 0:
+                return
+            budget[0] -= 1
+            name = mix.pick(rng)
+            service, tool, arguments = mix.call(name, rng)
+            start = time.perf_counter()
+            try:
+                result = await clients[service].call_tool(tool, arguments)
+                ok = not _is_error(result)
+            except Exception:
+                ok = False
+            samples.append((name, start, time.perf_counter() - start, ok))
+
+
+def _summarize(samples: List[tuple], elapsed: float) -> dict:
+    latencies = np.array([s[2] for s in samples]) * 1000 if samples else np.zeros(0)
+    errors = sum(1 for s in samples if not s[3])
+    summary = {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "qps": round(len(samples) / elapsed, 2) if elapsed else 0.0
+    }
+    if len(latencies):
+        summary.update({
+            "mean_ms": round(float(latencies.mean()), 2),
+            **{f"p{q}_ms": round(float(np.percentile(latencies, q)), 2) for q in (50, 90, 95, 99)},
+            "max_ms": round(float(latencies.max()), 2)
+        })
+    return summary
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=_REPO_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_load(urls: Dict[str, str], mix: RequestMix, concurrency: int, duration: float,
+                   max_requests: Optional[int]) -> dict:
+    """
+    执行一轮压测
+
+    Args:
+        urls: 服务 -> SSE地址
+        mix: 请求配比
+        concurrency: 并发客户端数
+        duration: 最长持续时间（秒）
+        max_requests: 总请求数上限（None表示只按时间）
+
+    Returns:
+        压测结果（整体和每类请求的统计）
+    """
+    print("预热...")
+    await _warmup(urls, mix)
+
+    print(f"压测: 并发 {concurrency}，时长 {duration:.0f} s" + (f"，最多 {max_requests} 个请求" if max_requests else ""))
+    samples: List[tuple] = []
+    budget = [max_requests or float("inf")]
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        _worker(i, urls, mix, start + duration, budget, samples) for i in range(concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+
+    return {
+        "overall": _summarize(samples, elapsed),
+        "operations": {
+            name: _summarize([s for s in samples if s[0] == name], elapsed)
+            for name in mix.weights
+        },
+        "elapsed_seconds": round(elapsed, 2)
+    }
+
+
+# ---------- 报告 ----------
+
+def print_report(result: dict):
+    print(f"\n{'请求类型':<10s} {'请求数':>7s} {'QPS':>8s} {'错误率':>7s} {'p50(ms)':>8s} {'p90(ms)':>8s} "
+          f"{'p95(ms)':>8s} {'p99(ms)':>8s} {'max(ms)':>8s}")
+    rows = list(result["operations"].items()) + [("overall", result["overall"])]
+    for name, s in rows:
+        print(f"{name:<10s} {s['requests']:7d} {s['qps']:8.1f} {s['error_rate']:7.2%} "
+              f"{s.get('p50_ms', 0):8.1f} {s.get('p90_ms', 0):8.1f} {s.get('p95_ms', 0):8.1f} "
+              f"{s.get('p99_ms', 0):8.1f} {s.get('max_ms', 0):8.1f}")
+
+
+def compare_with_baseline(result: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    与基线结果对比，打印变化并返回回退项
+
+    QPS下降、p95/p99上升超过 tolerance 比例，或错误率上升超过 ERROR_RATE_TOLERANCE 时判定为回退
+    """
+    regressions = []
+
+    def _delta(now: float, base: float) -> float:
+        return (now - base) / base if base else 0.0
+
+    print(f"\n与基线对比（基线: {baseline.get('timestamp', '?')} @ {baseline.get('git_revision') or '?'}）")
+    print(f"{'请求类型':<10s} {'QPS':>18s} {'p95(ms)':>20s} {'p99(ms)':>20s} {'错误率':>16s}")
+    names = [n for n in result["operations"] if n in baseline.get("operations", {})] + ["overall"]
+    for name in names:
+        now = result["overall"] if name == "overall" else result["operations"][name]
+        base = baseline["overall"] if name == "overall" else baseline["operations"][name]
+        cells = []
+        for key, worse_if_higher in (("qps", False), ("p95_ms", True), ("p99_ms", True)):
+            delta = _delta(now.get(key, 0), base.get(key, 0))
+            worse = delta > tolerance if worse_if_higher else delta < -tolerance
+            if worse:
+                regressions.append(f"{name}.{key}: {base.get(key, 0)} -> {now.get(key, 0)} ({delta:+.1%})")
+            cells.append(f"{base.get(key, 0):.1f}->{now.get(key, 0):.1f} {delta:+6.1%}{'!' if worse else ' '}")
+        error_delta = now["error_rate"] - base["error_rate"]
+        if error_delta > ERROR_RATE_TOLERANCE:
+            regressions.append(f"{name}.error_rate: {base['error_rate']:.2%} -> {now['error_rate']:.2%}")
+        cells.append(f"{base['error_rate']:.2%}->{now['error_rate']:.2%}{'!' if error_delta > ERROR_RATE_TOLERANCE else ' '}")
+        print(f"{name:<10s} {cells[0]:>18s} {cells[1]:>20s} {cells[2]:>20s} {cells[3]:>16s}")
+
+    if regressions:
+        print(f"\n⚠️  {len(regressions)} 项超过容差（{tolerance:.0%}）:")
+        for item in regressions:
+            print(f"  - {item}")
+    else:
+        print(f"\n✅ 所有指标都在容差（{tolerance:.0%}）以内")
+    return regressions
+
+
+def main(args) -> int:
+    mix = RequestMix(args.mix, args.seed)
+    host = args.host if args.attach else "127.0.0.1"
+    urls = {service: f"http://{host}:{SERVICE_PORTS[service]}/sse" for service in mix.services}
+
+    stack = None
+    if not args.attach:
+        if "image_search" in mix.services:
+            standins.prepare(args.workdir, args.atlas_size, args.seed)
+        print(f"启动服务: {', '.join(mix.services)}")
+        stack = StandInStack(args.workdir, mix.services, args.eutils_latency_ms,
+                             args.eutils_jitter_ms, args.eutils_error_rate)
+    try:
+        if stack:
+            stack.start()
+        mix.prepare()
+        result = asyncio.run(run_load(urls, mix, args.concurrency, args.duration, args.requests))
+    finally:
+        if stack:
+            stack.stop()
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "git_revision": _git_revision(),
+        "config": {
+            "mix": mix.weights,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "max_requests": args.requests,
+            "attach": args.attach,
+            "atlas_size": None if args.attach else args.atlas_size,
+            "eutils_latency_ms": None if args.attach else args.eutils_latency_ms,
+            "eutils_jitter_ms": None if args.attach else args.eutils_jitter_ms,
+            "eutils_error_rate": None if args.attach else args.eutils_error_rate
+        },
+        "host": {"platform": platform.platform(), "cpu_count": os.cpu_count(), "python": platform.python_version()},
+        **result
+    }
+    print_report(result)
+
+    output = args.output or os.path.join(args.workdir, "results", f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"\n结果已保存: {output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config", {}).get("mix") != result["config"]["mix"] \
+                or baseline.get("config", {}).get("concurrency") != args.concurrency:
+            print("⚠️  基线的请求配比或并发数与本次不同，对比结果仅供参考")
+        if compare_with_baseline(result, baseline, args.tolerance) and args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MCP SSE服务端到端压测")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发客户端数（默认: 16）")
+    parser.add_argument("--duration", type=float, default=60, help="压测时长（秒，默认: 60）")
+    parser.add_argument("--requests", type=int, default=None, help="总请求数上限（默认只按时长）")
+    parser.add_argument("--mix", type=str, default=DEFAULT_MIX,
+                        help=f"请求配比，类型: image / text / report / pubmed（默认: {DEFAULT_MIX}）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子（默认: 0）")
+    parser.add_argument("--attach", action="store_true", help="压测已在运行的服务，不启动替身")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="--attach 时服务所在主机（默认: 127.0.0.1）")
+    parser.add_argument("--workdir", type=str, default=DEFAULT_WORKDIR, help="替身模型、合成图谱、日志和结果目录")
+    parser.add_argument("--atlas_size", type=int, default=2000, help="合成图谱的图块数（默认: 2000）")
+    parser.add_argument("--eutils_latency_ms", type=float, default=50, help="模拟eutils的固定延迟（毫秒，默认: 50）")
+    parser.add_argument("--eutils_jitter_ms", type=float, default=50, help="模拟eutils的随机延迟上限（毫秒，默认: 50）")
+    parser.add_argument("--eutils_error_rate", type=float, default=0.0, help="模拟eutils注入错误的比例（默认: 0）")
+    parser.add_argument("--output", type=str, default=None, help="结果JSON路径（默认: <workdir>/results/loadtest-<时间>.json）")
+    parser.add_argument("--baseline", type=str, default=None, help="基线结果JSON，给出时对比并标出回退项")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"判定回退的相对变化阈值（默认: {DEFAULT_TOLERANCE}）")
+    parser.add_argument("--fail_on_regression", action="store_true", help="有回退项时以退出码1结束（用于CI）")
+
+    args = parser.parse_args()
+
+    try:
+        sys.exit(main(args))
+    except KeyboardInterrupt:
+        print("\n\n压测被用户中断")
+    except Exception as e:
+        print(f"\n错误: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
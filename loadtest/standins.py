@@ -0,0 +1,186 @@
+"""
+压测用的本地替身：随机权重的微型CLIP模型（代替PLIP）、合成组织图块和合成图谱索引
+不需要网络、GPU或真实数据集，用于测量服务本身（解码、预处理、检索、序列化、并发调度）的容量
+
+- 微型CLIP与PLIP结构相同（CLIPModel + CLIPProcessor），输入尺寸224，图像/文本塔各2层、宽64，
+  以 PLIP_LOCAL_PATH 指向它即可被 plip_model.py 直接加载
+- 合成图块按 NCT-CRC 的9个类别生成不同底色和纹理，查询图块与图谱图块使用不同的随机种子
+- 图谱以紧凑向量索引（vector_store.py）保存，以 ATLAS_INDEX_PATH 指向它，不需要ChromaDB
+
+用法:
+    python standins.py --workdir ./work --atlas_size 2000
+"""
+import argparse
+import json
+import os
+import sys
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+_REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_SEARCH_DIR = os.path.join(_REPO_DIR, "image_search_mcp")
+sys.path.insert(0, IMAGE_SEARCH_DIR)
+
+from build_atlas import NCT_CRC_CATEGORIES  # noqa: E402
+
+TILE_SIZE = 224
+# 微型CLIP的结构参数
+TINY_HIDDEN = 64
+TINY_LAYERS = 2
+TINY_HEADS = 2
+# 替身模型的标记文件（与真实PLIP快照区分）
+STANDIN_INFO = "standin_info.json"
+
+
+def model_dir(workdir: str) -> str:
+    return os.path.join(workdir, "tiny_plip")
+
+
+def index_dir(workdir: str) -> str:
+    return os.path.join(workdir, "atlas_index")
+
+
+def synthetic_tile(rng: np.random.Generator, category: int, size: int = TILE_SIZE) -> Image.Image:
+    """合成一张组织样图块：类别决定底色和斑点密度，叠加随机斑点和噪声"""
+    hue = np.random.default_rng(category).integers(60, 230, 3)
+    tile = np.empty((size, size, 3), dtype=np.float32)
+    tile[:] = hue
+    n_blobs = 20 + 15 * category
+    ys, xs = rng.integers(0, size, n_blobs), rng.integers(0, size, n_blobs)
+    yy, xx = np.ogrid[:size, :size]
+    for y, x in zip(ys, xs):
+        radius = rng.integers(3, 12)
+        mask = (yy - y) ** 2 + (xx - x) ** 2 <= radius ** 2
+        tile[mask] *= 0.55
+    tile += rng.normal(0, 12, tile.shape)
+    return Image.fromarray(np.clip(tile, 0, 255).astype(np.uint8))
+
+
+def synthetic_tiles(n: int, seed: int) -> List[Tuple[str, Image.Image]]:
+    """n 张合成图块，返回 [(类别代码, 图块), ...]，类别轮流分配"""
+    rng = np.random.default_rng(seed)
+    categories = list(NCT_CRC_CATEGORIES)
+    return [
+        (categories[i % len(categories)], synthetic_tile(rng, i % len(categories)))
+        for i in range(n)
+    ]
+
+
+def make_tiny_clip(path: str, seed: int = 0):
+    """
+    生成随机权重的微型CLIP快照（config.json + 权重 + processor配置）
+
+    分词器使用只含单字节符号的BPE词表（无合并规则），文本按字符切分，
+    与真实CLIP分词器接口一致
+    """
+    import torch
+    from transformers import CLIPConfig, CLIPImageProcessor, CLIPModel, CLIPProcessor, CLIPTokenizer
+    from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+    os.makedirs(path, exist_ok=True)
+    symbols = list(bytes_to_unicode().values())
+    tokens = symbols + [s + "</w>" for s in symbols] + ["<|startoftext|>", "<|endoftext|>"]
+    vocab = {token: i for i, token in enumerate(tokens)}
+    vocab_file = os.path.join(path, "vocab.json")
+    merges_file = os.path.join(path, "merges.txt")
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+    with open(merges_file, "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n")
+
+    bos, eos = vocab["<|startoftext|>"], vocab["<|endoftext|>"]
+    config = CLIPConfig(
+        text_config={
+            "vocab_size": len(vocab),
+            "hidden_size": TINY_HIDDEN,
+            "intermediate_size": TINY_HIDDEN * 2,
+            "num_hidden_layers": TINY_LAYERS,
+            "num_attention_heads": TINY_HEADS,
+            "max_position_embeddings": 77,
+            "bos_token_id": bos,
+            "eos_token_id": eos,
+            "pad_token_id": eos
+        },
+        vision_config={
+            "hidden_size": TINY_HIDDEN,
+            "intermediate_size": TINY_HIDDEN * 2,
+            "num_hidden_layers": TINY_LAYERS,
+            "num_attention_heads": TINY_HEADS,
+            "image_size": TILE_SIZE,
+            "patch_size": 32
+        },
+        projection_dim=TINY_HIDDEN
+    )
+    torch.manual_seed(seed)
+    CLIPModel(config).eval().save_pretrained(path)
+
+    tokenizer = CLIPTokenizer(vocab_file, merges_file)
+    CLIPProcessor(image_processor=CLIPImageProcessor(), tokenizer=tokenizer).save_pretrained(path)
+    with open(os.path.join(path, STANDIN_INFO), "w", encoding="utf-8") as f:
+        json.dump({"model": "tiny-random-clip", "seed": seed, "hidden_size": TINY_HIDDEN}, f)
+
+
+def build_synthetic_atlas(workdir: str, n_tiles: int, seed: int = 0, batch_size: int = 64):
+    """用微型CLIP提取合成图块的特征，构建紧凑向量索引"""
+    # plip_model 在导入时读取环境变量
+    os.environ["PLIP_LOCAL_PATH"] = model_dir(workdir)
+    os.environ["PLIP_OFFLINE"] = "1"
+    from plip_model import PLIPFeatureExtractor
+    from vector_store import AtlasVectorIndex
+
+    extractor = PLIPFeatureExtractor(device="cpu", image_backend="torch", quantize=False)
+    tiles = synthetic_tiles(n_tiles, seed)
+    features = []
+    for start in range(0, n_tiles, batch_size):
+        batch = [tile for _, tile in tiles[start:start + batch_size]]
+        features.append(extractor.extract_features_batch(batch))
+    ids = [f"synthetic_{i:06d}" for i in range(n_tiles)]
+    metadatas = [
+        {
+            "diagnosis": category,
+            "source": "synthetic",
+            "filename": f"{ids[i]}.png",
+            "image_path": f"synthetic://{ids[i]}.png"
+        }
+        for i, (category, _) in enumerate(tiles)
+    ]
+    index = AtlasVectorIndex.build(ids, np.concatenate(features), metadatas, dtype="int8")
+    index.save(index_dir(workdir))
+    print(f"合成图谱: {n_tiles} 个图块，{index.dim} 维 -> {index_dir(workdir)}")
+
+
+def prepare(workdir: str, atlas_size: int, seed: int = 0, rebuild: bool = False):
+    """准备微型模型和合成图谱（已存在且图块数一致时跳过）"""
+    os.makedirs(workdir, exist_ok=True)
+    if rebuild or not os.path.exists(os.path.join(model_dir(workdir), STANDIN_INFO)):
+        print(f"生成微型随机权重CLIP -> {model_dir(workdir)}")
+        make_tiny_clip(model_dir(workdir), seed)
+
+    info_path = os.path.join(index_dir(workdir), "index.json")
+    if not rebuild and os.path.exists(info_path):
+        with open(info_path, "r", encoding="utf-8") as f:
+            if json.load(f).get("count") == atlas_size:
+                return
+    build_synthetic_atlas(workdir, atlas_size, seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成压测用的微型模型和合成图谱")
+    parser.add_argument("--workdir", type=str, required=True, help="输出目录")
+    parser.add_argument("--atlas_size", type=int, default=2000, help="合成图谱的图块数（默认: 2000）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子（默认: 0）")
+    parser.add_argument("--rebuild", action="store_true", help="重新生成模型和图谱")
+
+    args = parser.parse_args()
+
+    try:
+        prepare(args.workdir, args.atlas_size, args.seed, args.rebuild)
+    except KeyboardInterrupt:
+        print("\n\n操作被用户中断")
+    except Exception as e:
+        print(f"\n错误: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,11 @@
+"""
+三个MCP服务共用的可观测性组件
+- metrics: 工具/阶段耗时直方图、调用计数、并发中的请求数、缓存命中率，/metrics 端点与 get_server_stats 工具
+- log: 分级结构化日志（MCP_LOG_LEVEL / MCP_LOG_FORMAT）
+
+各服务目录下的 server.py 把仓库根目录加入 sys.path 后导入本包
+"""
+from mcp_common.log import get_logger
+from mcp_common.metrics import REGISTRY, install_metrics, register_cache, stage, timed
+
+__all__ = ["REGISTRY", "get_logger", "install_metrics", "register_cache", "stage", "timed"]
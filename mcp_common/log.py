@@ -0,0 +1,93 @@
+"""
+分级结构化日志
+
+环境变量:
+- MCP_LOG_LEVEL: DEBUG / INFO（默认）/ WARNING / ERROR / OFF（关闭全部日志）
+- MCP_LOG_FORMAT: text（默认，"时间 级别 模块 消息 key=value ..."）/ json（每行一个JSON对象）
+
+用法:
+    log = get_logger("image_search")
+    log.info("图片解码成功", width=224, height=224)
+    log.debug(...) 在级别高于DEBUG时直接返回，不做格式化和输出
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.getenv("MCP_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("MCP_LOG_FORMAT", "text").lower()
+ROOT_LOGGER = "mcp"
+
+# LoggerAdapter.log 本身支持的关键字参数，其余关键字参数作为结构化字段
+_LOGGING_KWARGS = ("exc_info", "stack_info", "stacklevel", "extra")
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class StructuredFormatter(logging.Formatter):
+    """把记录上的结构化字段输出为 key=value 或 JSON"""
+
+    def __init__(self, json_output: bool = False):
+        super().__init__()
+        self.json_output = json_output
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        if self.json_output:
+            payload = {
+                "ts": f"{timestamp}.{int(record.msecs):03d}",
+                "level": record.levelname,
+                "logger": record.name,
+                "msg": record.getMessage(),
+                **fields
+            }
+            if record.exc_info:
+                payload["exc"] = self.formatException(record.exc_info)
+            return json.dumps(payload, ensure_ascii=False, default=str)
+
+        line = f"{timestamp} {record.levelname:<7s} {record.name} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """支持 log.info("消息", key=value) 形式结构化字段的日志器"""
+
+    def process(self, msg, kwargs):
+        fields = {k: kwargs.pop(k) for k in list(kwargs) if k not in _LOGGING_KWARGS}
+        if fields:
+            extra = dict(kwargs.get("extra") or {})
+            extra["fields"] = fields
+            kwargs["extra"] = extra
+        return msg, kwargs
+
+
+def _configure():
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        root = logging.getLogger(ROOT_LOGGER)
+        root.propagate = False
+        if LOG_LEVEL == "OFF":
+            root.disabled = True
+        else:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(StructuredFormatter(json_output=LOG_FORMAT == "json"))
+            root.addHandler(handler)
+            root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        _configured = True
+
+
+def get_logger(name: str) -> StructuredLogger:
+    """获取服务/模块的日志器（名称为 mcp.<name>）"""
+    _configure()
+    return StructuredLogger(logging.getLogger(f"{ROOT_LOGGER}.{name}"), {})
@@ -0,0 +1,308 @@
+"""
+进程内指标采集
+
+- 计数器、仪表（gauge）和固定分桶的耗时直方图，标签为关键字参数
+- 每个工具调用的次数/状态/耗时/并发中请求数由FastMCP中间件自动记录
+- 阶段耗时（解码、特征提取、检索、esearch、正则抽取……）用 stage() 上下文管理器或 timed() 装饰器记录
+- 缓存命中率通过 register_cache() 注册回调，在读取指标时才取值，不影响缓存本身的热路径
+
+install_metrics(mcp) 注册 GET /metrics（Prometheus文本格式）和 get_server_stats 工具
+"""
+import functools
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Tuple
+
+# 耗时直方图分桶上界（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+TOOL_CALLS = "mcp_tool_calls_total"
+TOOL_DURATION = "mcp_tool_duration_seconds"
+TOOL_IN_FLIGHT = "mcp_tool_in_flight"
+STAGE_DURATION = "mcp_stage_duration_seconds"
+CACHE_HITS = "mcp_cache_hits_total"
+CACHE_MISSES = "mcp_cache_misses_total"
+
+_HELP = {
+    TOOL_CALLS: ("counter", "工具调用次数（status: ok / error / exception）"),
+    TOOL_DURATION: ("histogram", "工具调用耗时"),
+    TOOL_IN_FLIGHT: ("gauge", "正在处理的工具调用数"),
+    STAGE_DURATION: ("histogram", "处理阶段耗时"),
+    CACHE_HITS: ("counter", "缓存命中次数"),
+    CACHE_MISSES: ("counter", "缓存未命中次数"),
+    "mcp_uptime_seconds": ("gauge", "服务运行时长"),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    """固定分桶直方图（非累积计数，输出时累积）"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """按分桶线性插值估计分位数"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, c in enumerate(self.counts):
+            upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+            if c and seen + c >= rank:
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+            lower = upper
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """线程安全的指标注册表"""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._gauges: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], Histogram] = {}
+        self._caches: Dict[str, Callable[[], Tuple[int, int]]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_gauge(self, name: str, delta: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def register_cache(self, name: str, stats: Callable[[], Tuple[int, int]]):
+        """注册缓存统计回调，返回 (命中次数, 未命中次数)"""
+        self._caches[name] = stats
+
+    def _cache_stats(self) -> Dict[str, Tuple[int, int]]:
+        stats = {}
+        for name, fn in self._caches.items():
+            try:
+                stats[name] = tuple(fn())
+            except Exception:
+                continue
+        return stats
+
+    def render_prometheus(self) -> str:
+        """Prometheus文本格式（0.0.4）"""
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {k: (list(h.counts), h.sum, h.count, h.buckets) for k, h in self._histograms.items()}
+        for name, (hits, misses) in self._cache_stats().items():
+            counters[(CACHE_HITS, (("cache", name),))] = hits
+            counters[(CACHE_MISSES, (("cache", name),))] = misses
+        gauges[("mcp_uptime_seconds", ())] = time.time() - self.start_time
+
+        described = set()
+
+        def describe(name: str, default_type: str):
+            if name not in described:
+                metric_type, help_text = _HELP.get(name, (default_type, name))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                described.add(name)
+
+        for (name, key), value in sorted(counters.items()):
+            describe(name, "counter")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), value in sorted(gauges.items()):
+            describe(name, "gauge")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), (counts, total, count, buckets) in sorted(histograms.items()):
+            describe(name, "histogram")
+            cumulative = 0
+            for upper, c in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += c
+                le = f'le="{upper}"'
+                lines.append(f"{name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """汇总视图（get_server_stats 使用）：各工具/阶段的次数与耗时分位数、并发数、缓存命中率"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = dict(self._histograms)
+
+            def summarize(hist: Histogram) -> dict:
+                return {
+                    "count": hist.count,
+                    "mean_ms": round(1000 * hist.sum / hist.count, 2) if hist.count else 0.0,
+                    "p50_ms": round(1000 * hist.quantile(0.5), 2),
+                    "p95_ms": round(1000 * hist.quantile(0.95), 2),
+                    "p99_ms": round(1000 * hist.quantile(0.99), 2)
+                }
+
+            tools: Dict[str, dict] = {}
+            stages: Dict[str, dict] = {}
+            for (name, key), hist in histograms.items():
+                labels = dict(key)
+                if name == TOOL_DURATION:
+                    tools.setdefault(labels["tool"], {}).update(summarize(hist))
+                elif name == STAGE_DURATION:
+                    stages[labels["stage"]] = summarize(hist)
+
+        for (name, key), value in counters.items():
+            labels = dict(key)
+            if name == TOOL_CALLS and labels.get("status") != "ok":
+                tool = tools.setdefault(labels["tool"], {})
+                tool["errors"] = tool.get("errors", 0) + int(value)
+        for (name, key), value in gauges.items():
+            if name == TOOL_IN_FLIGHT:
+                tools.setdefault(dict(key)["tool"], {})["in_flight"] = int(value)
+
+        caches = {
+            name: {
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None
+            }
+            for name, (hits, misses) in self._cache_stats().items()
+        }
+        return {
+            "uptime_seconds": round(time.time() - self.start_time, 1),
+            "tools": tools,
+            "stages": stages,
+            "caches": caches
+        }
+
+
+REGISTRY = MetricsRegistry()
+
+
+def stage(name: str):
+    """记录一个处理阶段的耗时: with stage("decode"): ..."""
+    return REGISTRY.timer(STAGE_DURATION, stage=name)
+
+
+def timed(name: str):
+    """把函数整体作为一个处理阶段计时的装饰器（支持同步和异步函数）"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_cache(name: str, stats: Callable[[], Tuple[int, int]]):
+    REGISTRY.register_cache(name, stats)
+
+
+def _is_error_result(result) -> bool:
+    """工具按约定以JSON返回错误（query_status=error 或 {"error": ...}），不抛异常"""
+    for block in getattr(result, "content", None) or []:
+        head = (getattr(block, "text", "") or "")[:200]
+        return '"query_status": "error"' in head or head.startswith('{"error"')
+    return False
+
+
+def install_metrics(mcp, service: str):
+    """
+    为FastMCP服务器安装指标采集
+
+    - 中间件记录每次工具调用的次数、状态、耗时和并发中请求数
+    - GET /metrics 返回Prometheus文本格式
+    - get_server_stats 工具返回汇总视图
+    """
+    from fastmcp.server.middleware import Middleware
+    from starlette.responses import PlainTextResponse
+
+    class MetricsMiddleware(Middleware):
+        async def on_call_tool(self, context, call_next):
+            tool = context.message.name
+            REGISTRY.add_gauge(TOOL_IN_FLIGHT, 1, tool=tool)
+            start = time.perf_counter()
+            status = "ok"
+            try:
+                result = await call_next(context)
+                if _is_error_result(result):
+                    status = "error"
+                return result
+            except Exception:
+                status = "exception"
+                raise
+            finally:
+                REGISTRY.observe(TOOL_DURATION, time.perf_counter() - start, tool=tool)
+                REGISTRY.inc(TOOL_CALLS, tool=tool, status=status)
+                REGISTRY.add_gauge(TOOL_IN_FLIGHT, -1, tool=tool)
+
+    mcp.add_middleware(MetricsMiddleware())
+
+    @mcp.custom_route("/metrics", methods=["GET"])
+    async def metrics_endpoint(request):
+        return PlainTextResponse(REGISTRY.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+    @mcp.tool(
+        name="get_server_stats",
+        description="服务运行统计：各工具调用次数/错误数/耗时分位数（ms）、并发中请求数、各处理阶段耗时、缓存命中率"
+    )
+    def get_server_stats() -> str:
+        return json.dumps({"query_status": "success", "service": service, **REGISTRY.snapshot()},
+                          indent=2, ensure_ascii=False)
@@ -0,0 +1,668 @@
+"""
+规则引擎基准测试：对比声明式规则引擎（rule_engine.py）与原先硬编码在 server.py 中的提取函数
+
+- 对照组是规则引擎之前 server.py 中的提取函数（逻辑不变，去掉了计时装饰器和未使用的中间变量）
+- 样例报告取自 test_inputs.md 的测试用例 1-4（按标题中的工具名确定报告类型），也可用 --input 指定
+- 先检查两者输出是否一致，再分别计时；--scale 把报告重复多次，模拟长报告
+- 混合报告（全部样例拼接）：对比分别调用各类型提取函数与一次 extract_report（分节路由）
+- 分节路由回归用例（ROUTING_CASES）：检查 extract_report 的路由结果和关键字段
+- 随机报告（--fuzz 份，由检验项、IHC、突变、分级、分期等片段随机拼接）：检查各类型的抽取结果和类型识别是否与原实现一致
+
+用法:
+    python bench_rules.py --repeat 2000
+    python bench_rules.py --with_metrics
+    python bench_rules.py --input report.txt --type pathology --scale 10
+    python bench_rules.py --repeat 100 --fuzz 20000 --seed 7
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(_DIR))
+
+from rule_engine import RULES_PATH, load_ruleset  # noqa: E402
+
+TEST_INPUTS = os.path.join(_DIR, "test_inputs.md")
+TOOL_TYPES = {
+    "extract_pathology_fields": "pathology",
+    "extract_blood_test_fields": "blood_test",
+    "extract_hormone_fields": "hormone",
+    "extract_tumor_marker_fields": "tumor_marker",
+}
+
+
+# ---------- 对照组：规则引擎之前的提取函数 ----------
+
+SITE_SYNONYMS = {
+    "lung": ["lung", "pulm", "pulmonary", "pneumo", "肺"],
+    "breast": ["breast", "mammary", "乳腺"],
+    "colon": ["colon", "colonic", "结肠"],
+    "rectum": ["rectum", "rectal", "直肠"],
+    "stomach": ["stomach", "gastric", "胃"],
+    "liver": ["liver", "hepatic", "肝"],
+    "pancreas": ["pancreas", "pancreatic", "胰"],
+    "prostate": ["prostate", "prostatic", "前列腺"],
+    "kidney": ["kidney", "renal", "肾"],
+    "bladder": ["bladder", "vesical", "膀胱"],
+    "cervix": ["cervix", "cervical", "宫颈"],
+    "ovary": ["ovary", "ovarian", "卵巢"],
+    "endometrium": ["endometrium", "endometrial", "子宫内膜"],
+    "thyroid": ["thyroid", "thyroidal", "甲状腺"],
+    "skin": ["skin", "cutaneous", "皮肤"],
+    "brain": ["brain", "cerebral", "脑"],
+    "esophagus": ["esophagus", "esophageal", "食管", "食道"],
+    "nasopharynx": ["nasopharynx", "nasopharyngeal", "鼻咽"],
+    "oropharynx": ["oropharynx", "oropharyngeal", "口咽"],
+}
+GRADE_PATTERNS = [
+    (r"well[- ]differentiated|highly differentiated", "well differentiated"),
+    (r"moderately[- ]differentiated", "moderately differentiated"),
+    (r"poorly[- ]differentiated|poorly diff", "poorly differentiated"),
+    (r"g([1-4])", None),
+]
+STAGE_REGEX = re.compile(r"pT\d+[a-z]?(?:N\d+[a-z]?)?(?:M[0-1])?|pT\d+[a-z]?(?:\s*/\s*pN\d+[a-z]?)?(?:\s*/\s*pM[0-1])?", re.IGNORECASE)
+SIZE_REGEX = re.compile(r"(\d+(?:\.\d+)?\s*(?:x|×)\s*\d+(?:\.\d+)?\s*(?:cm|mm))", re.IGNORECASE)
+MUTATION_REGEX = re.compile(r"(EGFR|ALK|KRAS|BRAF|HER2|ER|PR|PIK3CA|ROS1|MET|RET|NTRK)\s*[:：\-]?\s*([A-Za-z0-9.+\-_/]+)", re.IGNORECASE)
+IHC_ALIASES = {
+    "TTF1": "TTF-1",
+    "NAPSA": "Napsin",
+    "NAPSIN": "Napsin",
+    "CK5-6": "CK5/6",
+    "CK5/6": "CK5/6",
+    "CK5": "CK5/6",
+}
+MUT_ALIASES = {
+    "ERBB2": "HER2",
+}
+BLOOD_TEST_KEYWORDS = {
+    "wbc": ["WBC", "白细胞", "白细胞计数", "white blood cell", "leukocyte"],
+    "rbc": ["RBC", "红细胞", "红细胞计数", "red blood cell", "erythrocyte"],
+    "hgb": ["HGB", "Hb", "血红蛋白", "hemoglobin"],
+    "hct": ["HCT", "Ht", "红细胞压积", "hematocrit"],
+    "plt": ["PLT", "血小板", "血小板计数", "platelet"],
+    "mcv": ["MCV", "平均红细胞体积"],
+    "mch": ["MCH", "平均血红蛋白量"],
+    "mchc": ["MCHC", "平均血红蛋白浓度"],
+    "alt": ["ALT", "GPT", "丙氨酸转氨酶", "alanine aminotransferase"],
+    "ast": ["AST", "GOT", "天冬氨酸转氨酶", "aspartate aminotransferase"],
+    "alp": ["ALP", "ALKP", "碱性磷酸酶", "alkaline phosphatase"],
+    "ggt": ["GGT", "γ-GT", "γ-谷氨酰转肽酶", "gamma-glutamyl transferase"],
+    "tbil": ["TBIL", "总胆红素", "total bilirubin"],
+    "dbil": ["DBIL", "直接胆红素", "direct bilirubin"],
+    "alb": ["ALB", "白蛋白", "albumin"],
+    "tp": ["TP", "总蛋白", "total protein"],
+    "crea": ["CREA", "Cr", "肌酐", "creatinine"],
+    "bun": ["BUN", "urea", "尿素氮", "blood urea nitrogen"],
+    "ua": ["UA", "uric acid", "尿酸"],
+    "egfr": ["eGFR", "估算肾小球滤过率"],
+    "glucose": ["GLU", "GLUC", "血糖", "glucose", "blood glucose"],
+    "hba1c": ["HbA1c", "糖化血红蛋白", "glycated hemoglobin"],
+    "chol": ["CHOL", "TC", "总胆固醇", "total cholesterol"],
+    "tg": ["TG", "triglyceride", "甘油三酯", "triglycerides"],
+    "hdl": ["HDL", "HDL-C", "高密度脂蛋白", "high-density lipoprotein"],
+    "ldl": ["LDL", "LDL-C", "低密度脂蛋白", "low-density lipoprotein"],
+    "pt": ["PT", "凝血酶原时间", "prothrombin time"],
+    "aptt": ["APTT", "PTT", "活化部分凝血活酶时间", "activated partial thromboplastin time"],
+    "inr": ["INR", "国际标准化比值", "international normalized ratio"],
+    "fib": ["FIB", "fibrinogen", "纤维蛋白原"],
+    "ddimer": ["D-Dimer", "D-二聚体"],
+}
+TUMOR_MARKER_KEYWORDS = {
+    "cea": ["CEA", "癌胚抗原", "carcinoembryonic antigen"],
+    "ca199": ["CA19-9", "CA199", "糖链抗原19-9"],
+    "ca125": ["CA125", "糖链抗原125"],
+    "ca153": ["CA15-3", "CA153", "糖链抗原15-3"],
+    "ca724": ["CA72-4", "CA724", "糖链抗原72-4"],
+    "psa": ["PSA", "前列腺特异性抗原", "prostate specific antigen"],
+    "fpsa": ["fPSA", "游离PSA", "free PSA"],
+    "afp": ["AFP", "甲胎蛋白", "alpha-fetoprotein"],
+    "ca242": ["CA242", "糖链抗原242"],
+    "cyfra211": ["CYFRA21-1", "细胞角蛋白19片段"],
+    "nse": ["NSE", "神经元特异性烯醇化酶"],
+    "scc": ["SCC", "鳞状细胞癌抗原"],
+    "he4": ["HE4", "人附睾蛋白4"],
+    "progrp": ["ProGRP", "胃泌素释放肽前体"],
+}
+
+
+def _normalize_text(text: str) -> str:
+    norm = text or ""
+    norm = norm.replace("：", ":").replace("；", ";").replace("，", ",").replace("。", ".")
+    norm = norm.replace("×", "x")
+    norm = norm.lower()
+    return norm
+
+
+def _extract_lab_values(text: str) -> List[Dict[str, str]]:
+    values = []
+    pattern1 = re.compile(
+        r"([A-Za-z0-9+\-\./]+)\s*[:：]\s*([0-9]+\.?[0-9]*)\s*([A-Za-z0-9^/μ×\-\.%]+)?\s*(?:\(([0-9]+\.?[0-9]*)\s*[-~至]\s*([0-9]+\.?[0-9]*)\))?",
+        re.IGNORECASE
+    )
+    pattern2 = re.compile(
+        r"([A-Za-z0-9+\-\./]+)\s+([0-9]+\.?[0-9]*)\s+([A-Za-z0-9^/μ×\-\.%]+)",
+        re.IGNORECASE
+    )
+    pattern3 = re.compile(
+        r"([A-Za-z0-9+\-\./]+)\s*\(([0-9]+\.?[0-9]*)\)\s*([A-Za-z0-9^/μ×\-\.%]+)?",
+        re.IGNORECASE
+    )
+    for pattern in [pattern1, pattern2, pattern3]:
+        for m in pattern.finditer(text):
+            item_name = m.group(1).strip()
+            value = m.group(2).strip()
+            unit = m.group(3).strip() if m.group(3) else ""
+            ref_low = m.group(4) if len(m.groups()) >= 4 and m.group(4) else None
+            ref_high = m.group(5) if len(m.groups()) >= 5 and m.group(5) else None
+            item = {"item": item_name, "value": value, "unit": unit}
+            if ref_low and ref_high:
+                item["reference_range"] = f"{ref_low}-{ref_high}"
+                try:
+                    item["abnormal"] = float(value) < float(ref_low) or float(value) > float(ref_high)
+                except ValueError:
+                    item["abnormal"] = None
+            else:
+                item["abnormal"] = None
+            if not any(v["item"] == item_name and v["value"] == value for v in values):
+                values.append(item)
+    return values
+
+
+def _detect_report_type(text: str) -> str:
+    text_lower = text.lower()
+    blood_keywords = ["血常规", "血检", "生化", "肝功能", "肾功能", "凝血", "wbc", "rbc", "hgb", "plt", "alt", "ast", "crea", "bun"]
+    hormone_keywords = ["激素", "tsh", "ft3", "ft4", "甲状腺", "性激素", "皮质醇", "insulin", "cortisol", "e2", "p", "t", "lh", "fsh"]
+    tumor_marker_keywords = ["肿瘤标志物", "cea", "ca19-9", "ca125", "psa", "afp", "ca153"]
+    pathology_keywords = ["病理", "病理诊断", "免疫组化", "ihc", "分化", "tnm", "carcinoma", "adenocarcinoma"]
+    scores = {
+        "blood_test": sum(1 for kw in blood_keywords if kw in text_lower),
+        "hormone": sum(1 for kw in hormone_keywords if kw in text_lower),
+        "tumor_marker": sum(1 for kw in tumor_marker_keywords if kw in text_lower),
+        "pathology": sum(1 for kw in pathology_keywords if kw in text_lower),
+    }
+    if max(scores.values()) == 0:
+        return "unknown"
+    return max(scores.items(), key=lambda x: x[1])[0]
+
+
+def _match_site(text: str) -> Optional[str]:
+    low = _normalize_text(text)
+    for site, aliases in SITE_SYNONYMS.items():
+        for alias in aliases:
+            if alias.lower() in low:
+                return site
+    return None
+
+
+def _extract_grade(text: str) -> Optional[str]:
+    for pat, label in GRADE_PATTERNS:
+        m = re.search(pat, text, re.IGNORECASE)
+        if m:
+            if label:
+                return label
+            if m.groups():
+                return f"G{m.group(1)}"
+    low = _normalize_text(text)
+    for pat, label in GRADE_PATTERNS:
+        m = re.search(pat, low)
+        if m:
+            if label:
+                return label
+            if m.groups():
+                return f"G{m.group(1)}"
+    return None
+
+
+def _extract_ihc(text: str) -> List[Dict[str, str]]:
+    items = []
+    known_markers = {
+        "TTF-1", "TTF1", "NAPSIN", "NAPSA", "P40", "CK5/6", "CK5-6", "CK5", "CK6",
+        "ER", "PR", "HER2", "KI67", "KI-67", "CD20", "CD3", "CD5", "CD10",
+        "CD19", "CD23", "CD30", "CD45", "CD56", "CD79A", "CD138", "BCL2",
+        "BCL6", "MYC", "P53", "P63", "P16", "VIMENTIN", "SMA", "DESMIN",
+        "SYN", "CHROMOGRANIN", "CDX2", "Villin", "CEA", "PSA", "PSAP"
+    }
+    patterns = [
+        re.compile(r"([A-Za-z][A-Za-z0-9\-/\.]+)\s*\(([0-3]\+|\+{1,3}|-|negative|positive|弱阳性|强阳性|阴性|阳性|%?\d+%?)\)", re.IGNORECASE),
+        re.compile(r"([A-Za-z][A-Za-z0-9\-/\.]+)\s*[:：]\s*([0-3]\+|\+{1,3}|-|negative|positive|弱阳性|强阳性|阴性|阳性|%?\d+%?)", re.IGNORECASE),
+    ]
+    for pattern in patterns:
+        for m in pattern.finditer(text):
+            raw = m.group(1).strip().upper()
+            result = m.group(2).strip()
+            if len(raw) < 2 or raw.isdigit() or raw in ["X", "CM", "TNM", "PT", "N", "M", "G3", "G2", "G1", "G4"]:
+                continue
+            if result.isdigit() and len(result) > 2:
+                continue
+            marker_key = raw.replace("-", "").replace("/", "")
+            canonical = IHC_ALIASES.get(marker_key, raw)
+            if canonical not in known_markers and marker_key not in IHC_ALIASES:
+                if not any(keyword in canonical for keyword in ["CD", "CK", "TTF", "NAPSIN", "P40", "ER", "PR", "HER", "KI"]):
+                    continue
+            result_clean = result.replace("(", "").replace(")", "").strip()
+            if result_clean.lower() in ["positive", "阳性", "弱阳性", "强阳性"]:
+                result_clean = "+"
+            elif result_clean.lower() in ["negative", "阴性"]:
+                result_clean = "-"
+            if not any(item["marker"] == canonical and item["result"] == result_clean for item in items):
+                items.append({"marker": canonical, "result": result_clean})
+    return items
+
+
+def _extract_mutations(text: str) -> List[Dict[str, str]]:
+    muts = []
+    for m in MUTATION_REGEX.finditer(text):
+        raw_gene = m.group(1).upper()
+        muts.append({"gene": MUT_ALIASES.get(raw_gene, raw_gene), "value": m.group(2).strip()})
+    return muts
+
+
+def _extract_size(text: str) -> Optional[str]:
+    m = SIZE_REGEX.search(text)
+    return m.group(1) if m else None
+
+
+def _extract_stage(text: str) -> Optional[str]:
+    continuous_pattern = re.compile(r"pT\d+[a-z]?N\d+[a-z]?M[0-1]", re.IGNORECASE)
+    m = continuous_pattern.search(text)
+    if m:
+        return m.group(0)
+    m = STAGE_REGEX.search(text)
+    if m:
+        return m.group(0)
+    return None
+
+
+def legacy_pathology(text: str) -> Dict:
+    key_terms = []
+    text_lower = text.lower()
+    for term in ["invasive", "carcinoma", "adenocarcinoma", "squamous", "necrosis", "metastasis", "dysplasia", "sarcoma", "lymphoma"]:
+        if term in text_lower:
+            key_terms.append(term)
+    return {
+        "site": _match_site(text) or "unknown",
+        "grade": _extract_grade(text),
+        "stage": _extract_stage(text),
+        "lesion_size": _extract_size(text),
+        "ihc": _extract_ihc(text),
+        "mutations": _extract_mutations(text),
+        "key_terms": key_terms,
+    }
+
+
+def legacy_blood_test(text: str) -> Dict:
+    all_values = _extract_lab_values(text)
+    found = {}
+    for item in all_values:
+        item_name_upper = item["item"].upper()
+        for key, keywords in BLOOD_TEST_KEYWORDS.items():
+            if any(kw.upper() in item_name_upper for kw in keywords) and key not in found:
+                found[key] = item
+
+    def _group(keywords):
+        items = [item for item in all_values if any(kw.upper() in item["item"].upper() for kw in keywords)]
+        return items if items else None
+
+    return {
+        "wbc": found.get("wbc"),
+        "rbc": found.get("rbc"),
+        "hgb": found.get("hgb"),
+        "plt": found.get("plt"),
+        "liver_function": _group(["ALT", "AST", "ALP", "GGT", "TBIL", "DBIL", "ALB", "TP"]),
+        "kidney_function": _group(["CREA", "BUN", "UA", "eGFR"]),
+        "glucose": found.get("glucose"),
+        "lipid": _group(["CHOL", "TG", "HDL", "LDL"]),
+        "coagulation": _group(["PT", "APTT", "INR", "FIB", "D-Dimer"]),
+        "all_values": all_values,
+    }
+
+
+def legacy_hormone(text: str) -> Dict:
+    all_values = _extract_lab_values(text)
+    thyroid, sex_hormones = [], []
+    cortisol = insulin = growth_hormone = None
+    for item in all_values:
+        name = item["item"].upper()
+        if any(kw.upper() in name for kw in ["TSH", "FT3", "FT4", "T3", "T4", "rT3", "TgAb", "TPOAb", "TRAb"]):
+            thyroid.append(item)
+        elif any(kw.upper() in name for kw in ["E2", "ESTRADIOL", "P", "PROGESTERONE", "T", "TESTOSTERONE", "LH", "FSH", "PRL", "PROLACTIN", "SHBG"]):
+            sex_hormones.append(item)
+        elif any(kw.upper() in name for kw in ["CORTISOL", "CORT", "ACTH"]):
+            if cortisol is None:
+                cortisol = item
+        elif any(kw.upper() in name for kw in ["INSULIN", "INS", "C-PEPTIDE", "CPEPTIDE"]):
+            if insulin is None:
+                insulin = item
+        elif any(kw.upper() in name for kw in ["GH", "GROWTH HORMONE", "IGF-1", "IGF1"]):
+            if growth_hormone is None:
+                growth_hormone = item
+    return {
+        "thyroid": thyroid if thyroid else None,
+        "sex_hormones": sex_hormones if sex_hormones else None,
+        "cortisol": cortisol,
+        "insulin": insulin,
+        "growth_hormone": growth_hormone,
+        "all_values": all_values,
+    }
+
+
+def legacy_tumor_marker(text: str) -> Dict:
+    all_values = _extract_lab_values(text)
+    markers = [
+        item for item in all_values
+        if any(kw.upper() in item["item"].upper() for kws in TUMOR_MARKER_KEYWORDS.values() for kw in kws)
+    ]
+    return {"markers": markers if markers else None, "all_values": all_values}
+
+
+LEGACY = {
+    "pathology": legacy_pathology,
+    "blood_test": legacy_blood_test,
+    "hormone": legacy_hormone,
+    "tumor_marker": legacy_tumor_marker,
+}
+# 原 server.py 中各提取函数的计时阶段名
+LEGACY_STAGES = {
+    "_match_site": "extract_site",
+    "_extract_grade": "extract_grade",
+    "_extract_stage": "extract_stage",
+    "_extract_size": "extract_size",
+    "_extract_ihc": "extract_ihc",
+    "_extract_mutations": "extract_mutations",
+    "_extract_lab_values": "extract_lab_values",
+    "_detect_report_type": "detect_report_type",
+}
+
+
+def instrument_legacy():
+    """与原 server.py 一样给每个提取函数加阶段计时（规则引擎每份报告只计时一次）"""
+    from mcp_common import timed
+    g = globals()
+    for name, stage_name in LEGACY_STAGES.items():
+        g[name] = timed(stage_name)(g[name])
+    for report_type in ("blood_test", "hormone", "tumor_marker"):
+        LEGACY[report_type] = timed(f"extract_{report_type}")(LEGACY[report_type])
+
+
+# ---------- 基准测试 ----------
+
+def load_samples(path: str = TEST_INPUTS) -> List[Tuple[str, str]]:
+    """test_inputs.md 中各提取工具的输入文本，返回 [(报告类型, 文本), ...]"""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    samples = []
+    for section in re.split(r"^## ", content, flags=re.MULTILINE):
+        header = section.split("\n", 1)[0]
+        tool = re.search(r"`(\w+)`", header)
+        if not tool or tool.group(1) not in TOOL_TYPES:
+            continue
+        block = re.search(r"### 输入文本\s*\n```\n(.*?)\n```", section, re.DOTALL)
+        if block:
+            samples.append((TOOL_TYPES[tool.group(1)], block.group(1)))
+    return samples
+
+
+# ---------- 随机报告 ----------
+
+FUZZ_ITEMS = [
+    "WBC", "RBC", "HGB", "Hb", "PLT", "ALT", "AST", "ALP", "GGT", "TBIL", "ALB", "TP", "CREA", "BUN", "UA",
+    "eGFR", "GLU", "CHOL", "TG", "HDL", "LDL", "PT", "APTT", "INR", "FIB", "D-Dimer", "TSH", "FT3", "FT4",
+    "T3", "T4", "E2", "P", "T", "LH", "FSH", "PRL", "Cortisol", "ACTH", "Insulin", "C-Peptide", "GH", "IGF-1",
+    "CEA", "CA19-9", "CA125", "CA15-3", "PSA", "fPSA", "AFP", "CYFRA21-1", "NSE", "SCC", "HE4", "ProGRP",
+]
+FUZZ_UNITS = ["U/L", "g/L", "×10^9/L", "×10^12/L", "mmol/L", "μmol/L", "ng/mL", "pg/mL", "mIU/L", "%", "s", "秒", ""]
+FUZZ_LAB_FORMATS = ["{i}: {v} {u}{r}", "{i}：{v}{u}{r}", "{i} {v} {u}{r}", "{i}({v}){u}{r}", "{i} {v}{r}", "{i}:{v}"]
+FUZZ_REFS = ["", "", " ({lo}-{hi})", "({lo}~{hi})", " ({lo}至{hi})", " (参考范围: {lo}-{hi})"]
+FUZZ_PATHOLOGY = [
+    "右肺上叶浸润性腺癌", "breast invasive carcinoma", "gastric adenocarcinoma", "肝", "colon", "necrosis",
+    "分化差（G3）", "G2", "poorly differentiated", "well-differentiated", "moderately differentiated",
+    "pT2N1M0", "pT1a/pN0/pM0", "pT3", "大小约 2.5 x 1.8 cm", "3×2 mm",
+    "TTF-1(+)", "Napsin(+)", "P40(-)", "CK5/6(-)", "Ki67(30%)", "ER(90%)", "PR: 阴性", "HER2(2+)", "CD20: positive",
+    "EGFR L858R", "ALK: negative", "KRAS: G12C", "BRAF V600E", "ERBB2 amplification", "HER2: positive",
+    "免疫组化", "病理诊断", "基因检测", "metastasis", "sarcoma",
+]
+FUZZ_JOINERS = [" ", "\n", ", ", "，", "; ", "。"]
+
+
+def _random_number(rng: random.Random) -> str:
+    return str(rng.randint(0, 500)) if rng.random() < 0.4 else f"{rng.uniform(0, 200):.{rng.randint(1, 2)}f}"
+
+
+def random_report(rng: random.Random) -> str:
+    """随机拼接检验项和病理片段（相邻项之间的分隔符也随机，检验项常常紧挨着）"""
+    parts = []
+    for _ in range(rng.randint(2, 14)):
+        if rng.random() < 0.65:
+            lo, hi = sorted((_random_number(rng), _random_number(rng)), key=float)
+            ref = rng.choice(FUZZ_REFS).format(lo=lo, hi=hi)
+            parts.append(rng.choice(FUZZ_LAB_FORMATS).format(
+                i=rng.choice(FUZZ_ITEMS), v=_random_number(rng), u=rng.choice(FUZZ_UNITS), r=ref
+            ))
+        else:
+            parts.append(rng.choice(FUZZ_PATHOLOGY))
+        parts.append(rng.choice(FUZZ_JOINERS))
+    return "".join(parts[:-1])
+
+
+def fuzz_parity(ruleset, n: int, seed: int = 0, max_examples: int = 5) -> Dict:
+    """随机报告上规则引擎与原实现的一致性"""
+    rng = random.Random(seed)
+    mismatched_reports = 0
+    mismatches = {report_type: 0 for report_type in LEGACY}
+    detect_mismatches = 0
+    examples = []
+    for _ in range(n):
+        text = random_report(rng)
+        differs = False
+        for report_type, legacy in LEGACY.items():
+            expected, actual = legacy(text), ruleset.extract(report_type, text)
+            if expected != actual:
+                differs = True
+                mismatches[report_type] += 1
+                if len(examples) < max_examples:
+                    examples.append({
+                        "report_type": report_type,
+                        "text": text,
+                        "fields": sorted(k for k in set(expected) | set(actual) if expected.get(k) != actual.get(k)),
+                    })
+        if _detect_report_type(text) != ruleset.detect(text):
+            differs = True
+            detect_mismatches += 1
+        mismatched_reports += differs
+    return {
+        "reports": n,
+        "seed": seed,
+        "identical": mismatched_reports == 0,
+        "mismatched_reports": mismatched_reports,
+        "mismatches_by_type": mismatches,
+        "detect_mismatches": detect_mismatches,
+        "examples": examples,
+    }
+
+
+# ---------- 分节路由回归用例 ----------
+
+# report_types 为期望路由出的全部类型（按出现顺序），fields 为各类型必须一致的字段
+ROUTING_CASES = [
+    {
+        # 诊断行含节标题关键词（甲状腺）但不是标题形式，不能开启激素节
+        "name": "thyroid_diagnosis_line",
+        "text": (
+            "患者，女性，45岁。甲状腺右叶切除标本。\n"
+            "病理诊断：\n"
+            "甲状腺乳头状癌，经典型\n"
+            "肿瘤大小 1.2 x 0.8 cm，未侵犯被膜。\n"
+            "免疫组化：TTF-1(+)，TG(+)。"
+        ),
+        "report_types": ["pathology"],
+        "fields": {"pathology": {"site": "thyroid", "lesion_size": "1.2 x 0.8 cm"}},
+    },
+    {
+        # 冒号后是数值的是检验项，项目名含关键词（甲状腺）也不是节标题
+        "name": "keyword_lab_item",
+        "text": "肿瘤标志物：\nCEA: 2.1 ng/mL\n甲状腺球蛋白: 12.5 ng/mL",
+        "report_types": ["tumor_marker"],
+        "fields": {},
+    },
+    {
+        "name": "bracket_and_colon_titles",
+        "text": "【病理诊断】右肺浸润性腺癌，分化差（G3）\n甲状腺功能：\nTSH: 2.5 mIU/L\n[肿瘤标志物]\nCEA: 6.1 ng/mL",
+        "report_types": ["pathology", "hormone", "tumor_marker"],
+        "fields": {"pathology": {"site": "lung", "grade": "G3"}},
+    },
+]
+
+
+def routing_regressions(ruleset) -> Dict:
+    """extract_report 在回归用例上的路由结果和关键字段"""
+    failed = []
+    for case in ROUTING_CASES:
+        report = ruleset.extract_report(case["text"])
+        problems = []
+        if report["report_types"] != case["report_types"]:
+            problems.append(f"report_types={report['report_types']}")
+        for report_type, expected in case["fields"].items():
+            actual = report["results"].get(report_type, {})
+            problems.extend(
+                f"{report_type}.{name}={actual.get(name)!r}"
+                for name, value in expected.items() if actual.get(name) != value
+            )
+        if problems:
+            failed.append({"name": case["name"], "problems": problems})
+    return {"cases": len(ROUTING_CASES), "passed": len(ROUTING_CASES) - len(failed), "failed": failed}
+
+
+def _time_per_call(fn, text: str, repeat: int) -> float:
+    """多轮计时取最快一轮，返回每次调用的微秒数"""
+    rounds = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(text)
+        rounds.append((time.perf_counter() - start) / repeat * 1e6)
+    return min(rounds)
+
+
+def run(
+    samples: List[Tuple[str, str]], repeat: int, scale: int, rules_path: str,
+    with_metrics: bool = False, fuzz: int = 0, seed: int = 0
+) -> Dict:
+    started = time.perf_counter()
+    ruleset = load_ruleset(rules_path)
+    load_ms = (time.perf_counter() - started) * 1000
+    if with_metrics:
+        from mcp_common import stage
+        instrument_legacy()
+
+    rows = []
+    total_legacy = total_engine = 0.0
+    for report_type, text in samples:
+        text = "\n".join([text] * scale)
+        legacy = LEGACY[report_type]
+
+        def engine(t, _type=report_type):
+            if with_metrics:
+                with stage(f"extract_{_type}"):
+                    return ruleset.extract(_type, t)
+            return ruleset.extract(_type, t)
+
+        expected, actual = legacy(text), engine(text)
+        mismatched = sorted(k for k in set(expected) | set(actual) if expected.get(k) != actual.get(k))
+        legacy_us = _time_per_call(legacy, text, repeat)
+        engine_us = _time_per_call(engine, text, repeat)
+        total_legacy += legacy_us
+        total_engine += engine_us
+        rows.append({
+            "report_type": report_type,
+            "chars": len(text),
+            "identical": not mismatched,
+            "mismatched_fields": mismatched,
+            "legacy_us": round(legacy_us, 1),
+            "engine_us": round(engine_us, 1),
+            "speedup": round(legacy_us / engine_us, 2) if engine_us else None,
+        })
+
+    detect_rows = []
+    for report_type, text in samples:
+        text = "\n".join([text] * scale)
+        detect_rows.append({
+            "report_type": report_type,
+            "identical": _detect_report_type(text) == ruleset.detect(text),
+            "legacy_us": round(_time_per_call(_detect_report_type, text, repeat), 1),
+            "engine_us": round(_time_per_call(ruleset.detect, text, repeat), 1),
+        })
+
+    # 混合报告：智能体分别调用四个提取工具（每次都传整份报告） vs 一次 extract_report
+    mixed_text = "\n\n".join(text for _, text in samples)
+    report_types = list(dict.fromkeys(report_type for report_type, _ in samples))
+
+    def legacy_calls(t):
+        return {report_type: LEGACY[report_type](t) for report_type in report_types}
+
+    def engine_calls(t):
+        return {report_type: ruleset.extract(report_type, t) for report_type in report_types}
+
+    routed = ruleset.extract_report(mixed_text)["results"]
+    mixed = {
+        "report_types": report_types,
+        "chars": len(mixed_text),
+        # 按节路由后每种类型的结果与单独抽取该类型样例的结果是否一致
+        "routed_identical": all(routed.get(report_type) == ruleset.extract(report_type, text) for report_type, text in samples),
+        "legacy_calls_us": round(_time_per_call(legacy_calls, mixed_text, repeat), 1),
+        "engine_calls_us": round(_time_per_call(engine_calls, mixed_text, repeat), 1),
+        "extract_report_us": round(_time_per_call(ruleset.extract_report, mixed_text, repeat), 1),
+    }
+
+    return {
+        "rules_version": ruleset.version,
+        "load_and_compile_ms": round(load_ms, 2),
+        "repeat": repeat,
+        "scale": scale,
+        "with_metrics": with_metrics,
+        "reports": rows,
+        "detect_report_type": detect_rows,
+        "mixed_report": mixed,
+        "routing_cases": routing_regressions(ruleset),
+        "fuzz": fuzz_parity(ruleset, fuzz, seed) if fuzz else None,
+        "total_speedup": round(total_legacy / total_engine, 2) if total_engine else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="规则引擎与原提取函数的一致性和耗时对比")
+    parser.add_argument("--rules", type=str, default=RULES_PATH, help=f"规则文件（默认: {RULES_PATH}）")
+    parser.add_argument("--repeat", type=int, default=1000, help="每轮每份报告的调用次数（默认: 1000）")
+    parser.add_argument("--scale", type=int, default=1, help="报告重复次数，模拟长报告（默认: 1）")
+    parser.add_argument("--with_metrics", action="store_true",
+                        help="两边都按服务中的方式记录阶段耗时（原实现每个字段一个阶段，规则引擎每份报告一个）")
+    parser.add_argument("--fuzz", type=int, default=3000, help="随机报告一致性检查的报告数，0表示跳过（默认: 3000）")
+    parser.add_argument("--seed", type=int, default=0, help="随机报告的种子（默认: 0）")
+    parser.add_argument("--input", type=str, default=None, help="使用指定的报告文件代替 test_inputs.md 的样例")
+    parser.add_argument("--type", type=str, default="pathology", choices=sorted(LEGACY),
+                        help="--input 报告的类型（默认: pathology）")
+
+    args = parser.parse_args()
+
+    try:
+        if args.input:
+            with open(args.input, "r", encoding="utf-8") as f:
+                samples = [(args.type, f.read())]
+        else:
+            samples = load_samples()
+        result = run(samples, args.repeat, args.scale, args.rules, args.with_metrics, args.fuzz, args.seed)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        if result["routing_cases"]["failed"]:
+            sys.exit(1)
+    except KeyboardInterrupt:
+        print("\n\n操作被用户中断")
+    except Exception as e:
+        print(f"\n错误: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,680 @@
+"""
+声明式字段抽取规则引擎
+
+规则集（rules.json）描述每种报告类型的字段、别名、取值正则和单位，加载时按字段编译:
+- 只有别名的字段（部位、关键术语）：在整篇报告只小写一次的副本上做子串判断，不使用正则
+- first 字段：所有规则合并成一个带命名组的选择分支 (?P<r0>...)|(?P<r1>...)，一次搜索得到最早的匹配，
+  用 lastindex 判断命中的是哪条规则
+- priority 字段：按规则顺序逐条搜索，第一条命中即停止
+- all / set 字段：每条规则单独 finditer。不同规则的匹配可以重叠（如检验值的 "项目 数值 单位" 规则
+  会把下一项的名称当作单位），合并成一个选择分支扫描时前一条规则的匹配会吞掉后一项
+
+没有把整种报告类型合并成一个跨字段的前瞻正则：实测前瞻使 re 失去前缀/字符集快速跳过，
+比逐字段扫描慢 2-5 倍，而且不同字段的匹配需要重叠（如 "HER2: positive" 同时属于IHC和突变）
+
+规则集格式:
+  shared_fields:  可复用的字段定义，报告类型中以字符串引用（如 "all_values": "lab_values"）
+  report_types.<类型>:
+    keywords:     报告类型识别关键词（文本小写后的子串，命中个数为得分）
+    sections:     节标题关键词（extract_report 分节路由用），标题包含其一时该节交给此类型抽取；
+                  只有标题形式的行才算节标题：以冒号结尾（"肝功能："）、短标题后接冒号（"免疫组化：TTF-1(+)"）
+                  或用【】/[] 括起（"【肿瘤标志物】"），正文中出现的关键词（"甲状腺乳头状癌"）不算
+    fields.<字段>:
+      mode:        first（最早出现）/ priority（规则顺序优先，其次最早出现）/
+                   all（全部匹配，按规则顺序再按位置排列）/ set（命中的规则取值，按规则顺序）
+      rules:       [{"aliases": [...], "value": ...} 或 {"pattern": 正则, "value"/"template": ...}]
+                   aliases 按子串匹配；pattern 中的命名组作为记录字段，template 用命名组格式化
+      ignore_case: 是否忽略大小写（默认 true）
+      default:     未命中时的取值（默认 all/set 为 []，其余为 null）
+      postprocess: 记录的后处理（ihc_marker / gene / lab_value），参数写在字段定义中
+    groups:       按项目名把 source 字段（检验值列表）归入各分组，aliases 为项目名（大写）中的子串；
+                  mode 为 first（第一项）或 list（全部，为空时 null）；exclusive 为真时每项只归入第一个命中的分组
+
+多类型报告（extract_report）: 全角标点按预先定义的替换表一次性转为半角，按节标题分节，
+每种报告类型只抽取路由给它的节；第一个标题之前的内容归入第一节，没有标题时按全文关键词识别
+
+热加载: get_ruleset() 每隔 PATHOLOGY_RULES_CHECK 秒检查一次规则文件的修改时间，变化时重新编译，
+编译成功后原子替换；新规则有错误时继续使用旧规则并记录错误。编译时检查规则集结构（对象/数组类型、
+template 引用的命名组、后处理需要的命名组），结构错误在编译期报 RuleError，不会留到抽取时
+"""
+import hashlib
+import json
+import os
+import re
+import string
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from mcp_common import get_logger
+
+RULES_PATH = os.getenv(
+    "PATHOLOGY_RULES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+)
+# 检查规则文件变化的间隔（秒），0表示只通过 reload_ruleset 重新加载
+RULES_CHECK_INTERVAL = float(os.getenv("PATHOLOGY_RULES_CHECK", "2"))
+# 检验项目名 -> 分组结果 的缓存条数上限
+CLASSIFY_CACHE_SIZE = 4096
+
+# extract_report 预处理：全角标点 -> 半角（用逐项 str.replace 而不是 str.translate：
+# 文本含中文时 translate 逐字符查表，实测慢约30倍）
+NORMALIZE_TABLE = (("：", ":"), ("；", ";"), ("，", ","), ("。", "."), ("（", "("), ("）", ")"), ("\u3000", " "))
+# 节标题（冒号前或括号内）的最大字符数
+SECTION_TITLE_MAX = 20
+
+MODES = ("first", "priority", "all", "set")
+GROUP_MODES = ("first", "list")
+
+log = get_logger("pathology")
+
+_DIGIT = re.compile(r"\d")
+_LEADING_NUMBER = re.compile(r"\s*[<>≤≥]?\s*[-+]?\d")
+# 【标题】/[标题] 形式的节标题（后面可以接冒号或正文）
+_BRACKET_TITLE = re.compile(r"^\s*[【\[]([^】\]]+)[】\]]")
+_GROUP_NAME = re.compile(r"\(\?P<([A-Za-z_]\w*)>")
+_GROUP_REF = re.compile(r"\(\?(?:P=|\()([A-Za-z_]\w*)\)")
+
+
+class RuleError(ValueError):
+    """规则集格式错误或正则无法编译"""
+
+
+def _expect(value, kind, where: str):
+    """规则集结构检查：类型不符时抛出 RuleError（编译期发现，而不是抽取时才报 TypeError/AttributeError）"""
+    if not isinstance(value, kind):
+        names = {dict: "对象", list: "数组", str: "字符串", bool: "布尔值"}
+        expected = "或".join(names.get(k, k.__name__) for k in (kind if isinstance(kind, tuple) else (kind,)))
+        raise RuleError(f"{where} 必须是{expected}，实际为 {type(value).__name__}: {value!r:.80}")
+    return value
+
+
+def _template_names(template: str, where: str) -> List[str]:
+    """template 中引用的组名（只允许 {组名} 形式）"""
+    try:
+        names = [name for _, name, _, _ in string.Formatter().parse(template) if name is not None]
+    except ValueError as e:
+        raise RuleError(f"{where} 的 template 格式错误: {e}") from e
+    for name in names:
+        if not name.isidentifier():
+            raise RuleError(f"{where} 的 template 只能引用命名组 {{组名}}: {template}")
+    return names
+
+
+def normalize_report(text: str) -> str:
+    """全角标点转为半角（整份报告只做一次）"""
+    for full, half in NORMALIZE_TABLE:
+        if full in text:
+            text = text.replace(full, half)
+    return text
+
+
+def section_title(line: str) -> Optional[str]:
+    """
+    标题形式的行返回标题文字，否则返回None（在已标准化的行上调用，冒号为半角）
+
+    标题形式：【标题】/[标题] 开头，或冒号前的部分（"标题:" 或 "标题: 内容"）；
+    冒号后紧跟数值的是检验项（"甲状腺球蛋白: 12.5 ng/mL"），不是标题
+    """
+    m = _BRACKET_TITLE.match(line)
+    if m is not None:
+        title = m.group(1)
+    elif ":" in line:
+        title, rest = line.split(":", 1)
+        if _LEADING_NUMBER.match(rest):
+            return None
+    else:
+        return None
+    title = title.strip()
+    if not title or len(title) > SECTION_TITLE_MAX or _DIGIT.search(title):
+        return None
+    return title
+
+
+def _rename_groups(pattern: str, prefix: str) -> Tuple[str, List[str]]:
+    """给规则中的命名组加前缀（组合正则中组名必须唯一），返回 (新正则, 原组名列表)"""
+    names = _GROUP_NAME.findall(pattern)
+    renamed = _GROUP_NAME.sub(lambda m: f"(?P<{prefix}{m.group(1)}>", pattern)
+    renamed = _GROUP_REF.sub(
+        lambda m: m.group(0).replace(m.group(1), prefix + m.group(1)) if m.group(1) in names else m.group(0),
+        renamed
+    )
+    return renamed, names
+
+
+class Rule:
+    def __init__(self, spec: dict, where: str = "规则"):
+        _expect(spec, dict, where)
+        if "pattern" not in spec and not spec.get("aliases"):
+            raise RuleError(f"{where} 需要 pattern 或 aliases: {spec}")
+        self.value = spec.get("value")
+        self.template = spec.get("template")
+        self.aliases = [str(a) for a in _expect(spec.get("aliases", []), list, f"{where}.aliases")]
+        self.pattern = spec.get("pattern")
+        # 规则自身的命名组（template 和 all/set 模式的记录字段）
+        self.groups: List[str] = []
+        if self.pattern is not None:
+            self.groups = _GROUP_NAME.findall(_expect(self.pattern, str, f"{where}.pattern"))
+        if self.template is not None:
+            _expect(self.template, str, f"{where}.template")
+            missing = [n for n in _template_names(self.template, where) if n not in self.groups]
+            if missing:
+                raise RuleError(f"{where} 的 template 引用了正则中没有的命名组: {', '.join(missing)}")
+
+    def source(self) -> str:
+        if self.pattern is not None:
+            return self.pattern
+        return "|".join(re.escape(a) for a in sorted(self.aliases, key=len, reverse=True))
+
+
+class Field:
+    """一个字段的编译结果"""
+
+    def __init__(self, name: str, spec: dict):
+        _expect(spec, dict, f"字段 {name} 的定义")
+        self.name = name
+        self.spec = spec
+        self.mode = spec.get("mode", "first")
+        if self.mode not in MODES:
+            raise RuleError(f"字段 {name} 的 mode 无效: {self.mode}（可选: {', '.join(MODES)}）")
+        self.ignore_case = _expect(spec.get("ignore_case", True), bool, f"字段 {name} 的 ignore_case")
+        self.default = spec.get("default", [] if self.mode in ("all", "set") else None)
+        self.postprocess = spec.get("postprocess")
+        if self.postprocess is not None and self.postprocess not in POSTPROCESSORS:
+            raise RuleError(f"字段 {name} 的 postprocess 无效: {self.postprocess}")
+        rules = _expect(spec.get("rules", []), list, f"字段 {name} 的 rules")
+        self.rules = [Rule(r, f"字段 {name} 的规则 {j}") for j, r in enumerate(rules)]
+        if not self.rules:
+            raise RuleError(f"字段 {name} 没有规则")
+        self._check_records()
+        # 全部规则都是别名时按子串匹配，否则编译成一个带命名组的交替正则；
+        # priority 模式另按规则逐条编译，按优先级依次搜索，命中即停
+        self.literal = all(r.pattern is None for r in self.rules)
+        self.needles: List[Tuple[str, ...]] = []
+        self.regex = None
+        self.rule_regexes: List["re.Pattern"] = []
+        self.rule_of_group: Dict[int, int] = {}
+        # 各规则的命名组 [(原组名, 组合正则中的组名)]
+        self.named: List[List[Tuple[str, str]]] = []
+        if self.literal:
+            self.needles = [tuple(dict.fromkeys(self.key(a) for a in r.aliases)) for r in self.rules]
+        else:
+            self._compile()
+        # 后处理参数
+        self.aliases: Dict[str, str] = dict(_expect(spec.get("aliases", {}), dict, f"字段 {name} 的 aliases"))
+        self.known_markers = frozenset(_expect(spec.get("known_markers", []), list, f"字段 {name} 的 known_markers"))
+        self.marker_keywords = tuple(
+            str(k) for k in _expect(spec.get("marker_keywords", []), list, f"字段 {name} 的 marker_keywords")
+        )
+        self.exclude = frozenset(_expect(spec.get("exclude", []), list, f"字段 {name} 的 exclude"))
+        self.results: Dict[str, str] = {
+            str(k).lower(): v for k, v in _expect(spec.get("results", {}), dict, f"字段 {name} 的 results").items()
+        }
+
+    def _check_records(self):
+        """
+        检查规则取值与模式、后处理匹配：set 模式的取值要可去重（不能是命名组记录），
+        后处理需要 all 模式的命名组记录，且记录包含后处理读取的组
+        """
+        for j, rule in enumerate(self.rules):
+            record = rule.pattern is not None and rule.value is None and rule.template is None
+            if self.mode == "set" and record and rule.groups:
+                raise RuleError(f"字段 {self.name} 的规则 {j}：set 模式的正则规则需要 value 或 template")
+            if self.postprocess is None:
+                continue
+            if self.mode != "all" or not record:
+                raise RuleError(f"字段 {self.name}：postprocess 需要 all 模式、只有 pattern 的规则（规则 {j}）")
+            missing = [g for g in POSTPROCESS_GROUPS[self.postprocess] if g not in rule.groups]
+            if missing:
+                raise RuleError(f"字段 {self.name} 的规则 {j} 缺少 {self.postprocess} 需要的命名组: {', '.join(missing)}")
+
+    def key(self, text: str) -> str:
+        return text.lower() if self.ignore_case else text
+
+    def _compile(self):
+        """规则 j 为命名组 r<j>，规则内的命名组改名为 r<j>_<原组名>；同一位置取靠前的规则"""
+        branches = []
+        for j, rule in enumerate(self.rules):
+            pattern, _ = _rename_groups(rule.source(), f"r{j}_")
+            branches.append(f"(?P<r{j}>{pattern})")
+        flags = re.IGNORECASE if self.ignore_case else 0
+        try:
+            self.regex = re.compile("|".join(branches), flags)
+            if self.mode != "first":
+                self.rule_regexes = [re.compile(branch, flags) for branch in branches]
+        except re.error as e:
+            raise RuleError(f"字段 {self.name} 的正则无法编译: {e}") from e
+        groupindex = self.regex.groupindex
+        for j in range(len(self.rules)):
+            prefix = f"r{j}_"
+            self.rule_of_group[groupindex[f"r{j}"]] = j
+            self.named.append([(name[len(prefix):], name) for name in groupindex if name.startswith(prefix)])
+
+    def _value(self, j: int, m: "re.Match"):
+        """规则命中时的取值: value / template / 命名组记录（all、set模式）/ 匹配文本"""
+        rule = self.rules[j]
+        if rule.value is not None:
+            return rule.value
+        if rule.template is not None:
+            return rule.template.format(**{name: m.group(group) or "" for name, group in self.named[j]})
+        if self.mode in ("all", "set"):
+            return {name: m.group(group) for name, group in self.named[j]}
+        return m.group(f"r{j}")
+
+    def _extract_literal(self, folded: str):
+        mode = self.mode
+        if mode == "priority":
+            for rule, needles in zip(self.rules, self.needles):
+                for n in needles:
+                    if n in folded:
+                        return rule.value
+            return None
+        if mode == "first":
+            best, value = -1, None
+            for rule, needles in zip(self.rules, self.needles):
+                for n in needles:
+                    pos = folded.find(n)
+                    if pos >= 0 and (best < 0 or pos < best):
+                        best, value = pos, rule.value
+            return value
+        values = []
+        for rule, needles in zip(self.rules, self.needles):
+            for n in needles:
+                if n in folded:
+                    if rule.value not in values:
+                        values.append(rule.value)
+                    break
+        return values
+
+    def _extract_regex(self, text: str):
+        mode = self.mode
+        if mode == "first":
+            m = self.regex.search(text)
+            return self._value(self.rule_of_group[m.lastindex], m) if m else None
+        if mode == "priority":
+            # 逐条规则单独搜索（保留正则模块对字面量前缀的快速查找）
+            for j, regex in enumerate(self.rule_regexes):
+                m = regex.search(text)
+                if m:
+                    return self._value(j, m)
+            return None
+        # 按规则顺序排列，同一规则内按位置
+        values = [self._value(j, m) for j, regex in enumerate(self.rule_regexes) for m in regex.finditer(text)]
+        if mode == "set":
+            values = list(dict.fromkeys(values))
+        return values
+
+    def extract(self, text: str, folded: Optional[str] = None):
+        """
+        抽取字段值
+
+        Args:
+            text: 报告文本
+            folded: text.lower()（同一报告的多个字段共用，只计算一次）
+        """
+        if self.literal:
+            if folded is None or not self.ignore_case:
+                folded = self.key(text)
+            value = self._extract_literal(folded)
+        else:
+            value = self._extract_regex(text)
+        if self.postprocess:
+            value = POSTPROCESSORS[self.postprocess](self, value)
+        if value is None or value == []:
+            value = list(self.default) if isinstance(self.default, list) else self.default
+        return value
+
+
+# ---------- 后处理 ----------
+
+def _post_ihc_marker(field: Field, records: List[dict]) -> List[Dict[str, str]]:
+    items = []
+    for r in records:
+        raw = r["marker"].strip().upper()
+        result = r["result"].strip()
+        # 过滤掉明显不是标记的内容
+        if len(raw) < 2 or raw.isdigit() or raw in field.exclude:
+            continue
+        # 过滤掉纯数字或单个字符的结果（允许百分比数字如 "30"）
+        if result.isdigit() and len(result) > 2:
+            continue
+        marker_key = raw.replace("-", "").replace("/", "")
+        canonical = field.aliases.get(marker_key, raw)
+        # 不在已知标记列表中、也不是别名时，需要包含常见标记的关键词
+        if canonical not in field.known_markers and marker_key not in field.aliases:
+            if not any(keyword in canonical for keyword in field.marker_keywords):
+                continue
+        result_clean = result.replace("(", "").replace(")", "").strip()
+        result_clean = field.results.get(result_clean.lower(), result_clean)
+        if not any(item["marker"] == canonical and item["result"] == result_clean for item in items):
+            items.append({"marker": canonical, "result": result_clean})
+    return items
+
+
+def _post_gene(field: Field, records: List[dict]) -> List[Dict[str, str]]:
+    muts = []
+    for r in records:
+        raw_gene = r["gene"].upper()
+        muts.append({"gene": field.aliases.get(raw_gene, raw_gene), "value": r["value"].strip()})
+    return muts
+
+
+def _post_lab_value(field: Field, records: List[dict]) -> List[Dict[str, object]]:
+    values = []
+    for r in records:
+        item_name = r["item"].strip()
+        value = r["value"].strip()
+        unit = r["unit"].strip() if r.get("unit") else ""
+        ref_low, ref_high = r.get("ref_low"), r.get("ref_high")
+        item = {"item": item_name, "value": value, "unit": unit}
+        if ref_low and ref_high:
+            item["reference_range"] = f"{ref_low}-{ref_high}"
+            try:
+                item["abnormal"] = float(value) < float(ref_low) or float(value) > float(ref_high)
+            except ValueError:
+                item["abnormal"] = None
+        else:
+            item["abnormal"] = None
+        # 避免重复添加
+        if not any(v["item"] == item_name and v["value"] == value for v in values):
+            values.append(item)
+    return values
+
+
+POSTPROCESSORS = {
+    "ihc_marker": _post_ihc_marker,
+    "gene": _post_gene,
+    "lab_value": _post_lab_value,
+}
+# 各后处理读取的命名组（必需）
+POSTPROCESS_GROUPS = {
+    "ihc_marker": ("marker", "result"),
+    "gene": ("gene", "value"),
+    "lab_value": ("item", "value"),
+}
+
+
+class GroupSet:
+    """按检验项目名归类的分组字段"""
+
+    def __init__(self, report_type: str, spec: dict):
+        _expect(spec, dict, f"{report_type}.groups")
+        self.source = _expect(spec.get("source", "all_values"), str, f"{report_type}.groups.source")
+        self.exclusive = bool(spec.get("exclusive", False))
+        self.names: List[str] = []
+        self.modes: List[str] = []
+        self.patterns: List["re.Pattern"] = []
+        for name, group in _expect(spec.get("fields", {}), dict, f"{report_type}.groups.fields").items():
+            _expect(group, dict, f"{report_type} 分组 {name}")
+            mode = group.get("mode", "list")
+            if mode not in GROUP_MODES:
+                raise RuleError(f"{report_type} 分组 {name} 的 mode 无效: {mode}（可选: {', '.join(GROUP_MODES)}）")
+            aliases = [str(a).upper() for a in _expect(group.get("aliases", []), list, f"{report_type} 分组 {name} 的 aliases")]
+            if not aliases:
+                raise RuleError(f"{report_type} 分组 {name} 没有 aliases")
+            self.names.append(name)
+            self.modes.append(mode)
+            self.patterns.append(re.compile("|".join(re.escape(a) for a in aliases)))
+        self._cache: Dict[str, Tuple[int, ...]] = {}
+
+    def classify(self, item_name: str) -> Tuple[int, ...]:
+        """项目名命中的分组编号（同一项目名只计算一次）"""
+        groups = self._cache.get(item_name)
+        if groups is None:
+            upper = item_name.upper()
+            groups = tuple(i for i, p in enumerate(self.patterns) if p.search(upper))
+            if self.exclusive:
+                groups = groups[:1]
+            if len(self._cache) >= CLASSIFY_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[item_name] = groups
+        return groups
+
+    def apply(self, values: List[dict]) -> Dict[str, object]:
+        filled: List[object] = [None if mode == "first" else [] for mode in self.modes]
+        for item in values:
+            for i in self.classify(item["item"]):
+                if self.modes[i] == "list":
+                    filled[i].append(item)
+                elif filled[i] is None:
+                    filled[i] = item
+        return {name: (value if value else None) for name, value in zip(self.names, filled)}
+
+
+class CompiledRuleset:
+    """编译后的规则集（不可变，热加载时整体替换）"""
+
+    def __init__(self, spec: dict, version: str = "", path: str = ""):
+        if not isinstance(spec, dict) or not isinstance(spec.get("report_types"), dict):
+            raise RuleError("规则集缺少 report_types")
+        started = time.perf_counter()
+        self.version = version
+        self.path = path
+        shared = _expect(spec.get("shared_fields", {}), dict, "shared_fields")
+        self.report_types: List[str] = list(spec["report_types"])
+        self.fields: Dict[str, List[Field]] = {}
+        self.groups: Dict[str, Optional[GroupSet]] = {}
+        self.keywords: Dict[str, Tuple[str, ...]] = {}
+        self.sections: Dict[str, Tuple[str, ...]] = {}
+        for report_type, type_spec in spec["report_types"].items():
+            _expect(type_spec, dict, f"report_types.{report_type}")
+            fields = []
+            for name, field_spec in _expect(type_spec.get("fields", {}), dict, f"{report_type}.fields").items():
+                if isinstance(field_spec, str):
+                    if field_spec not in shared:
+                        raise RuleError(f"{report_type}.{name} 引用了不存在的共用字段: {field_spec}")
+                    field_spec = shared[field_spec]
+                fields.append(Field(name, field_spec))
+            self.fields[report_type] = fields
+            self.groups[report_type] = GroupSet(report_type, type_spec["groups"]) if type_spec.get("groups") else None
+            self.keywords[report_type] = tuple(dict.fromkeys(
+                str(k).lower() for k in _expect(type_spec.get("keywords", []), list, f"{report_type}.keywords")
+            ))
+            self.sections[report_type] = tuple(dict.fromkeys(
+                str(k).lower() for k in _expect(type_spec.get("sections", []), list, f"{report_type}.sections")
+            ))
+        # 节标题关键词合并成一个正则（长的在前），关键词重复时归属靠前的报告类型
+        self._section_types: Dict[str, str] = {}
+        for report_type, titles in self.sections.items():
+            for keyword in titles:
+                self._section_types.setdefault(keyword, report_type)
+        self._section_regex = re.compile("|".join(
+            re.escape(k) for k in sorted(self._section_types, key=len, reverse=True)
+        )) if self._section_types else None
+        self.compile_ms = (time.perf_counter() - started) * 1000
+        self.loaded_at = time.time()
+
+    def field(self, report_type: str, name: str) -> Field:
+        for field in self.fields.get(report_type, ()):
+            if field.name == name:
+                return field
+        raise KeyError(f"{report_type} 没有字段 {name}")
+
+    def extract(
+        self, report_type: str, text: str, fields: Optional[Sequence[str]] = None, folded: Optional[str] = None
+    ) -> Dict[str, object]:
+        """抽取报告类型的全部（或指定）字段，分组字段在前（folded 为调用方已算好的 text.lower()）"""
+        if report_type not in self.fields:
+            raise KeyError(f"未知的报告类型: {report_type}（可选: {', '.join(self.report_types)}）")
+        text = text or ""
+        selected = self.fields[report_type] if fields is None else [self.field(report_type, name) for name in fields]
+        if folded is None:
+            folded = text.lower()
+        values = {field.name: field.extract(text, folded) for field in selected}
+        groups = self.groups[report_type]
+        if groups is None or groups.source not in values:
+            return values
+        return {**groups.apply(values[groups.source]), **values}
+
+    def detect(self, text: str, folded: Optional[str] = None) -> str:
+        """按关键词命中个数识别报告类型，都未命中时为 unknown（得分相同时取规则集中靠前的类型）"""
+        if folded is None:
+            folded = (text or "").lower()
+        scores = {t: sum(1 for kw in keywords if kw in folded) for t, keywords in self.keywords.items()}
+        best = max(scores.items(), key=lambda x: x[1], default=("unknown", 0))
+        return best[0] if best[1] > 0 else "unknown"
+
+    def section_type(self, folded_line: str) -> Optional[str]:
+        """标题行对应的报告类型（标题中最先出现的关键词决定），不是标题形式的行或标题不含关键词时为None"""
+        if self._section_regex is None:
+            return None
+        title = section_title(folded_line)
+        if title is None:
+            return None
+        m = self._section_regex.search(title)
+        if m is None:
+            return None
+        return self._section_types[m.group(0)]
+
+    def route(self, text: str) -> List[Dict[str, object]]:
+        """
+        把（已标准化的）报告按节标题分节，确定每节交给哪种报告类型抽取
+
+        Returns:
+            [{"title": 标题行或None, "report_type": 类型或None, "start_line": 起始行号, "lines": 原文行, "folded": 小写行}]
+        """
+        lines = text.split("\n")
+        folded = text.lower()
+        folded_lines = folded.split("\n")
+        sections = []
+        current = None
+        for i, (line, folded_line) in enumerate(zip(lines, folded_lines)):
+            report_type = self.section_type(folded_line)
+            if report_type is not None or current is None:
+                current = {
+                    "title": section_title(line) if report_type is not None else None,
+                    "report_type": report_type,
+                    "start_line": i + 1,
+                    "lines": [],
+                    "folded": [],
+                }
+                sections.append(current)
+            current["lines"].append(line)
+            current["folded"].append(folded_line)
+        # 第一个标题之前的内容（患者信息、标本等）交给第一节的类型；没有标题时按全文关键词识别
+        if sections and sections[0]["report_type"] is None:
+            if len(sections) > 1:
+                sections[0]["report_type"] = sections[1]["report_type"]
+            else:
+                detected = self.detect(text, folded)
+                sections[0]["report_type"] = detected if detected != "unknown" else None
+        return sections
+
+    def extract_report(self, text: str) -> Dict[str, object]:
+        """
+        一次调用抽取多类型报告：标准化一次、分节，每种报告类型只抽取路由给它的节
+
+        Returns:
+            {"report_types": 出现的类型（按首次出现顺序）, "sections": 分节摘要, "results": {类型: 字段}}
+        """
+        sections = self.route(normalize_report(text or ""))
+        routed: Dict[str, Tuple[List[str], List[str]]] = {}
+        for section in sections:
+            if section["report_type"] is not None:
+                lines, folded = routed.setdefault(section["report_type"], ([], []))
+                lines.extend(section["lines"])
+                folded.extend(section["folded"])
+        results = {
+            report_type: self.extract(report_type, "\n".join(lines), folded="\n".join(folded))
+            for report_type, (lines, folded) in routed.items()
+        }
+        return {
+            "report_types": list(routed),
+            "sections": [
+                {
+                    "title": s["title"],
+                    "report_type": s["report_type"] or "unknown",
+                    "start_line": s["start_line"],
+                    "line_count": len(s["lines"]),
+                }
+                for s in sections
+            ],
+            "results": results,
+        }
+
+    def info(self) -> Dict[str, object]:
+        return {
+            "version": self.version,
+            "path": self.path,
+            "report_types": {t: [f.name for f in self.fields[t]] for t in self.report_types},
+            "compile_ms": round(self.compile_ms, 2),
+            "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.loaded_at)),
+        }
+
+
+def _stat(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def load_ruleset(path: str = RULES_PATH) -> CompiledRuleset:
+    """读取并编译规则文件，版本为文件内容的SHA-1前12位"""
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        spec = json.loads(data.decode("utf-8"))
+    except ValueError as e:
+        raise RuleError(f"规则文件不是有效的JSON: {e}") from e
+    return CompiledRuleset(spec, version=hashlib.sha1(data).hexdigest()[:12], path=os.path.abspath(path))
+
+
+_ruleset = None
+_ruleset_stat = None
+_ruleset_error = None
+_last_check = 0.0
+_ruleset_lock = threading.Lock()
+
+
+def reload_ruleset(force: bool = False, path: str = RULES_PATH) -> Dict[str, object]:
+    """
+    规则文件变化（或 force）时重新编译并替换当前规则集
+
+    Returns:
+        {"reloaded": 是否替换, "version": 当前版本, "previous_version": 之前的版本, "error": 编译错误}
+    """
+    global _ruleset, _ruleset_stat, _ruleset_error, _last_check
+    with _ruleset_lock:
+        _last_check = time.monotonic()
+        previous = _ruleset
+        stat = _stat(path)
+        if previous is not None and not force and stat == _ruleset_stat:
+            return {"reloaded": False, "version": previous.version, "previous_version": previous.version, "error": _ruleset_error}
+        try:
+            ruleset = load_ruleset(path)
+        except Exception as e:
+            # 结构检查之外的编译失败（包括意料之外的异常）同样保留旧规则
+            if previous is None:
+                raise
+            # 新规则有错误：继续使用旧规则，同一份错误文件不再重复编译
+            _ruleset_stat = stat
+            _ruleset_error = f"{type(e).__name__}: {e}"
+            log.error("规则集编译失败，继续使用旧规则", version=previous.version, error=_ruleset_error)
+            return {"reloaded": False, "version": previous.version, "previous_version": previous.version, "error": _ruleset_error}
+        _ruleset, _ruleset_stat, _ruleset_error = ruleset, stat, None
+        log.info(
+            "规则集已加载", version=ruleset.version,
+            previous=previous.version if previous else None, compile_ms=round(ruleset.compile_ms, 2)
+        )
+        return {
+            "reloaded": True,
+            "version": ruleset.version,
+            "previous_version": previous.version if previous else None,
+            "error": None,
+        }
+
+
+def get_ruleset() -> CompiledRuleset:
+    """当前规则集（按间隔检查规则文件是否变化，变化时重新编译）"""
+    if _ruleset is None:
+        reload_ruleset()
+    elif RULES_CHECK_INTERVAL > 0 and time.monotonic() - _last_check >= RULES_CHECK_INTERVAL:
+        try:
+            reload_ruleset()
+        except OSError as e:
+            log.warning("无法读取规则文件，继续使用当前规则", path=RULES_PATH, error=str(e))
+    return _ruleset
+
+
+def ruleset_error() -> Optional[str]:
+    """最近一次热加载的编译错误（成功加载后清空）"""
+    return _ruleset_error
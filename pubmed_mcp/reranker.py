@@ -0,0 +1,120 @@
+"""
+Semantic re-ranking for PubMed search results.
+
+Embeds the query and each candidate's title+abstract with a small local CPU
+sentence encoder and orders candidates by cosine similarity. Document
+embeddings are cached by PMID so repeated/overlapping searches only encode
+articles that have not been seen before.
+
+Optional dependency: sentence-transformers (pip install sentence-transformers).
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+HAS_SENTENCE_TRANSFORMERS = False
+try:
+    from sentence_transformers import SentenceTransformer
+    HAS_SENTENCE_TRANSFORMERS = True
+except ImportError:
+    pass
+
+RERANK_MODEL_NAME = os.getenv("PUBMED_RERANK_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+RERANK_CACHE_SIZE = int(os.getenv("PUBMED_RERANK_CACHE_SIZE", "5000"))
+RERANK_BATCH_SIZE = 32
+
+
+class SemanticReranker:
+    """Sentence-embedding re-ranker with a PMID-keyed LRU embedding cache."""
+
+    def __init__(self, model_name: str = RERANK_MODEL_NAME, cache_size: int = RERANK_CACHE_SIZE):
+        if not HAS_SENTENCE_TRANSFORMERS:
+            raise RuntimeError("sentence-transformers is not installed: pip install sentence-transformers")
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=RERANK_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype(np.float32)
+
+    def _cached_embeddings(self, docs: Dict[str, str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        missing: List[str] = []
+        with self._lock:
+            for pmid in docs:
+                vec = self._cache.get(pmid)
+                if vec is None:
+                    missing.append(pmid)
+                else:
+                    self._cache.move_to_end(pmid)
+                    found[pmid] = vec
+            self.cache_hits += len(found)
+            self.cache_misses += len(missing)
+
+        if missing:
+            # one batched forward pass for every uncached document
+            vecs = self._encode([docs[pmid] for pmid in missing])
+            with self._lock:
+                for pmid, vec in zip(missing, vecs):
+                    found[pmid] = vec
+                    self._cache[pmid] = vec
+                    self._cache.move_to_end(pmid)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return found
+
+    def rank(self, query: str, docs: Dict[str, str]) -> List[Tuple[str, float]]:
+        """
+        Rank documents against the query.
+
+        docs: pmid -> "title. abstract" text
+        Returns (pmid, cosine similarity) pairs, most similar first.
+        """
+        if not docs:
+            return []
+        query_vec = self._encode([query])[0]
+        embeddings = self._cached_embeddings(docs)
+        pmids = list(docs)
+        matrix = np.stack([embeddings[pmid] for pmid in pmids])
+        scores = matrix @ query_vec
+        order = np.argsort(-scores, kind="stable")
+        return [(pmids[i], float(scores[i])) for i in order]
+
+
+_reranker: Optional[SemanticReranker] = None
+_reranker_lock = threading.Lock()
+
+
+def get_reranker() -> SemanticReranker:
+    """Return the process-wide re-ranker (loaded on first use)."""
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                _reranker = SemanticReranker()
+    return _reranker
+
+
+def cache_stats() -> Tuple[int, int]:
+    """(hits, misses) of the embedding cache; zeros until the re-ranker is loaded."""
+    if _reranker is None:
+        return 0, 0
+    return _reranker.cache_hits, _reranker.cache_misses
+
+
+def document_text(title: Optional[str], abstract: Optional[str]) -> str:
+    """Text that is embedded for one article."""
+    parts = [p.strip() for p in (title, abstract) if p and p.strip()]
+    return ". ".join(parts)
@@ -1,26 +1,40 @@
 """
 PubMed Search MCP
 - search_pubmed: query PubMed (defaults to Case Reports) and return structured metadata/abstracts.
+  Optional semantic re-ranking (rerank=true) with a local CPU sentence encoder, see reranker.py.
 
 Usage:
   pip install -r requirements.txt
   NCBI_API_KEY=<optional> python server.py
 
 Transport: SSE on 0.0.0.0:18920
+Metrics: GET /metrics (Prometheus text) or the get_server_stats tool; logging via MCP_LOG_LEVEL / MCP_LOG_FORMAT.
 """
 import json
 import os
+import sys
 import xml.etree.ElementTree as ET
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import requests
 from fastmcp import FastMCP
 
+from reranker import cache_stats as rerank_cache_stats, document_text, get_reranker
+
+# shared instrumentation lives in <repo>/mcp_common
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp_common import get_logger, install_metrics, register_cache, timed  # noqa: E402
+
 
 mcp = FastMCP(name="PubMed Search MCP")
-BASE_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"
+install_metrics(mcp, "pubmed")
+log = get_logger("pubmed")
+# PUBMED_EUTILS_URL points at a local stand-in for load tests (loadtest/mock_eutils.py)
+BASE_URL = os.getenv("PUBMED_EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils").rstrip("/")
 API_KEY = os.getenv("NCBI_API_KEY")
 USER_AGENT = "nexent-mcp-pubmed/0.1 (contact@example.com)"
+# rerank=True fetches max_results * RERANK_OVERFETCH candidates (still capped at 50)
+RERANK_OVERFETCH = int(os.getenv("PUBMED_RERANK_OVERFETCH", "3"))
 
 
 def _clamp_retmax(value: int) -> int:
@@ -33,6 +47,10 @@ def _add_api_key(params: Dict[str, str]) -> Dict[str, str]:
     return params
 
 
+register_cache("rerank_embeddings", rerank_cache_stats)
+
+
+@timed("esearch")
 def _esearch(term: str, max_results: int, days_back: int, sort: str) -> List[str]:
     params = _add_api_key(
         {
@@ -50,6 +68,7 @@ def _esearch(term: str, max_results: int, days_back: int, sort: str) -> List[str
     return data.get("esearchresult", {}).get("idlist", [])
 
 
+@timed("esummary")
 def _esummary(pmids: List[str]) -> Dict[str, Dict]:
     params = _add_api_key(
         {
@@ -64,6 +83,7 @@ def _esummary(pmids: List[str]) -> Dict[str, Dict]:
     return data.get("result", {})
 
 
+@timed("efetch")
 def _efetch_abstracts(pmids: List[str]) -> Dict[str, str]:
     if not pmids:
         return {}
@@ -101,7 +121,25 @@ def _build_term(query: str, pubtype: Optional[str], humans_only: bool) -> str:
     return " AND ".join(parts)
 
 
-@mcp.tool(name="search_pubmed", description="搜索 PubMed（默认 Case Reports），返回文献元数据+摘要（可选）")
+@timed("rerank")
+def _rerank(
+    query: str, ids: List[str], meta: Dict[str, Dict], abstracts: Dict[str, str]
+) -> Tuple[List[str], Dict[str, float], Optional[str]]:
+    """Order PMIDs by semantic similarity; falls back to NCBI order (and returns the error) if the encoder is unavailable."""
+    docs = {pmid: document_text(meta.get(pmid, {}).get("title"), abstracts.get(pmid)) for pmid in ids}
+    docs = {pmid: text for pmid, text in docs.items() if text}
+    try:
+        ranked = get_reranker().rank(query, docs)
+    except Exception as exc:  # noqa: BLE001
+        log.warning("rerank unavailable, keeping NCBI order", error=str(exc))
+        return ids, {}, f"{type(exc).__name__}: {exc}"
+    scores = dict(ranked)
+    # articles without any text keep their relative order after the scored ones
+    ordered = [pmid for pmid, _ in ranked] + [pmid for pmid in ids if pmid not in scores]
+    return ordered, scores, None
+
+
+@mcp.tool(name="search_pubmed", description="搜索 PubMed（默认 Case Reports），返回文献元数据+摘要（可选），rerank=true 时按语义相关度重排")
 def search_pubmed(
     query: str,
     max_results: int = 10,
@@ -110,6 +148,7 @@ def search_pubmed(
     sort: str = "date",
     include_abstract: bool = True,
     humans_only: bool = True,
+    rerank: bool = False,
 ) -> str:
     """
     查询参数:
@@ -120,11 +159,14 @@ def search_pubmed(
       sort: date/relevance
       include_abstract: 是否附带摘要（默认开启）
       humans_only: 是否限定人类研究
+      rerank: 是否按语义相似度重排（多取候选，本地编码 标题+摘要 后取 Top-N）
     """
     term = _build_term(query, pubtype, humans_only)
+    fetch_n = max_results * RERANK_OVERFETCH if rerank else max_results
     try:
-        ids = _esearch(term, max_results, days_back, sort)
+        ids = _esearch(term, fetch_n, days_back, sort)
     except Exception as exc:  # noqa: BLE001
+        log.error("esearch failed", error=str(exc))
         return json.dumps({"error": f"esearch failed: {exc}"}, ensure_ascii=False)
 
     if not ids:
@@ -133,16 +175,24 @@ def search_pubmed(
     try:
         meta = _esummary(ids)
     except Exception as exc:  # noqa: BLE001
+        log.error("esummary failed", error=str(exc))
         return json.dumps({"error": f"esummary failed: {exc}"}, ensure_ascii=False)
 
     abstracts = {}
-    if include_abstract:
+    if include_abstract or rerank:
         try:
             abstracts = _efetch_abstracts(ids)
         except Exception as exc:  # noqa: BLE001
+            log.warning("efetch failed", error=str(exc))
             abstracts = {}
             meta["abstract_error"] = str(exc)
 
+    scores: Dict[str, float] = {}
+    rerank_error: Optional[str] = None
+    if rerank:
+        ids, scores, rerank_error = _rerank(query, ids, meta, abstracts)
+    ids = ids[:_clamp_retmax(max_results)]
+
     results = []
     for pmid in ids:
         rec = meta.get(pmid, {})
@@ -159,7 +209,15 @@ def search_pubmed(
         }
         if include_abstract:
             item["abstract"] = abstract
+        if rerank:
+            # lets the caller tell a semantic ordering from the NCBI fallback
+            item["reranked"] = rerank_error is None
+            if rerank_error:
+                item["rerank_error"] = rerank_error
+        if pmid in scores:
+            item["rerank_score"] = round(scores[pmid], 4)
         results.append(item)
+    log.debug("search_pubmed", term=term, returned=len(results), rerank=rerank)
     return json.dumps(results, ensure_ascii=False)
 
 